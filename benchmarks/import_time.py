@@ -0,0 +1,113 @@
+"""Import time of the JHub Apps service, i.e. the startup cost of each uvicorn worker.
+
+Runs `python -X importtime -c "import jhub_apps.service.app"` a few times in a
+fresh interpreter, reports the median total and the slowest imports of the
+median run, and fails when:
+
+- the total is over STARTUP_IMPORT_BUDGET_MS, the budget for importing the
+  service in a worker, measured on a developer laptop with a warm disk cache,
+- one of LAZY_MODULES got imported, these must only be imported on first use.
+
+Run with: python benchmarks/import_time.py [--runs N] [--top N]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+STARTUP_IMPORT_BUDGET_MS = 800
+
+# Heavy modules which the service only needs for some requests
+LAZY_MODULES = [
+    "git",  # creating apps from git repositories
+    "conda_project",  # idem
+    "jupyterhub.app",  # executing jupyterhub_config.py when there is no config snapshot
+    "slugify",  # callable KubeSpawner.profile_list
+    "unittest.mock",  # idem
+]
+
+SERVICE_ENVIRONMENT = {
+    "PUBLIC_HOST": "http://127.0.0.1:8000",
+    "JUPYTERHUB_CLIENT_ID": "service-japps",
+}
+
+CHECK_LAZY_MODULES = (
+    "import sys, jhub_apps.service.app; "
+    "print('imported:' + ','.join(m for m in {modules!r} if m in sys.modules))"
+)
+
+
+def _run_importtime():
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import jhub_apps.service.app"],
+        env={**os.environ, **SERVICE_ENVIRONMENT},
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    # "import time: self [us] | cumulative | imported package"
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        # nested imports are indented under the module importing them
+        imports.append((name[1:].rstrip(), int(self_us), int(cumulative_us)))
+    return imports
+
+
+def imported_lazy_modules():
+    result = subprocess.run(
+        [sys.executable, "-c", CHECK_LAZY_MODULES.format(modules=LAZY_MODULES)],
+        env={**os.environ, **SERVICE_ENVIRONMENT},
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    # the service logs to stdout while being imported
+    line = [line for line in result.stdout.splitlines() if line.startswith("imported:")][-1]
+    return [module for module in line[len("imported:"):].split(",") if module]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    runs = []
+    for _ in range(args.runs):
+        imports = _run_importtime()
+        total_ms = sum(self_us for _, self_us, _ in imports) / 1000
+        runs.append((total_ms, imports))
+    runs.sort(key=lambda run: run[0])
+    total_ms, imports = runs[len(runs) // 2]
+
+    print(f"Import time of jhub_apps.service.app: {total_ms:.0f}ms "
+          f"(median of {args.runs}, min {runs[0][0]:.0f}ms, max {runs[-1][0]:.0f}ms, "
+          f"stdev {statistics.pstdev(run[0] for run in runs):.0f}ms)")
+    print("\nSlowest imports made while importing the service (cumulative):")
+    # modules indented by one level are imported directly by jhub_apps.service.app
+    direct = [(name.strip(), cumulative) for name, _, cumulative in imports if name.startswith("  ")
+              and not name.startswith("    ")]
+    for name, cumulative_us in sorted(direct, key=lambda item: -item[1])[:args.top]:
+        print(f"  {cumulative_us / 1000:8.1f}ms  {name}")
+    print("\nSlowest modules (self):")
+    for name, self_us, _ in sorted(imports, key=lambda item: -item[1])[:args.top]:
+        print(f"  {self_us / 1000:8.1f}ms  {name.strip()}")
+
+    failures = []
+    if total_ms > STARTUP_IMPORT_BUDGET_MS:
+        failures.append(f"over the budget of {STARTUP_IMPORT_BUDGET_MS}ms")
+    lazy_modules = imported_lazy_modules()
+    if lazy_modules:
+        failures.append(f"modules to import on first use were imported: {', '.join(lazy_modules)}")
+    if failures:
+        print("\nFAILED: " + "; ".join(failures))
+        sys.exit(1)
+    print(f"\nOK: within the budget of {STARTUP_IMPORT_BUDGET_MS}ms")
+
+
+if __name__ == "__main__":
+    main()
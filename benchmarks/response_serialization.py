@@ -0,0 +1,84 @@
+"""Serialization time and wire bytes of the `GET /server/` response.
+
+Builds responses of 50, 500 and 5000 apps shaped like the Hub server models
+(user_options with env, thumbnail url and placeholder), and compares:
+
+- serialization: FastAPI's default (jsonable_encoder + json.dumps) with
+  jhub_apps.service.responses.dump_json (orjson when installed),
+- wire bytes: identity, gzip and brotli (when installed), at the levels used
+  by jhub_apps.service.compression.
+
+Run with: python benchmarks/response_serialization.py
+"""
+import json
+import timeit
+
+from fastapi.encoders import jsonable_encoder
+
+from jhub_apps.service import compression
+from jhub_apps.service.responses import dump_json, orjson
+
+SIZES = [50, 500, 5000]
+
+
+def server(i):
+    return {
+        "name": f"app-{i}",
+        "full_name": f"user-{i % 50}/app-{i}",
+        "last_activity": "2024-05-01T10:00:00.000000Z",
+        "started": "2024-05-01T09:00:00.000000Z",
+        "pending": None,
+        "ready": i % 3 == 0,
+        "stopped": i % 3 != 0,
+        "url": f"/user/user-{i % 50}/app-{i}/",
+        "user_options": {
+            "jhub_app": True,
+            "display_name": f"App {i}",
+            "description": "A dashboard of the quarterly numbers, refreshed every hour.",
+            "thumbnail": f"/services/japps/thumbnails/{i:064x}",
+            "thumbnail_placeholder": "data:image/webp;base64," + "UklGRkAAAABXRUJQVlA4IDQAAADQAQCdASoQAAgAAUAmJaQAA3AA" * 2,
+            "filepath": "app.py",
+            "framework": ["panel", "streamlit", "gradio", "voila"][i % 4],
+            "custom_command": "",
+            "public": False,
+            "keep_alive": False,
+            "env": {"DATABASE_URL": "postgresql://db:5432/app", "LOG_LEVEL": "info"},
+            "repository": None,
+            "conda_env": "analytics",
+            "profile": "small",
+            "share_with": {"users": [f"user-{(i + 1) % 50}"], "groups": ["analysts"]},
+        },
+        "progress_url": f"/hub/api/users/user-{i % 50}/servers/app-{i}/progress",
+        "state": {"pod_name": f"jupyter-user-{i % 50}--app-{i}"},
+    }
+
+
+def default_serialization(content):
+    return json.dumps(
+        jsonable_encoder(content), ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")
+    ).encode("utf-8")
+
+
+def best_of(func, repeat=5):
+    return min(timeit.repeat(func, number=1, repeat=repeat)) * 1000
+
+
+def main():
+    print(f"orjson: {'installed' if orjson is not None else 'not installed'}, "
+          f"brotli: {'installed' if 'br' in compression.ENCODERS else 'not installed'}\n")
+    print(f"{'apps':>5} {'default (ms)':>13} {'dump_json (ms)':>15} {'identity':>10} "
+          + " ".join(f"{encoding:>10}" for encoding in compression.ENCODERS))
+    for size in SIZES:
+        content = {
+            "shared_apps": [server(i) for i in range(size // 5)],
+            "user_apps": [server(i) for i in range(size - size // 5)],
+        }
+        body = dump_json(content)
+        sizes = [len(encoder().compress(body, finish=True)) for encoder in compression.ENCODERS.values()]
+        print(f"{size:>5} {best_of(lambda: default_serialization(content)):>13.2f} "
+              f"{best_of(lambda: dump_json(content)):>15.2f} {len(body):>10} "
+              + " ".join(f"{compressed:>10}" for compressed in sizes))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""Microbenchmark of filtering users/groups a user can share apps with, by scopes.
+
+Compares the previous implementation, which checked jupyterhub.scopes.has_scope
+for each entity, with jhub_apps.hub_client.hub_client.ScopeResolver.
+
+Run with: python benchmarks/scope_filter.py (requires jupyterhub>=5)
+"""
+import timeit
+
+from jhub_apps.hub_client.hub_client import filter_entity_based_on_scopes
+
+SIZES = [1_000, 10_000, 50_000]
+
+
+def filter_entity_based_on_scopes_has_scope(scopes, entities, entity_key="user"):
+    from jupyterhub.scopes import has_scope, expand_scopes
+    allowed_entities_to_read = set()
+    expanded_scopes = expand_scopes(scopes)
+    for entity in entities:
+        if has_scope(f'read:{entity_key}s:name!{entity_key}={entity}', expanded_scopes):
+            allowed_entities_to_read.add(entity)
+    return list(allowed_entities_to_read)
+
+
+def scenarios(size):
+    users = [f"user-{i}" for i in range(size)]
+    return {
+        "unfiltered": ["read:users:name"],
+        "100 user filters": [f"read:users:name!user=user-{i}" for i in range(0, size, size // 100)],
+        "no permission": ["read:groups:name"],
+    }, users
+
+
+def best_of(func, repeat=3):
+    return min(timeit.repeat(func, number=1, repeat=repeat))
+
+
+def main():
+    print(f"{'entities':>9} {'scopes':<18} {'has_scope (ms)':>15} {'resolver (ms)':>14} {'speedup':>8}")
+    for size in SIZES:
+        scope_scenarios, users = scenarios(size)
+        for name, scopes in scope_scenarios.items():
+            expected = set(filter_entity_based_on_scopes_has_scope(scopes, users))
+            assert set(filter_entity_based_on_scopes(scopes, users)) == expected
+            before = best_of(lambda: filter_entity_based_on_scopes_has_scope(scopes, users))
+            after = best_of(lambda: filter_entity_based_on_scopes(scopes, users))
+            print(
+                f"{size:>9} {name:<18} {before * 1000:>15.2f} {after * 1000:>14.2f} "
+                f"{before / after:>7.0f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""Snapshot of the part of the JupyterHub config read by the JHub Apps service.
+
+Written by `install_jhub_apps` in the JupyterHub process, so that the service
+can load it instead of executing the whole JupyterHub config file (which
+imports JupyterHub, the authenticator and the spawner).
+"""
+import hashlib
+import json
+import os
+import typing
+from datetime import datetime, timezone
+
+import structlog
+from pydantic import BaseModel
+from traitlets.config import Config, LazyConfigValue
+
+logger = structlog.get_logger(__name__)
+
+# Bumped whenever the layout of the snapshot changes
+SNAPSHOT_FORMAT_VERSION = 1
+
+# Config read by the service, besides JAppsConfig
+SNAPSHOT_CONFIG = {
+    "KubeSpawner": ["profile_list"],
+    "JupyterHub": ["template_vars"],
+}
+
+
+def _file_digest(path: str) -> typing.Optional[str]:
+    try:
+        with open(path, "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except OSError:
+        return None
+
+
+def _jsonable(value):
+    if isinstance(value, BaseModel):
+        return value.model_dump(mode="json")
+    if isinstance(value, (list, tuple)):
+        return [_jsonable(item) for item in value]
+    if isinstance(value, dict):
+        return {key: _jsonable(item) for key, item in value.items()}
+    return value
+
+
+def _jhub_apps_version() -> typing.Optional[str]:
+    from jhub_apps.version import get_version
+    try:
+        return str(get_version())
+    except Exception:
+        return None
+
+
+def write_config_snapshot(c, japps_config, path: str):
+    """Writes the config read by the service as json to `path`.
+
+    Values which can't be serialized (e.g. callables) are listed in the snapshot
+    instead, the service then executes the config file as before.
+    """
+    config = {"JAppsConfig": {}}
+    unserializable = []
+    values = [
+        ("JAppsConfig", trait_name, getattr(japps_config, trait_name))
+        for trait_name in japps_config.class_trait_names(config=True)
+    ]
+    for section, trait_names in SNAPSHOT_CONFIG.items():
+        for trait_name in trait_names:
+            value = getattr(c[section], trait_name) if section in c else LazyConfigValue()
+            if not isinstance(value, LazyConfigValue):
+                values.append((section, trait_name, value))
+    for section, trait_name, value in values:
+        try:
+            value = _jsonable(value)
+            json.dumps(value)
+        except (TypeError, ValueError):
+            unserializable.append(f"{section}.{trait_name}")
+            continue
+        config.setdefault(section, {})[trait_name] = value
+    snapshot = {
+        "format_version": SNAPSHOT_FORMAT_VERSION,
+        "jhub_apps_version": _jhub_apps_version(),
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "jupyterhub_config_digest": _file_digest(japps_config.jupyterhub_config_path),
+        "unserializable": unserializable,
+        "config": config,
+    }
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(snapshot, f)
+    # atomic, the service never reads a partially written snapshot
+    os.replace(tmp_path, path)
+    logger.info("Wrote JHub Apps config snapshot", path=path, unserializable=unserializable)
+
+
+def load_config_snapshot(path: str, jupyterhub_config_path: str) -> typing.Optional[Config]:
+    """Returns the config from the snapshot, or None if the JupyterHub config file
+    has to be executed: no usable snapshot, the config file changed since the
+    snapshot was written or some of its values couldn't be serialized.
+    """
+    try:
+        with open(path) as f:
+            snapshot = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.info("No usable config snapshot", path=path, error=str(e))
+        return None
+    if snapshot.get("format_version") != SNAPSHOT_FORMAT_VERSION:
+        reason = "format version"
+    elif snapshot.get("jhub_apps_version") != _jhub_apps_version():
+        reason = "jhub-apps version"
+    elif snapshot.get("jupyterhub_config_digest") != _file_digest(jupyterhub_config_path):
+        reason = "JupyterHub config file changed"
+    elif snapshot.get("unserializable"):
+        reason = f"unserializable values: {snapshot['unserializable']}"
+    else:
+        return Config(snapshot["config"])
+    logger.info("Not using config snapshot", path=path, reason=reason)
+    return None
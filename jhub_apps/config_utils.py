@@ -1,7 +1,7 @@
 import textwrap
 import typing as t
 from pydantic import BaseModel, ValidationError
-from traitlets import Unicode, Union, List, Callable, Integer, TraitType, TraitError
+from traitlets import Bool, Unicode, Union, List, Callable, Integer, Tuple, TraitType, TraitError
 
 from traitlets.config import SingletonConfigurable, Enum
 
@@ -102,6 +102,64 @@ class JAppsConfig(SingletonConfigurable):
         help="Path to JupyterHub config file.",
     ).tag(config=True)
 
+    config_snapshot = Bool(
+        False,
+        help="""
+        Write the configuration read by the JHub Apps service to a json file when installing
+        JHub Apps, for the service to load instead of executing jupyterhub_config_path.
+        JAppsConfig, KubeSpawner.profile_list and JupyterHub.template_vars must then be set
+        before calling install_jhub_apps.
+        """,
+    ).tag(config=True)
+
+    config_snapshot_path = Unicode(
+        "jhub-apps-config-snapshot.json",
+        help="Path of the configuration snapshot (see config_snapshot)",
+    ).tag(config=True)
+
+    thumbnail_store_path = Unicode(
+        "jhub-apps-thumbnails",
+        help="""
+        Directory where the JHub Apps service stores the thumbnails of the apps, which are
+        served by the service instead of being stored in the servers' user_options.
+        """,
+    ).tag(config=True)
+
+    thumbnail_size = Tuple(
+        Integer(),
+        Integer(),
+        default_value=(640, 360),
+        help="""
+        (width, height) in pixels that uploaded thumbnails are downscaled to fit in,
+        twice the size of the app cards for high resolution screens.
+        """,
+    ).tag(config=True)
+
+    thumbnail_format = Enum(
+        ["webp", "jpeg"],
+        default_value="webp",
+        help="Image format uploaded thumbnails are re-encoded to.",
+    ).tag(config=True)
+
+    thumbnail_workers = Integer(
+        2,
+        help="Number of threads resizing and re-encoding uploaded thumbnails, per service worker.",
+    ).tag(config=True)
+
+    response_compression = List(
+        trait=Unicode(),
+        default_value=["br", "gzip"],
+        help="""
+        Encodings the JHub Apps service compresses its responses with, in order of preference,
+        when the browser accepts them. "br" requires the brotli package. Empty to disable.
+        """,
+    ).tag(config=True)
+
+    response_compression_minimum_size = Integer(
+        1024,
+        help="Responses of the JHub Apps service smaller than this many bytes are not compressed.",
+    ).tag(config=True)
+
     hub_host = Unicode(
         "127.0.0.1",
         help="Hub Host name, in k8s environment it would be the container name, e.g. 'hub'",
@@ -112,6 +170,64 @@ class JAppsConfig(SingletonConfigurable):
         help="The number of workers to create for the JHub Apps FastAPI service",
     ).tag(config=True)
 
+    hub_http2 = Bool(
+        False,
+        help="""
+        Use HTTP/2 for the connection pool the JHub Apps service keeps to the JupyterHub API.
+        Requires the 'h2' package (pip install 'httpx[http2]'), falls back to HTTP/1.1 otherwise.
+        """,
+    ).tag(config=True)
+
+    user_cache_ttl = Integer(
+        30,
+        help="""
+        Seconds for which the JHub Apps service caches the JupyterHub user model of an
+        authenticated user, instead of asking JupyterHub on every API call. 0 disables the cache.
+        """,
+    ).tag(config=True)
+
+    user_cache_max_entries = Integer(
+        1024,
+        help="Maximum number of users the JHub Apps service keeps in its authenticated users cache (per worker)",
+    ).tag(config=True)
+
+    share_concurrency = Integer(
+        10,
+        help="Maximum number of concurrent requests to JupyterHub API while sharing an app with users and groups",
+    ).tag(config=True)
+
+    batch_concurrency = Integer(
+        10,
+        help="Maximum number of concurrent requests to JupyterHub API while running a batch of server operations",
+    ).tag(config=True)
+
+    cache_backend = Enum(
+        ["memory", "sqlite"],
+        default_value="memory",
+        help="""
+        Where the JHub Apps service workers cache users and share permissions: "memory" gives
+        each worker its own cache, "sqlite" shares them between the workers through a SQLite file.
+        """,
+    ).tag(config=True)
+
+    cache_path = Unicode(
+        "jhub-apps-cache.sqlite",
+        help="Path of the SQLite file shared by the JHub Apps service workers, when cache_backend is sqlite",
+    ).tag(config=True)
+
+    hub_state_mirror = Bool(
+        False,
+        help="""
+        Keep an in-memory snapshot of all the servers in JupyterHub in each JHub Apps service
+        worker, refreshed in the background, and serve the servers listings from it.
+        """,
+    ).tag(config=True)
+
+    hub_state_mirror_interval = Integer(
+        30,
+        help="Seconds between two refreshes of the JupyterHub servers snapshot (see hub_state_mirror)",
+    ).tag(config=True)
+
     allowed_frameworks = List(
         None,
         help="Allow only a specific set of frameworks to spun up apps.",
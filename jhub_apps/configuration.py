@@ -5,6 +5,7 @@ from secrets import token_bytes
 from traitlets.config import LazyConfigValue
 
 from jhub_apps import JAppsConfig
+from jhub_apps.config_snapshot import write_config_snapshot
 from jhub_apps.hub_client.utils import is_jupyterhub_5
 from jhub_apps.spawner.spawner_creation import subclass_spawner
 
@@ -46,6 +47,15 @@ def install_jhub_apps(c, spawner_to_subclass, *, oauth_no_confirm=False):
     set_defaults_for_jhub_apps_config(c)
     if not isinstance(bind_url, str):
         raise ValueError(f"c.JupyterHub.bind_url is not set: {c.JupyterHub.bind_url}")
+    config_environment = {}
+    if japps_config.config_snapshot:
+        config_snapshot_path = os.path.abspath(japps_config.config_snapshot_path)
+        write_config_snapshot(c, japps_config, config_snapshot_path)
+        config_environment["JHUB_APPS_CONFIG_SNAPSHOT"] = config_snapshot_path
+    # The Hub pages of jhub-apps (home, not running) load the UI bundles with their version
+    from jhub_apps.service.static_files import get_ui_assets_version
+    template_vars = c.JupyterHub.template_vars if isinstance(c.JupyterHub.template_vars, dict) else {}
+    c.JupyterHub.template_vars = {**template_vars, "version_hash": get_ui_assets_version()}
     if not c.JupyterHub.services:
         c.JupyterHub.services = []
     public_host = c.JupyterHub.bind_url
@@ -71,7 +81,23 @@ def install_jhub_apps(c, spawner_to_subclass, *, oauth_no_confirm=False):
                     "JHUB_APP_TITLE": japps_config.app_title,
                     "JHUB_APP_ICON": japps_config.app_icon,
                     "JHUB_JUPYTERHUB_CONFIG": japps_config.jupyterhub_config_path,
+                    **config_environment,
                     "JHUB_APP_JWT_SECRET_KEY": _create_token_for_service(),
+                    "JHUB_APPS_HUB_HTTP2": str(japps_config.hub_http2).lower(),
+                    "JHUB_APPS_SHARE_CONCURRENCY": str(japps_config.share_concurrency),
+                    "JHUB_APPS_BATCH_CONCURRENCY": str(japps_config.batch_concurrency),
+                    "JHUB_APPS_USER_CACHE_TTL": str(japps_config.user_cache_ttl),
+                    "JHUB_APPS_USER_CACHE_MAX_ENTRIES": str(japps_config.user_cache_max_entries),
+                    "JHUB_APPS_HUB_STATE_MIRROR": str(japps_config.hub_state_mirror).lower(),
+                    "JHUB_APPS_HUB_STATE_MIRROR_INTERVAL": str(japps_config.hub_state_mirror_interval),
+                    "JHUB_APPS_CACHE_BACKEND": japps_config.cache_backend,
+                    "JHUB_APPS_CACHE_PATH": os.path.abspath(japps_config.cache_path),
+                    "JHUB_APPS_THUMBNAIL_STORE_PATH": os.path.abspath(japps_config.thumbnail_store_path),
+                    "JHUB_APPS_THUMBNAIL_SIZE": "x".join(str(side) for side in japps_config.thumbnail_size),
+                    "JHUB_APPS_THUMBNAIL_FORMAT": japps_config.thumbnail_format,
+                    "JHUB_APPS_THUMBNAIL_WORKERS": str(japps_config.thumbnail_workers),
+                    "JHUB_APPS_RESPONSE_COMPRESSION": ",".join(japps_config.response_compression),
+                    "JHUB_APPS_RESPONSE_COMPRESSION_MINIMUM_SIZE": str(japps_config.response_compression_minimum_size),
 
                     # Temp environment variables for Nebari Deployment
                     "PROXY_API_SERVICE_PORT": "*",
@@ -91,6 +117,8 @@ def install_jhub_apps(c, spawner_to_subclass, *, oauth_no_confirm=False):
                 "environment": {
                     "PUBLIC_HOST": c.JupyterHub.bind_url,
                     "JHUB_JUPYTERHUB_CONFIG": japps_config.jupyterhub_config_path,
+                    **config_environment,
+                    "JHUB_APPS_SHARE_CONCURRENCY": str(japps_config.share_concurrency),
 
                     # Temp environment variables for Nebari Deployment
                     "PROXY_API_SERVICE_PORT": "*",
@@ -121,6 +149,7 @@ def install_jhub_apps(c, spawner_to_subclass, *, oauth_no_confirm=False):
                 # declare what permissions the service should have
                 "list:users",  # list users
                 "list:groups",  # list groups
+                "read:groups",  # read group members, to resolve read:users:name!group=... scopes
                 "read:users:activity",  # read user last-activity
                 "read:users",  # read user last-activity
                 "admin:servers",  # start/stop servers
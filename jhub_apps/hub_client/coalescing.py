@@ -0,0 +1,106 @@
+import asyncio
+import contextvars
+import typing
+import weakref
+
+import httpx
+import structlog
+
+logger = structlog.get_logger(__name__)
+
+# Responses of the Hub GET requests made while serving the current API request,
+# set by the service middleware, None outside of an API request.
+_request_memo: contextvars.ContextVar[typing.Optional[dict]] = contextvars.ContextVar(
+    "hub_request_memo", default=None
+)
+
+
+def start_request_memo() -> contextvars.Token:
+    """Starts memoizing Hub GET responses for the current API request."""
+    return _request_memo.set({})
+
+
+def end_request_memo(token: contextvars.Token):
+    _request_memo.reset(token)
+
+
+def invalidate_request_memo():
+    """Forgets the memoized responses, called after any change made to the Hub state."""
+    memo = _request_memo.get()
+    if memo:
+        memo.clear()
+
+
+class SingleFlight:
+    """Coalesces concurrent identical Hub GET requests into one in-flight request.
+
+    Callers share the ``httpx.Response`` (not the parsed body), so that each
+    of them can parse it into its own objects.
+    """
+
+    def __init__(self):
+        self._in_flight: typing.Dict[tuple, asyncio.Future] = {}
+        self.calls = 0
+        self.coalesced = 0
+        self.memo_hits = 0
+
+    def stats(self) -> dict:
+        requested = self.calls + self.coalesced + self.memo_hits
+        return {
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+            "memo_hits": self.memo_hits,
+            "in_flight": len(self._in_flight),
+            # number of callers served per request actually sent to the Hub
+            "fan_in_ratio": round(requested / self.calls, 2) if self.calls else None,
+        }
+
+    async def get(
+            self,
+            client: httpx.AsyncClient,
+            url: str,
+            params: typing.Optional[dict] = None,
+            headers: typing.Optional[dict] = None,
+    ) -> httpx.Response:
+        key = _request_key(url, params, headers)
+        memo = _request_memo.get()
+        if memo is not None and key in memo:
+            self.memo_hits += 1
+            return memo[key]
+        future = self._in_flight.get(key)
+        if future is not None:
+            self.coalesced += 1
+        else:
+            self.calls += 1
+            future = asyncio.ensure_future(client.get(url, params=params, headers=headers))
+            self._in_flight[key] = future
+            future.add_done_callback(lambda f: self._in_flight.pop(key, None))
+        # A cancelled caller must not cancel the request the other callers are waiting on
+        response = await asyncio.shield(future)
+        if memo is not None and response.status_code < 500:
+            memo[key] = response
+        return response
+
+
+def _request_key(url, params, headers) -> tuple:
+    headers = headers or {}
+    return (
+        url,
+        tuple(sorted((k, str(v)) for k, v in (params or {}).items())),
+        # different tokens can see different things
+        headers.get("Authorization"),
+        headers.get("Accept"),
+    )
+
+
+_single_flights: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, SingleFlight]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def get_single_flight() -> SingleFlight:
+    loop = asyncio.get_running_loop()
+    single_flight = _single_flights.get(loop)
+    if single_flight is None:
+        single_flight = _single_flights[loop] = SingleFlight()
+    return single_flight
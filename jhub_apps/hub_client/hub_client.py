@@ -1,42 +1,61 @@
+import asyncio
+import inspect
 import typing
-from concurrent.futures import ThreadPoolExecutor
 from functools import wraps
 
+import httpx
 import structlog
 import os
 import re
+import time
 import uuid
 
-import requests
-
 from jhub_apps.service.models import UserOptions, SharePermissions
-from jhub_apps.hub_client.utils import is_jupyterhub_5
+from jhub_apps.hub_client.coalescing import get_single_flight, invalidate_request_memo
+from jhub_apps.hub_client.state_mirror import get_hub_state_mirror
+from jhub_apps.hub_client.token_pool import close_user_token_pool, get_user_token_pool
+from jhub_apps.hub_client.transport import close_hub_http_client, get_hub_http_client
+from jhub_apps.hub_client.utils import is_jupyterhub_5, json_loads
+from jhub_apps.service.cache import Cache
 from jhub_apps.spawner.types import Framework
 
-API_URL = os.environ.get("JUPYTERHUB_API_URL")
 JUPYTERHUB_API_TOKEN = os.environ.get("JUPYTERHUB_API_TOKEN")
 
-# Default timeout for requests to JupyterHub API (seconds)
-# Can be overridden with JUPYTERHUB_REQUEST_TIMEOUT env variable
-DEFAULT_REQUEST_TIMEOUT = int(os.environ.get("JUPYTERHUB_REQUEST_TIMEOUT", "30"))
+# JupyterHub caps the page size to JupyterHub.api_page_max_limit (200 by default)
+HUB_API_PAGE_SIZE = 200
+# Number of pages requested concurrently while iterating over users/groups
+HUB_API_PAGE_CONCURRENCY = 4
+PAGINATION_MEDIA_TYPE = "application/jupyterhub-pagination+json"
+# Maximum number of concurrent share/revoke requests while sharing an app
+SHARE_CONCURRENCY = int(os.environ.get("JHUB_APPS_SHARE_CONCURRENCY", "10"))
+# Seconds for which the users and groups a user can share with are cached
+SHARE_PERMISSIONS_CACHE_TTL = int(os.environ.get("JHUB_APPS_SHARE_PERMISSIONS_CACHE_TTL", "300"))
 
 logger = structlog.get_logger(__name__)
 
 
 def requires_user_token(func):
-    """Decorator to apply to methods of HubClient to create user token before
-    the method call and revoke them after the method call finishes.
+    """Decorator to apply to methods of HubClient to lease a user token from the
+    worker's token pool for the duration of the method call.
+
+    Nested calls (e.g. start_server -> get_server) and concurrent requests for
+    the same user share the same token, tokens are revoked by the pool in the
+    background once they are close to expiring.
     """
     @wraps(func)
-    def wrapper(self, *args, **kwargs):
-        response_json = self._create_token_for_user()
-        token_id = response_json["id"]
+    async def wrapper(self, *args, **kwargs):
+        token_pool = get_user_token_pool()
+        assert self.username
+        lease = await token_pool.acquire(self.username)
+        self.token_json = lease.token_json
+        self.tokens.append(lease.token)
         try:
-            original_method_return = func(self, *args, **kwargs)
+            original_method_return = await func(self, *args, **kwargs)
         except Exception as e:
             raise e
         finally:
-            self._revoke_token(token_id=token_id)
+            self.tokens.remove(lease.token)
+            token_pool.release(lease)
         return original_method_return
     return wrapper
 
@@ -53,101 +72,187 @@ class HubClient:
         contextvars = structlog.contextvars.get_contextvars()
         self.jhub_apps_request_id = contextvars.get("request_id")
 
+    @property
+    def _http(self) -> httpx.AsyncClient:
+        # Shared keep-alive client, so that calls to the Hub reuse connections
+        return get_hub_http_client()
+
+    async def _get(self, url, params=None, headers=None) -> httpx.Response:
+        """GET request to the Hub API, concurrent identical requests are coalesced into
+        one and responses are memoized for the duration of the current API request.
+        """
+        return await get_single_flight().get(self._http, url, params=params, headers=headers)
+
+    async def _request(self, method, url, **kwargs) -> httpx.Response:
+        """Request changing the Hub state, GET responses memoized so far are dropped."""
+        try:
+            return await self._http.request(method, url, **kwargs)
+        finally:
+            invalidate_request_memo()
+
     def _headers(self, token=None):
         header_token = token
         if not token and self.tokens:
             header_token = self.tokens[-1]
 
-        return {
-            "Authorization": f"token {token or header_token}",
-            "JHUB_APPS_REQUEST_ID": self.jhub_apps_request_id
-        }
+        headers = {"Authorization": f"token {token or header_token}"}
+        if self.jhub_apps_request_id:
+            headers["JHUB_APPS_REQUEST_ID"] = self.jhub_apps_request_id
+        return headers
 
-    def _create_token_for_user(self):
-        assert self.username
-        logger.info("Creating token for user", username=self.username)
-        r = requests.post(
-            API_URL + f"/users/{self.username}/tokens",
-            headers=self._headers(token=JUPYTERHUB_API_TOKEN),
-            json={
-                # Expire in 5 minutes max
-                "expires_in": 60*5
-            },
-            timeout=DEFAULT_REQUEST_TIMEOUT
-        )
-        r.raise_for_status()
-        rjson = r.json()
-        # This is so that when a new token is created, it doesn't overrides a previously created token,
-        # which is still in use by the previous function in stack
-        # for e.g. When func_a calls func_b and both have the decorator "requires_user_token"
-        # The func_a on completing execution will only clear the token, which the decorator
-        # requires_user_token created for it, not the token created for func_a
-        self.token_json = rjson
-        self.tokens.append(rjson["token"])
-        logger.info(f"Created token: {rjson['id']}")
-        return rjson
-
-    def _revoke_token(self, token_id):
-        assert self.username
-        assert token_id
-        logger.debug(f"Revoking token: {token_id}")
-        r = requests.delete(
-            API_URL + f"/users/{self.username}/tokens/{token_id}",
-            headers=self._headers(token=JUPYTERHUB_API_TOKEN),
-            timeout=DEFAULT_REQUEST_TIMEOUT
-        )
-        r.raise_for_status()
-        logger.debug(
-            "Token revoked",
-            status_code=r.status_code,
-            username=self.username
-        )
-        self.tokens.pop()
-        return r
+    async def _iter_paginated(
+            self,
+            url: str,
+            params: typing.Optional[dict] = None,
+            page_size: int = HUB_API_PAGE_SIZE,
+            concurrency: int = HUB_API_PAGE_CONCURRENCY,
+            token: typing.Optional[str] = None,
+    ) -> typing.AsyncIterator[dict]:
+        """Yields the items of a paginated Hub API listing, page by page.
+
+        The first page tells the total, the remaining pages are then fetched
+        `concurrency` at a time, so at most that many pages are held in memory.
+        Uses the japps app token, unless another `token` is given.
+        """
+        headers = {**self._headers(token=token or self.tokens[0]), "Accept": PAGINATION_MEDIA_TYPE}
+
+        async def fetch_page(offset, limit):
+            r = await self._get(
+                url, params={**(params or {}), "offset": offset, "limit": limit}, headers=headers
+            )
+            r.raise_for_status()
+            return json_loads(r.content)
+
+        page = await fetch_page(0, page_size)
+        if isinstance(page, list):
+            # Hub doesn't support pagination, the whole listing came at once
+            for item in page:
+                yield item
+            return
+        pagination = page["_pagination"]
+        for item in page["items"]:
+            yield item
+        if not pagination.get("next"):
+            return
+        # The Hub might return smaller pages than requested
+        limit = pagination["limit"]
+        offsets = list(range(pagination["offset"] + limit, pagination["total"], limit))
+        del page
+        for i in range(0, len(offsets), concurrency):
+            pages = await asyncio.gather(
+                *(fetch_page(offset, limit) for offset in offsets[i:i + concurrency])
+            )
+            for page in pages:
+                for item in page["items"]:
+                    yield item
+            del pages
+
+    def iter_users(
+            self,
+            state: typing.Optional[str] = None,
+            include_stopped_servers: bool = True,
+            page_size: int = HUB_API_PAGE_SIZE,
+            concurrency: int = HUB_API_PAGE_CONCURRENCY,
+    ) -> typing.AsyncIterator[dict]:
+        """Streams all the users in JupyterHub, page by page.
+
+        :param state: only users with servers in the given state: "active", "inactive" or "ready"
+        """
+        params = {"include_stopped_servers": include_stopped_servers}
+        if state:
+            params["state"] = state
+        return self._iter_paginated("/users", params, page_size=page_size, concurrency=concurrency)
 
-    def get_users(self) -> typing.List[dict]:
-        r = requests.get(
-            API_URL + "/users",
-            params={"include_stopped_servers": True},
-            # We explicitly want to use japps app token for this
-            headers=self._headers(token=self.tokens[0]),
-            timeout=DEFAULT_REQUEST_TIMEOUT
-        )
-        r.raise_for_status()
-        users = r.json()
-        return users
+    def iter_groups(
+            self,
+            page_size: int = HUB_API_PAGE_SIZE,
+            concurrency: int = HUB_API_PAGE_CONCURRENCY,
+    ) -> typing.AsyncIterator[dict]:
+        """Streams all the groups in JupyterHub, page by page."""
+        return self._iter_paginated("/groups", page_size=page_size, concurrency=concurrency)
+
+    async def get_users(self) -> typing.List[dict]:
+        return [user async for user in self.iter_users()]
 
     @requires_user_token
-    def get_user(self, user=None):
-        r = requests.get(
-            API_URL + f"/users/{user or self.username}",
+    async def get_user(self, user=None):
+        r = await self._get(
+            f"/users/{user or self.username}",
             params={"include_stopped_servers": True},
             headers=self._headers(),
-            timeout=DEFAULT_REQUEST_TIMEOUT
         )
         r.raise_for_status()
         user = r.json()
         return user
 
-    @requires_user_token
-    def get_server(self, username, servername=None) -> typing.Optional[typing.Union[dict, typing.Iterable[dict]]]:
+    async def get_user_servers(self, username, fresh=False) -> typing.Optional[typing.Dict[str, dict]]:
+        """Returns the servers of the given user (including stopped ones) or None if
+        the user doesn't exist.
+
+        Served from the Hub state mirror when it is running and knows the user,
+        unless `fresh` is set, which is meant for reads made before changing servers:
+        the Hub is then asked again, without sharing an in-flight or memoized response.
+        """
+        mirror = get_hub_state_mirror()
+        if fresh:
+            servers = await self.fetch_user_servers(username)
+        else:
+            if mirror is not None:
+                servers = mirror.get_user_servers(username)
+                if servers is not None:
+                    return servers
+            r = await self._get(
+                f"/users/{username}",
+                params={"include_stopped_servers": True},
+                # We explicitly want to use japps app token for this, to look up servers of other users
+                headers=self._headers(token=self.tokens[0]),
+            )
+            servers = self._servers_from_response(r)
+        if mirror is not None and mirror.ready:
+            # user created after the last sync of the mirror
+            mirror.set_user_servers(username, servers)
+        return servers
+
+    async def fetch_user_servers(self, username) -> typing.Optional[typing.Dict[str, dict]]:
+        """Like get_user_servers, but always asks the Hub, without sharing an in-flight request."""
+        r = await self._http.get(
+            f"/users/{username}",
+            params={"include_stopped_servers": True},
+            headers=self._headers(token=self.tokens[0]),
+        )
+        return self._servers_from_response(r)
+
+    @staticmethod
+    def _servers_from_response(r: httpx.Response) -> typing.Optional[typing.Dict[str, dict]]:
+        if r.status_code == 404:
+            return None
+        r.raise_for_status()
+        # Only the servers map is needed, the rest of the user model is dropped right away
+        return json_loads(r.content).get("servers") or {}
+
+    async def _servers_changed(self, username, started=False):
+        """Brings the Hub state mirror up to date after changing the servers of a user."""
+        mirror = get_hub_state_mirror()
+        if mirror is not None:
+            await mirror.refresh_user(username)
+            if started:
+                # the server is still pending at this point
+                mirror.refresh_user_later(username)
+
+    async def get_server(
+            self, username, servername=None, fresh=False
+    ) -> typing.Optional[typing.Union[dict, typing.Iterable[dict]]]:
         """Returns the given server for the given user or all servers if servername is None"""
-        users = self.get_users()
-        filter_given_user = [user for user in users if user["name"] == username]
-        if not filter_given_user:
+        user_servers = await self.get_user_servers(username, fresh=fresh)
+        if user_servers is None:
             logger.info(f"No user with username: {username} found.")
             return
-        else:
-            assert len(filter_given_user) == 1
-            given_user = filter_given_user[0]
-                
-        if servername: 
-            for name, server in given_user["servers"].items():
-                if name == servername:
-                    return server
+
+        if servername:
+            return user_servers.get(servername)
         else:
             # return all user servers
-            return given_user["servers"]
+            return user_servers
 
     @staticmethod
     def normalize_server_name(servername):
@@ -161,7 +266,8 @@ class HubClient:
         return text[:240]
 
     @requires_user_token
-    def start_server(self, username, servername):
+    async def start_server(self, username, servername, server=None):
+        """Start a server of the user, the server model can be given if already fetched."""
         server_owner = username
         if not servername:
             logger.info("Starting JupyterLab server")
@@ -170,20 +276,23 @@ class HubClient:
             user_options = {}
         else:
             # Get named server
-            server = self.get_server(username, servername)
+            if server is None:
+                server = await self.get_server(username, servername, fresh=True)
             if not server:
                 return None
             user_options = server["user_options"]
         url = f"/users/{server_owner}/servers/{servername}"
         data = {"name": servername, **user_options}
-        response = requests.post(API_URL + url, headers=self._headers(), json=data, timeout=DEFAULT_REQUEST_TIMEOUT)
+        response = await self._request("POST", url, headers=self._headers(), json=data)
         logger.info("Start server response", status_code=response.status_code, servername=servername)
+        if response.is_success:
+            await self._servers_changed(server_owner, started=True)
         return response
 
     @requires_user_token
-    def create_server(self, username: str, servername: str, user_options: UserOptions = None) -> tuple[int, str]:
+    async def create_server(self, username: str, servername: str, user_options: UserOptions = None) -> tuple[int, str]:
         logger.info("Creating new server", user=username)
-        user_servers = self.get_server(username)
+        user_servers = await self.get_server(username, fresh=True)
         normalized_servername = self.normalize_server_name(servername)
         logger.info("User servers", user_servers=user_servers.keys())
         # If server with the given name already exists
@@ -195,32 +304,32 @@ class HubClient:
         else:
             unique_servername = normalized_servername
         logger.info("Normalized servername", servername=servername)
-        return self._create_server(username, unique_servername, user_options)
+        return await self._create_server(username, unique_servername, user_options)
 
     @requires_user_token
-    def edit_server(self, username: str, servername: str, user_options: UserOptions = None) -> tuple[int, str]:
+    async def edit_server(self, username: str, servername: str, user_options: UserOptions = None) -> tuple[int, str]:
         logger.info("Editing server", server_name=servername)
-        server = self.get_server(username, servername)
+        server = await self.get_server(username, servername, fresh=True)
         if server:
             # Stop the server first
             logger.info("Stopping the server first", server_name=servername)
-            self.delete_server(username, server["name"])
+            await self.delete_server(username, server["name"])
         else:
             raise ValueError("Server does not exists")
         logger.info("Now creating the server with new params", server_name=servername)
-        return self._create_server(username, servername, user_options)
+        return await self._create_server(username, servername, user_options)
 
-    def _create_server(self, username: str, servername: str, user_options: UserOptions = None) -> tuple[int, str]:
+    async def _create_server(self, username: str, servername: str, user_options: UserOptions = None) -> tuple[int, str]:
         url = f"/users/{username}/servers/{servername}"
         params = user_options.model_dump()
         data = {"name": servername, **params}
         logger.info("Creating new server", server_name=servername)
-        r = requests.post(API_URL + url, headers=self._headers(), json=data, timeout=DEFAULT_REQUEST_TIMEOUT)
+        r = await self._request("POST", url, headers=self._headers(), json=data)
         r.raise_for_status()
         if user_options.framework != Framework.jupyterlab.value:
             if is_jupyterhub_5():
                 logger.info("Sharing", share_with=user_options.share_with)
-                self._share_server_with_multiple_entities(
+                await self._share_server_with_multiple_entities(
                     username,
                     servername,
                     share_with=user_options.share_with
@@ -230,14 +339,16 @@ class HubClient:
         else:
             logger.info(f"Not sharing the server as Framework is {user_options.framework}, "
                         f"sharing JupyterLab servers is not allowed.")
+        await self._servers_changed(username)
         return r.status_code, servername
 
-    def _share_server(
+    async def _share_server(
             self,
             username: str,
             servername: str,
             share_to_user: typing.Optional[str],
             share_to_group: typing.Optional[str],
+            revoke: bool = False,
     ):
         url = f"/shares/{username}/{servername}"
         if share_to_user:
@@ -247,26 +358,40 @@ class HubClient:
         else:
             raise ValueError("None of share_to_user or share_to_group provided")
         share_with = share_to_group or share_to_user
+        if revoke:
+            # PATCH without scopes revokes all the permissions of the given user/group
+            logger.info(f"Revoking share of {username}/{servername} with {share_with}")
+            return await self._request("PATCH", url, headers=self._headers(), json=data)
         logger.info(f"Sharing {username}/{servername} with {share_with}")
-        return requests.post(
-            API_URL + url,
+        return await self._request(
+            "POST",
+            url,
             headers=self._headers(),
             json=data,
-            timeout=DEFAULT_REQUEST_TIMEOUT
         )
 
-    def _share_server_with_multiple_entities(
+    async def get_server_shares(self, username: str, servername: str) -> typing.Dict[str, typing.Set[str]]:
+        """Returns the users and groups a server is currently shared with."""
+        current = {"user": set(), "group": set()}
+        async for share in self._iter_paginated(f"/shares/{username}/{servername}"):
+            for kind in current:
+                if share.get(kind):
+                    current[kind].add(share[kind]["name"])
+        return current
+
+    async def _share_server_with_multiple_entities(
             self,
             username: str,
             servername: str,
             share_with: typing.Optional[SharePermissions] = None
     ):
-        """
+        """Applies the difference between the current shares of the server and `share_with`.
+
         :param username: owner of the servername
         :param servername: servername to share
-        :param share_to_users: list of users to share the server with
-        :param share_to_groups: list of groups to share the server with
-        :return: mapping of dict of users + group to corresponding response json from Hub API
+        :param share_with: users and groups the server should be shared with
+        :return: list of per user/group results with the action taken, Hub API
+            status code and duration of the call in seconds
         """
         if not share_with:
             logger.info("Neither of share_to_user or share_to_group provided, NOT sharing")
@@ -275,35 +400,52 @@ class HubClient:
             f"Requested to share {username}/{servername}",
             share_to_users=share_with.users, share_to_groups=share_with.groups
         )
-        users = share_with.users or []
-        groups = share_with.groups or []
-        share_to_user_args = [(username, servername, user, None,) for user in users]
-        share_to_group_args = [(username, servername, None, group,) for group in groups]
-        executor_arguments = share_to_user_args + share_to_group_args
-        # Remove any previously shared access, this is useful when editing apps
-        self._revoke_shared_access(username, servername)
+        desired = {"user": set(share_with.users or []), "group": set(share_with.groups or [])}
+        current = await self.get_server_shares(username, servername)
+        changes = []
+        for kind in ("user", "group"):
+            changes += [(kind, name, False) for name in sorted(desired[kind] - current[kind])]
+            changes += [(kind, name, True) for name in sorted(current[kind] - desired[kind])]
         # NOTE: JupyterHub 5.x doesn't provide a way for bulk sharing, as in share with a
-        # set of groups and users. Since we don't have a task queue in jhub-apps at the moment,
-        # we're using multithreading to call JupyterHub API to share the app with multiple users/groups
-        # to remove any visible lag in the API request to create server.
-        with ThreadPoolExecutor(max_workers=10) as ex:
-            logger.info(f"Share executor arguments: {executor_arguments}")
-            response_results = list(ex.map(lambda p: self._share_server(*p), executor_arguments))
-
-        user_and_groups = users + groups
-        response_results_json = [resp.json() for resp in response_results]
-        user_group_and_response_map = dict(zip(user_and_groups, response_results_json))
-        logger.info("Sharing response", response=user_group_and_response_map)
-        return user_group_and_response_map
-
-    def _revoke_shared_access(self, username: str, servername: str):
-        """Revoke all shared access to a given server"""
-        logger.info("Revoking shared servers access", user=username, servername=servername)
-        url = f"/shares/{username}/{servername}"
-        return requests.delete(API_URL + url, headers=self._headers(), timeout=DEFAULT_REQUEST_TIMEOUT)
+        # set of groups and users. Only the changed shares are sent, concurrently, but at
+        # most SHARE_CONCURRENCY at a time to not flood the Hub when sharing with large groups of users.
+        semaphore = asyncio.Semaphore(SHARE_CONCURRENCY)
+
+        async def apply_change(kind, name, revoke):
+            async with semaphore:
+                start = time.perf_counter()
+                response = await self._share_server(
+                    username,
+                    servername,
+                    share_to_user=name if kind == "user" else None,
+                    share_to_group=name if kind == "group" else None,
+                    revoke=revoke,
+                )
+                return {
+                    kind: name,
+                    "action": "revoke" if revoke else "share",
+                    "status_code": response.status_code,
+                    "duration": round(time.perf_counter() - start, 4),
+                }
+
+        results = await asyncio.gather(*(apply_change(*change) for change in changes))
+        unchanged = [
+            {kind: name, "action": "unchanged"}
+            for kind in ("user", "group")
+            for name in sorted(desired[kind] & current[kind])
+        ]
+        results = list(results) + unchanged
+        logger.info(
+            "Sharing response",
+            shared=sum(r["action"] == "share" for r in results),
+            revoked=sum(r["action"] == "revoke" for r in results),
+            unchanged=len(unchanged),
+            response=results,
+        )
+        return results
 
     @requires_user_token
-    def get_shared_servers(self, username: str = None):
+    async def get_shared_servers(self, username: str = None):
         """List servers shared with user"""
         username = username or self.username
         if not is_jupyterhub_5():
@@ -311,66 +453,162 @@ class HubClient:
             return []
         logger.info("Getting shared servers", user=username)
         url = f"/users/{username}/shared"
-        response = requests.get(API_URL + url, headers=self._headers(), timeout=DEFAULT_REQUEST_TIMEOUT)
-        rjson = response.json()
-        shared_servers = rjson["items"]
-        return shared_servers
+        return [
+            shared_server
+            async for shared_server in self._iter_paginated(url, token=self.tokens[-1])
+        ]
 
     @requires_user_token
-    def delete_server(self, username, server_name, remove=False) -> int:
+    async def delete_server(self, username, server_name, remove=False) -> int:
         if server_name is None:
             # Default server and not named server
             server_name = ""
         url = f"/users/{username}/servers/{server_name}"
         # This will remove it from the database, otherwise it will just stop the server
         params = {"remove": remove}
-        r = requests.delete(API_URL + url, headers=self._headers(), json=params, timeout=DEFAULT_REQUEST_TIMEOUT)
+        r = await self._request("DELETE", url, headers=self._headers(), json=params)
         r.raise_for_status()
+        await self._servers_changed(username)
         return r.status_code
 
     @requires_user_token
-    def get_services(self):
-        r = requests.get(API_URL + "/services", headers=self._headers(), timeout=DEFAULT_REQUEST_TIMEOUT)
+    async def get_services(self):
+        r = await self._get("/services", headers=self._headers())
         r.raise_for_status()
         return r.json()
 
-    def get_groups(self):
+    async def get_groups(self):
         """Returns all the groups in JupyterHub"""
-        r = requests.get(API_URL + "/groups", headers=self._headers(), timeout=DEFAULT_REQUEST_TIMEOUT)
-        r.raise_for_status()
-        return r.json()
+        return [group async for group in self.iter_groups()]
 
     @requires_user_token
-    def get_user_scopes(self):
+    async def get_user_scopes(self):
         assert self.token_json
         assert "scopes" in self.token_json
         return self.token_json["scopes"]
 
 
-def get_users_and_group_allowed_to_share_with(user):
+class SyncHubClient:
+    """Thin blocking facade over HubClient for scripts and tests without an event loop.
+
+    Every coroutine method of HubClient is run to completion in its own event loop,
+    the token pool and the shared http client of that loop are closed once the call returns.
+    """
+
+    def __init__(self, username=None):
+        self._hub_client = HubClient(username=username)
+
+    def __getattr__(self, name):
+        attribute = getattr(self._hub_client, name)
+        if not inspect.iscoroutinefunction(attribute):
+            return attribute
+
+        @wraps(attribute)
+        def wrapper(*args, **kwargs):
+            async def run():
+                try:
+                    return await attribute(*args, **kwargs)
+                finally:
+                    await close_user_token_pool()
+                    await close_hub_http_client()
+            return asyncio.run(run())
+        return wrapper
+
+
+_share_permissions_cache = Cache("share_permissions", ttl=SHARE_PERMISSIONS_CACHE_TTL)
+
+
+async def get_share_permissions(user):
+    """Cached get_users_and_group_allowed_to_share_with.
+
+    The cached permissions are only used for the groups and scopes of the user
+    they were computed for, so that a change in group membership or roles is
+    picked up right away, new users and groups in the hub are picked up after
+    SHARE_PERMISSIONS_CACHE_TTL.
+    """
+    computed_for = [sorted(user.groups or []), sorted(user.scopes)]
+    cached = _share_permissions_cache.get(user.name)
+    if cached is not None and cached["computed_for"] == computed_for:
+        return cached["share_permissions"]
+    share_permissions = await get_users_and_group_allowed_to_share_with(user)
+    _share_permissions_cache.set(
+        user.name, {"computed_for": computed_for, "share_permissions": share_permissions}
+    )
+    return share_permissions
+
+
+async def get_users_and_group_allowed_to_share_with(user):
     """Returns a list of users and groups"""
     hclient = HubClient(username=user.name)
-    users = hclient.get_users()
-    user_names = [u["name"] for u in users if u["name"] != user.name]
-    groups = hclient.get_groups()
-    group_names = [group['name'] for group in groups]
-    user_scopes = hclient.get_user_scopes()
+    user_scopes = await hclient.get_user_scopes()
+    users_resolver = ScopeResolver(user_scopes, entity_key="user")
+    groups_resolver = ScopeResolver(user_scopes, entity_key="group")
+    # Members of groups are only needed to resolve group filtered user scopes
+    # e.g. read:users:name!group=x
+    group_members = {}
+
+    async def get_user_names():
+        # Only names are kept, so user models are dropped page by page
+        return [
+            u["name"] async for u in hclient.iter_users(include_stopped_servers=False)
+            if u["name"] != user.name
+        ]
+
+    async def get_group_names():
+        group_names = []
+        async for group in hclient.iter_groups():
+            group_names.append(group["name"])
+            if group["name"] in users_resolver.allowed_groups:
+                group_members[group["name"]] = group.get("users", [])
+        return group_names
+
+    # Both listings use the japps service token, so they can run concurrently
+    user_names, group_names = await asyncio.gather(get_user_names(), get_group_names())
     return {
-        "users": filter_entity_based_on_scopes(
-            scopes=user_scopes, entities=user_names
-        ),
-        "groups": filter_entity_based_on_scopes(
-            scopes=user_scopes, entities=group_names, entity_key="group"
-        )
+        "users": users_resolver.filter(user_names, group_members=group_members),
+        "groups": groups_resolver.filter(group_names),
     }
 
 
-def filter_entity_based_on_scopes(scopes, entities, entity_key="user"):
-    # only available in JupyterHub>=5
-    from jupyterhub.scopes import has_scope, expand_scopes
-    allowed_entities_to_read = set()
-    expanded_scopes = expand_scopes(scopes)
-    for entity in entities:
-        if has_scope(f'read:{entity_key}s:name!{entity_key}={entity}', expanded_scopes):
-            allowed_entities_to_read.add(entity)
-    return list(allowed_entities_to_read)
+class ScopeResolver:
+    """Resolves which users or groups can be read by name with the given scopes.
+
+    The scopes are expanded and parsed once, entities are then filtered with set
+    operations instead of checking a scope for each one of them, see
+    benchmarks/scope_filter.py for the comparison with jupyterhub.scopes.has_scope.
+    """
+
+    def __init__(self, scopes, entity_key="user"):
+        # only available in JupyterHub>=5
+        from jupyterhub.scopes import expand_scopes
+        self.entity_key = entity_key
+        self.allow_all = False
+        self.allowed_entities = set()
+        self.allowed_groups = set()
+        scope_name = f"read:{entity_key}s:name"
+        for scope in expand_scopes(scopes):
+            if scope == scope_name:
+                self.allow_all = True
+            elif scope.startswith(f"{scope_name}!"):
+                filter_kind, _, filter_value = scope[len(scope_name) + 1:].partition("=")
+                if filter_kind == entity_key:
+                    self.allowed_entities.add(filter_value)
+                elif filter_kind == "group" and entity_key == "user":
+                    self.allowed_groups.add(filter_value)
+
+    def filter(self, entities, group_members=None) -> typing.List[str]:
+        """
+        :param entities: names of users or groups to filter
+        :param group_members: mapping of group name to the names of its users, used
+            to resolve group filtered scopes when filtering users
+        """
+        if self.allow_all:
+            return list(set(entities))
+        allowed = set(self.allowed_entities)
+        for group in self.allowed_groups:
+            allowed.update((group_members or {}).get(group, []))
+        return list(allowed.intersection(entities))
+
+
+def filter_entity_based_on_scopes(scopes, entities, entity_key="user", group_members=None):
+    return ScopeResolver(scopes, entity_key=entity_key).filter(entities, group_members=group_members)
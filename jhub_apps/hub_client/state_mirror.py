@@ -0,0 +1,216 @@
+import asyncio
+import os
+import random
+import time
+import typing
+
+import structlog
+
+from jhub_apps.service.cache import publish, subscribe, unsubscribe
+
+logger = structlog.get_logger(__name__)
+
+# Opt-in: keep an in-memory copy of all the servers in the Hub, refreshed in the background
+HUB_STATE_MIRROR = os.environ.get("JHUB_APPS_HUB_STATE_MIRROR", "false").lower() == "true"
+# Seconds between two listings of the Hub users
+HUB_STATE_MIRROR_INTERVAL = int(os.environ.get("JHUB_APPS_HUB_STATE_MIRROR_INTERVAL", "30"))
+# Fraction of the interval randomly added or removed, so that workers don't poll in lockstep
+HUB_STATE_MIRROR_JITTER = 0.1
+# Seconds after which the servers of an owner are refreshed again after starting one,
+# the first refresh sees it pending
+HUB_STATE_MIRROR_START_RECHECK_DELAY = 5
+
+# Channel on which the mirrors of the other service workers are told that the
+# servers of a user changed
+SERVERS_CHANGED_CHANNEL = "hub_servers"
+
+
+class HubStateMirror:
+    """Snapshot of the servers of all the Hub users, indexed by owner and server name.
+
+    The snapshot is rebuilt from one paginated listing of the Hub users every
+    `interval` seconds and the servers of an owner are refreshed right after
+    jhub-apps changes them (and once more a few seconds after starting one).
+    Reads are served from the snapshot while the next listing is in flight,
+    however long the Hub takes to answer it, and a failed listing keeps the
+    previous snapshot. Changes made outside of jhub-apps (e.g. from the Hub
+    home page or by the idle culler) show up after the next listing.
+
+    Each service worker has its own mirror and lists all the Hub users itself,
+    so the Hub serves one listing per worker per interval.
+
+    The server models are shared between readers and must not be modified.
+    """
+
+    def __init__(
+        self,
+        interval: float = HUB_STATE_MIRROR_INTERVAL,
+        jitter: float = HUB_STATE_MIRROR_JITTER,
+        start_recheck_delay: float = HUB_STATE_MIRROR_START_RECHECK_DELAY,
+    ):
+        self.interval = interval
+        self.jitter = jitter
+        self.start_recheck_delay = start_recheck_delay
+        self._servers: typing.Dict[str, typing.Dict[str, dict]] = {}
+        # owner -> time its servers were last refreshed outside of a listing
+        self._refreshed_at: typing.Dict[str, float] = {}
+        self._task: typing.Optional[asyncio.Task] = None
+        # owner -> delayed refresh of their servers
+        self._rechecks: typing.Dict[str, asyncio.Task] = {}
+        self.synced_at: typing.Optional[float] = None
+        self.syncs = 0
+        self.sync_errors = 0
+        self.last_sync_duration: typing.Optional[float] = None
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def ready(self) -> bool:
+        return self.synced_at is not None
+
+    def stats(self) -> dict:
+        return {
+            "ready": self.ready,
+            "owners": len(self._servers),
+            "servers": sum(len(servers) for servers in self._servers.values()),
+            "age": round(time.monotonic() - self.synced_at, 3) if self.ready else None,
+            "syncs": self.syncs,
+            "sync_errors": self.sync_errors,
+            "last_sync_duration": self.last_sync_duration,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    def get_user_servers(self, username: str) -> typing.Optional[typing.Dict[str, dict]]:
+        """Returns the servers of the given user, or None if they are not in the snapshot."""
+        servers = self._servers.get(username) if self.ready else None
+        if servers is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return servers
+
+    def set_user_servers(self, username: str, servers: typing.Optional[typing.Dict[str, dict]]):
+        """Replaces the servers of the given user, None meaning the user doesn't exist."""
+        self._refreshed_at[username] = time.monotonic()
+        if servers is None:
+            self._servers.pop(username, None)
+        else:
+            self._servers[username] = servers
+
+    def forget_user(self, username: typing.Optional[str]):
+        """Drops the servers of the given user (or of all users) changed by another worker,
+        the next read asks the Hub.
+        """
+        if username is None:
+            for username in list(self._servers):
+                self.set_user_servers(username, None)
+        else:
+            self.set_user_servers(username, None)
+
+    async def refresh_user(self, username: str):
+        """Fetches the servers of the given user from the Hub, after they were changed."""
+        publish(SERVERS_CHANGED_CHANNEL, username)
+        # imported here as the hub client itself updates the mirror
+        from jhub_apps.hub_client.hub_client import HubClient
+        try:
+            servers = await HubClient().fetch_user_servers(username)
+        except Exception as e:
+            # Don't serve what is known to be outdated, reads go to the Hub until the next sync
+            logger.warning("Failed to refresh mirrored servers", username=username, error=str(e))
+            servers = None
+        self.set_user_servers(username, servers)
+
+    def refresh_user_later(self, username: str):
+        """Refreshes the servers of the given user again after `start_recheck_delay`
+        seconds, once a server started by jhub-apps is likely ready.
+        """
+        if username in self._rechecks:
+            return
+
+        async def recheck():
+            try:
+                await asyncio.sleep(self.start_recheck_delay)
+                await self.refresh_user(username)
+            finally:
+                self._rechecks.pop(username, None)
+
+        self._rechecks[username] = asyncio.create_task(recheck())
+
+    async def sync(self):
+        """Rebuilds the snapshot from a listing of all the Hub users."""
+        from jhub_apps.hub_client.hub_client import HubClient
+        started_at = time.monotonic()
+        servers = {}
+        async for user in HubClient().iter_users(include_stopped_servers=True):
+            servers[user["name"]] = user.get("servers") or {}
+        # Owners refreshed while the listing was in flight keep their more recent servers
+        for username, refreshed_at in self._refreshed_at.items():
+            if refreshed_at < started_at:
+                continue
+            if username in self._servers:
+                servers[username] = self._servers[username]
+            else:
+                servers.pop(username, None)
+        self._servers = servers
+        self._refreshed_at = {
+            username: refreshed_at for username, refreshed_at in self._refreshed_at.items()
+            if refreshed_at >= started_at
+        }
+        self.synced_at = time.monotonic()
+        self.syncs += 1
+        self.last_sync_duration = round(self.synced_at - started_at, 3)
+        logger.debug("Hub state mirror synced", owners=len(servers), duration=self.last_sync_duration)
+
+    def _next_delay(self) -> float:
+        return self.interval * (1 + random.uniform(-self.jitter, self.jitter))
+
+    async def _run(self):
+        while True:
+            try:
+                await self.sync()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.sync_errors += 1
+                logger.warning("Failed to sync Hub state mirror, serving the previous snapshot", error=str(e))
+            await asyncio.sleep(self._next_delay())
+
+    def start(self):
+        logger.info("Starting Hub state mirror", interval=self.interval)
+        self._task = asyncio.create_task(self._run())
+        subscribe(SERVERS_CHANGED_CHANNEL, self.forget_user)
+
+    async def stop(self):
+        unsubscribe(SERVERS_CHANGED_CHANNEL, self.forget_user)
+        for recheck in list(self._rechecks.values()):
+            recheck.cancel()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+# The mirror of the service worker, None unless started
+_mirror: typing.Optional[HubStateMirror] = None
+
+
+def get_hub_state_mirror() -> typing.Optional[HubStateMirror]:
+    return _mirror
+
+
+def start_hub_state_mirror(interval: float = HUB_STATE_MIRROR_INTERVAL) -> HubStateMirror:
+    global _mirror
+    _mirror = HubStateMirror(interval=interval)
+    _mirror.start()
+    return _mirror
+
+
+async def stop_hub_state_mirror():
+    global _mirror
+    mirror, _mirror = _mirror, None
+    if mirror is not None:
+        await mirror.stop()
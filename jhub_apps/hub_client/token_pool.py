@@ -0,0 +1,192 @@
+import asyncio
+import os
+import time
+import typing
+import weakref
+from dataclasses import dataclass, field
+
+import structlog
+
+from jhub_apps.hub_client.transport import get_hub_http_client
+
+logger = structlog.get_logger(__name__)
+
+JUPYTERHUB_API_TOKEN = os.environ.get("JUPYTERHUB_API_TOKEN")
+
+# Lifetime of the tokens created on behalf of users (seconds)
+USER_TOKEN_EXPIRES_IN = int(os.environ.get("JHUB_APPS_USER_TOKEN_EXPIRES_IN", str(60 * 5)))
+# A token is not handed out anymore once it is this close to expiring (seconds),
+# so that a request never starts with a token which may expire midway.
+USER_TOKEN_RENEW_BEFORE = int(os.environ.get("JHUB_APPS_USER_TOKEN_RENEW_BEFORE", "60"))
+# Seconds between two sweeps of the tokens of users who stopped making requests
+TOKEN_POOL_SWEEP_INTERVAL = 60
+
+
+@dataclass
+class TokenLease:
+    username: str
+    token_id: str
+    token: str
+    scopes: typing.List[str]
+    expires_at: float
+    token_json: dict = field(repr=False)
+    # number of in-flight HubClient calls using this token
+    users: int = 0
+    retired: bool = False
+
+    def is_fresh(self, now: float) -> bool:
+        return not self.retired and now < self.expires_at - USER_TOKEN_RENEW_BEFORE
+
+
+class UserTokenPool:
+    """Per-user pool of short-lived Hub tokens leased to HubClient calls.
+
+    A valid token is reused by all calls for the same user until shortly before
+    it expires, at which point a new one is created and the old one is revoked in
+    the background as soon as the last call using it finishes. The tokens of users
+    who don't make requests anymore are revoked and forgotten by a periodic sweep.
+    """
+
+    def __init__(self):
+        self._leases: typing.Dict[str, TokenLease] = {}
+        self._locks: typing.Dict[str, asyncio.Lock] = {}
+        self._background_tasks: typing.Set[asyncio.Task] = set()
+        self._swept_at = time.monotonic()
+        self.hits = 0
+        self.misses = 0
+        self.revoked = 0
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "revoked": self.revoked,
+            "active": len(self._leases),
+        }
+
+    async def acquire(self, username: str) -> TokenLease:
+        self._sweep(time.monotonic())
+        lease = self._leases.get(username)
+        if lease is None or not lease.is_fresh(time.monotonic()):
+            lock = self._locks.setdefault(username, asyncio.Lock())
+            async with lock:
+                # Another call might have renewed the token while waiting for the lock
+                lease = self._leases.get(username)
+                if lease is None or not lease.is_fresh(time.monotonic()):
+                    self.misses += 1
+                    lease = await self._renew(username)
+                else:
+                    self.hits += 1
+        else:
+            self.hits += 1
+        lease.users += 1
+        return lease
+
+    def release(self, lease: TokenLease):
+        lease.users -= 1
+        if lease.retired and lease.users == 0:
+            self._revoke_in_background(lease)
+
+    def _sweep(self, now: float):
+        """Revokes and forgets the tokens nobody uses that are not handed out anymore."""
+        if now - self._swept_at < TOKEN_POOL_SWEEP_INTERVAL:
+            return
+        self._swept_at = now
+        for username, lease in list(self._leases.items()):
+            if lease.users == 0 and not lease.is_fresh(now):
+                del self._leases[username]
+                lock = self._locks.get(username)
+                if lock is not None and not lock.locked():
+                    del self._locks[username]
+                lease.retired = True
+                if now < lease.expires_at:
+                    self._revoke_in_background(lease)
+
+    async def _renew(self, username: str) -> TokenLease:
+        lease = await _create_token_for_user(username)
+        previous_lease = self._leases.get(username)
+        self._leases[username] = lease
+        if previous_lease is not None:
+            previous_lease.retired = True
+            if previous_lease.users == 0:
+                self._revoke_in_background(previous_lease)
+        logger.info("Token pool renewed user token", username=username, **self.stats())
+        return lease
+
+    def _revoke_in_background(self, lease: TokenLease):
+        task = asyncio.create_task(self._revoke(lease))
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+
+    async def _revoke(self, lease: TokenLease):
+        try:
+            await _revoke_token(lease)
+            self.revoked += 1
+        except Exception as e:
+            # The token expires on its own anyway
+            logger.warning("Failed to revoke token", token_id=lease.token_id, error=str(e))
+
+    async def close(self):
+        """Revoke all the tokens held by the pool, those not expired yet."""
+        now = time.monotonic()
+        leases = [lease for lease in self._leases.values() if now < lease.expires_at]
+        self._leases.clear()
+        self._locks.clear()
+        for lease in leases:
+            lease.retired = True
+        await asyncio.gather(
+            *self._background_tasks, *(self._revoke(lease) for lease in leases)
+        )
+        logger.info("Token pool closed", **self.stats())
+
+
+async def _create_token_for_user(username: str) -> TokenLease:
+    assert username
+    logger.info("Creating token for user", username=username)
+    r = await get_hub_http_client().post(
+        f"/users/{username}/tokens",
+        headers={"Authorization": f"token {JUPYTERHUB_API_TOKEN}"},
+        json={"expires_in": USER_TOKEN_EXPIRES_IN},
+    )
+    r.raise_for_status()
+    rjson = r.json()
+    logger.info(f"Created token: {rjson['id']}")
+    return TokenLease(
+        username=username,
+        token_id=rjson["id"],
+        token=rjson["token"],
+        scopes=rjson.get("scopes", []),
+        expires_at=time.monotonic() + USER_TOKEN_EXPIRES_IN,
+        token_json=rjson,
+    )
+
+
+async def _revoke_token(lease: TokenLease):
+    logger.debug(f"Revoking token: {lease.token_id}")
+    r = await get_hub_http_client().delete(
+        f"/users/{lease.username}/tokens/{lease.token_id}",
+        headers={"Authorization": f"token {JUPYTERHUB_API_TOKEN}"},
+    )
+    r.raise_for_status()
+    logger.debug("Token revoked", status_code=r.status_code, username=lease.username)
+    return r
+
+
+# Like the http client, the pool (and its locks and background tasks) belongs to an event loop
+_pools: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, UserTokenPool]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def get_user_token_pool() -> UserTokenPool:
+    loop = asyncio.get_running_loop()
+    pool = _pools.get(loop)
+    if pool is None:
+        pool = _pools[loop] = UserTokenPool()
+    return pool
+
+
+async def close_user_token_pool():
+    pool = _pools.pop(asyncio.get_running_loop(), None)
+    if pool is not None:
+        await pool.close()
@@ -0,0 +1,72 @@
+import asyncio
+import os
+import weakref
+from typing import Optional
+
+import httpx
+import structlog
+
+logger = structlog.get_logger(__name__)
+
+# Default timeout for requests to JupyterHub API (seconds)
+# Can be overridden with JUPYTERHUB_REQUEST_TIMEOUT env variable
+DEFAULT_REQUEST_TIMEOUT = int(os.environ.get("JUPYTERHUB_REQUEST_TIMEOUT", "30"))
+
+# Connection pool limits for the shared client, one pool per service worker
+HUB_MAX_CONNECTIONS = int(os.environ.get("JHUB_APPS_HUB_MAX_CONNECTIONS", "100"))
+HUB_MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get("JHUB_APPS_HUB_MAX_KEEPALIVE_CONNECTIONS", "20"))
+HUB_KEEPALIVE_EXPIRY = 30
+
+# One client per event loop: uvicorn workers run a single loop, while scripts
+# using asyncio.run (or the sync facade) get a fresh loop for every call.
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def _http2_enabled() -> bool:
+    if os.environ.get("JHUB_APPS_HUB_HTTP2", "false").lower() != "true":
+        return False
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        logger.warning("HTTP/2 requested for Hub API but 'h2' is not installed, using HTTP/1.1")
+        return False
+    return True
+
+
+def _create_hub_http_client() -> httpx.AsyncClient:
+    base_url = os.environ.get("JUPYTERHUB_API_URL") or ""
+    token = os.environ.get("JUPYTERHUB_API_TOKEN")
+    headers = {"Authorization": f"Bearer {token}"} if token else {}
+    # Increase timeout to handle hairpin NAT delays in local clusters (kind/k3d)
+    timeout = httpx.Timeout(DEFAULT_REQUEST_TIMEOUT, connect=DEFAULT_REQUEST_TIMEOUT)
+    limits = httpx.Limits(
+        max_connections=HUB_MAX_CONNECTIONS,
+        max_keepalive_connections=HUB_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=HUB_KEEPALIVE_EXPIRY,
+    )
+    http2 = _http2_enabled()
+    logger.info(
+        "Creating shared httpx client", base_url=base_url, timeout=str(timeout), http2=http2
+    )
+    return httpx.AsyncClient(
+        base_url=base_url, headers=headers, timeout=timeout, limits=limits, http2=http2
+    )
+
+
+def get_hub_http_client() -> httpx.AsyncClient:
+    """Returns the keep-alive client for JupyterHub API shared by the current event loop."""
+    loop = asyncio.get_running_loop()
+    client: Optional[httpx.AsyncClient] = _clients.get(loop)
+    if client is None or client.is_closed:
+        client = _clients[loop] = _create_hub_http_client()
+    return client
+
+
+async def close_hub_http_client():
+    """Closes the shared client of the current event loop, if one was created."""
+    client = _clients.pop(asyncio.get_running_loop(), None)
+    if client is not None and not client.is_closed:
+        logger.info("Closing shared httpx client")
+        await client.aclose()
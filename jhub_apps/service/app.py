@@ -1,14 +1,25 @@
+import asyncio
 import os
-from pathlib import Path
+from contextlib import asynccontextmanager
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
 
+from jhub_apps.hub_client.state_mirror import (
+    HUB_STATE_MIRROR,
+    start_hub_state_mirror,
+    stop_hub_state_mirror,
+)
+from jhub_apps.hub_client.token_pool import close_user_token_pool
+from jhub_apps.hub_client.transport import close_hub_http_client, get_hub_http_client
 from jhub_apps.service.japps_routes import router as japps_router
 from jhub_apps.service.logging_utils import setup_logging
 from jhub_apps.service.middlewares import create_middlewares
+from jhub_apps.service.responses import JAppsJSONResponse
 from jhub_apps.service.routes import router
+from jhub_apps.service.static_files import STATIC_DIR, PrecompressedStaticFiles
+from jhub_apps.service.thumbnails import shutdown_thumbnail_workers
+from jhub_apps.service.utils import jupyterhub_config_cache
 from jhub_apps.version import get_version
 import structlog
 
@@ -20,7 +31,6 @@ setup_logging()
 ### One way to handle this with FastAPI is to use an APIRouter.
 ### All routes are defined in routes.py
 
-STATIC_DIR = Path(__file__).parent.parent / "static"
 
 logger.info("Starting jhub-apps service initialization", version=str(get_version()), static_dir=str(STATIC_DIR))
 
@@ -31,10 +41,37 @@ logger.info("Loading environment variables",
             jupyterhub_client_id=os.environ.get("JUPYTERHUB_CLIENT_ID"),
             public_host=os.environ.get("PUBLIC_HOST"))
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One keep-alive connection pool to the Hub per worker, shared by all requests
+    get_hub_http_client()
+    if HUB_STATE_MIRROR:
+        start_hub_state_mirror()
+    # Load the JupyterHub config before the first request needs it, and keep it fresh
+    try:
+        await asyncio.to_thread(jupyterhub_config_cache.load)
+    except Exception as e:
+        logger.error("Failed to load JupyterHub config at startup", error=str(e))
+    config_refresh_task = asyncio.create_task(jupyterhub_config_cache.refresh_periodically())
+    logger.info("FastAPI startup event triggered - application is ready to serve requests")
+    try:
+        yield
+    finally:
+        logger.info("FastAPI shutdown event triggered - application is stopping")
+        config_refresh_task.cancel()
+        await stop_hub_state_mirror()
+        # Revoke the user tokens still held by this worker before closing the connections
+        await close_user_token_pool()
+        await close_hub_http_client()
+        shutdown_thumbnail_workers()
+
+
 try:
     logger.info("Creating FastAPI application")
     app = FastAPI(
         title="JApps Service",
+        lifespan=lifespan,
+        default_response_class=JAppsJSONResponse,
         version=str(get_version()),
         ### Serve out Swagger from the service prefix (<hub>/services/:name/docs)
         openapi_url=router.prefix + "/openapi.json",
@@ -76,7 +113,7 @@ try:
         logger.info("CORS middleware disabled (set ENABLE_CORS=true to enable)")
 
     logger.info("Mounting static files", static_dir=str(STATIC_DIR), prefix=f"{router.prefix}/static")
-    static_files = StaticFiles(directory=STATIC_DIR)
+    static_files = PrecompressedStaticFiles(directory=STATIC_DIR)
     app.mount(f"{router.prefix}/static", static_files, name="static")
     logger.info("Static files mounted successfully")
 
@@ -94,14 +131,6 @@ try:
 
     logger.info("jhub-apps service started successfully", version=str(get_version()))
 
-    @app.on_event("startup")
-    async def startup_event():
-        logger.info("FastAPI startup event triggered - application is ready to serve requests")
-
-    @app.on_event("shutdown")
-    async def shutdown_event():
-        logger.info("FastAPI shutdown event triggered - application is stopping")
-
 except Exception as e:
     logger.error("Failed to start jhub-apps service", error=str(e), error_type=type(e).__name__)
     raise
@@ -5,7 +5,6 @@ import tempfile
 from pathlib import Path
 from urllib.parse import urlparse
 
-import git
 from fastapi import HTTPException, status
 from pydantic import ValidationError
 
@@ -52,6 +51,8 @@ def _clone_repo(repository: Repository, temp_dir):
     """Clone repository to the given tem_dir"""
     # Validate repository before cloning
     _validate_git_repository(repository)
+    # Imported on first use, GitPython is one of the slowest imports of the service
+    import git
 
     try:
         logger.info("Trying to clone repository", repo_url=repository.url)
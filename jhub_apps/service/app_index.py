@@ -0,0 +1,180 @@
+import base64
+import bisect
+import json
+import typing
+
+from cachetools import LRUCache
+from fastapi import HTTPException, status
+
+from jhub_apps.hub_client.state_mirror import get_hub_state_mirror
+
+### Pages of the apps of a user (owned and shared with them), filtered, sorted
+### and counted by framework on the service rather than in the UI. The apps
+### are indexed once: each one with its normalized filter and sort values, and
+### one ordering per sort key built on first use. With the Hub state mirror, the
+### index of each user is kept until their servers change, the Hub server models
+### are not copied.
+
+SORT_KEYS = ("last_activity", "name", "started")
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+class AppEntry(typing.NamedTuple):
+    server: dict
+    owner: str
+    name: str
+    shared: bool
+    framework: str
+    running: bool
+    # lowercase display name, description and server name
+    search_text: str
+    sort_values: typing.Dict[str, str]
+
+
+def _owner(server: dict, default: str) -> str:
+    # full_name is "<owner>/<server name>"
+    full_name = server.get("full_name") or ""
+    return full_name.split("/", 1)[0] if "/" in full_name else default
+
+
+def _entry(server: dict, owner: str, shared: bool) -> AppEntry:
+    user_options = server.get("user_options") or {}
+    display_name = user_options.get("display_name") or server.get("name") or ""
+    return AppEntry(
+        server=server,
+        owner=owner,
+        name=server.get("name") or "",
+        shared=shared,
+        framework=user_options.get("framework") or "",
+        running=bool(server.get("ready") or server.get("pending")),
+        search_text=" ".join(
+            [display_name, user_options.get("description") or "", server.get("name") or ""]
+        ).lower(),
+        sort_values={
+            # ISO 8601 timestamps sort as strings, servers never active/started first
+            "last_activity": server.get("last_activity") or "",
+            "name": display_name.lower(),
+            "started": server.get("started") or "",
+        },
+    )
+
+
+class AppFilters(typing.NamedTuple):
+    frameworks: typing.FrozenSet[str] = frozenset()
+    status: typing.Optional[str] = None  # running / stopped
+    owner: typing.Optional[str] = None
+    scope: typing.Optional[str] = None  # mine / shared
+    search: typing.Optional[str] = None
+
+    def match(self, entry: AppEntry, ignore_framework: bool = False) -> bool:
+        return (
+            (ignore_framework or not self.frameworks or entry.framework in self.frameworks)
+            and (self.status is None or entry.running == (self.status == "running"))
+            and (self.owner is None or entry.owner == self.owner)
+            and (self.scope is None or entry.shared == (self.scope == "shared"))
+            and (not self.search or self.search.lower() in entry.search_text)
+        )
+
+
+def encode_cursor(sort: str, key: typing.Tuple[str, str, str]) -> str:
+    return base64.urlsafe_b64encode(json.dumps([sort, *key]).encode()).decode()
+
+
+def decode_cursor(cursor: str, sort: str) -> typing.Tuple[str, str, str]:
+    try:
+        cursor_sort, *key = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if cursor_sort != sort or len(key) != 3 or not all(isinstance(value, str) for value in key):
+            raise ValueError(cursor)
+    except (ValueError, TypeError):
+        raise HTTPException(
+            detail="Invalid cursor, start again without it",
+            status_code=status.HTTP_400_BAD_REQUEST,
+        )
+    return tuple(key)
+
+
+class AppIndex:
+    def __init__(self, entries: typing.List[AppEntry]):
+        self.entries = entries
+        # sort key -> (sorted keys, entries in the same order)
+        self._orders: typing.Dict[str, typing.Tuple[list, typing.List[AppEntry]]] = {}
+
+    @classmethod
+    def build(cls, username: str, user_apps: typing.Iterable[dict], shared_apps: typing.Iterable[dict]):
+        entries = [_entry(server, username, shared=False) for server in user_apps]
+        entries += [_entry(server, _owner(server, ""), shared=True) for server in shared_apps]
+        return cls(entries)
+
+    def _order(self, sort: str):
+        if sort not in self._orders:
+            keyed = sorted(((entry.sort_values[sort], entry.owner, entry.name), entry) for entry in self.entries)
+            self._orders[sort] = ([key for key, _ in keyed], [entry for _, entry in keyed])
+        return self._orders[sort]
+
+    def query(
+        self,
+        filters: AppFilters,
+        sort: str = "name",
+        descending: bool = False,
+        cursor: typing.Optional[str] = None,
+        limit: int = DEFAULT_PAGE_SIZE,
+    ) -> dict:
+        keys, ordered = self._order(sort)
+        if descending:
+            start = len(keys) - 1
+            if cursor:
+                start = bisect.bisect_left(keys, decode_cursor(cursor, sort)) - 1
+            positions = range(start, -1, -1)
+        else:
+            start = bisect.bisect_right(keys, decode_cursor(cursor, sort)) if cursor else 0
+            positions = range(start, len(keys))
+        page, next_cursor = [], None
+        for position in positions:
+            if not filters.match(ordered[position]):
+                continue
+            if len(page) == limit:
+                # the key of the last app of the page, the next one starts after it
+                next_cursor = encode_cursor(sort, keys[last_position])
+                break
+            page.append(ordered[position])
+            last_position = position
+        # the framework counts ignore the framework filter, to show the other choices
+        framework_counts: typing.Dict[str, int] = {}
+        total = 0
+        for entry in self.entries:
+            if filters.match(entry, ignore_framework=True):
+                framework_counts[entry.framework] = framework_counts.get(entry.framework, 0) + 1
+                if filters.match(entry):
+                    total += 1
+        return {
+            "items": page,
+            "next_cursor": next_cursor,
+            "total": total,
+            "facets": {"framework": framework_counts},
+        }
+
+
+# username -> (the server models the index was built from, index)
+_indexes = LRUCache(maxsize=256)
+
+
+def get_app_index(username: str, user_apps: typing.List[dict], shared_apps: typing.List[dict]) -> AppIndex:
+    """The index of the apps of the user, rebuilt when their server models change.
+
+    Only the Hub state mirror returns the same models until a server changes
+    (and new ones after), so the index is only kept when it's running: the
+    models are then compared by identity. The index holds them, their ids can't
+    be reused while it's cached. Without the mirror, the models are parsed from
+    the Hub responses of each request and the index is built for the request.
+    """
+    if get_hub_state_mirror() is None:
+        _indexes.pop(username, None)
+        return AppIndex.build(username, user_apps, shared_apps)
+    fingerprint = (tuple(map(id, user_apps)), tuple(map(id, shared_apps)))
+    cached = _indexes.get(username)
+    if cached is not None and cached[0] == fingerprint:
+        return cached[1]
+    index = AppIndex.build(username, user_apps, shared_apps)
+    _indexes[username] = (fingerprint, index)
+    return index
@@ -0,0 +1,101 @@
+import asyncio
+import os
+import typing
+
+import httpx
+import structlog
+
+from jhub_apps.hub_client.hub_client import HubClient
+from jhub_apps.service.models import BatchOperation
+from jhub_apps.service.responses import dump_json
+
+logger = structlog.get_logger(__name__)
+
+# Maximum number of operations of a batch sent to the Hub at the same time
+BATCH_CONCURRENCY = int(os.environ.get("JHUB_APPS_BATCH_CONCURRENCY", "10"))
+# Starts refused by the Hub spawn limits (429) are retried this many times,
+# after the Retry-After of the Hub capped to MAX_RETRY_AFTER seconds
+SPAWN_LIMIT_RETRIES = 3
+MAX_RETRY_AFTER = 30
+
+
+def _retry_after(response: httpx.Response) -> float:
+    try:
+        return min(max(float(response.headers.get("retry-after", 1)), 0), MAX_RETRY_AFTER)
+    except ValueError:
+        return 1
+
+
+class BatchRunner:
+    """Runs the operations of a batch for a user, with their token.
+
+    The servers of each owner are fetched once for all the starts of the batch,
+    the Hub checks the permissions of the user on each operation.
+    """
+
+    def __init__(self, username: str, concurrency: int = BATCH_CONCURRENCY):
+        self.username = username
+        self.hub_client = HubClient(username=username)
+        self.semaphore = asyncio.Semaphore(concurrency)
+        # owner -> task fetching their servers
+        self._owner_servers: typing.Dict[str, asyncio.Task] = {}
+
+    async def _get_owner_server(self, owner: str, name: str) -> typing.Optional[dict]:
+        if owner not in self._owner_servers:
+            self._owner_servers[owner] = asyncio.ensure_future(self.hub_client.get_server(owner, fresh=True))
+        owner_servers = await self._owner_servers[owner]
+        return (owner_servers or {}).get(name)
+
+    async def _start(self, owner: str, name: str) -> typing.Optional[httpx.Response]:
+        server = await self._get_owner_server(owner, name) if name else None
+        if name and server is None:
+            return None
+        for attempt in range(SPAWN_LIMIT_RETRIES + 1):
+            response = await self.hub_client.start_server(owner, name, server=server)
+            if response.status_code != 429 or attempt == SPAWN_LIMIT_RETRIES:
+                return response
+            logger.info("Spawn limit reached, retrying", owner=owner, server_name=name)
+            await asyncio.sleep(_retry_after(response))
+
+    async def run_operation(self, operation: BatchOperation) -> dict:
+        owner = operation.owner or self.username
+        result = {"owner": owner, "name": operation.name, "action": operation.action}
+        async with self.semaphore:
+            try:
+                if operation.action == "start":
+                    response = await self._start(owner, operation.name)
+                    if response is None:
+                        result.update(status_code=404, detail=f"server '{operation.name}' not found")
+                        return result
+                    result["status_code"] = response.status_code
+                    if not response.is_success:
+                        result["detail"] = response.text
+                else:
+                    result["status_code"] = await self.hub_client.delete_server(
+                        owner, operation.name, remove=operation.action == "delete"
+                    )
+            except httpx.HTTPStatusError as e:
+                result.update(status_code=e.response.status_code, detail=e.response.text)
+            except httpx.HTTPError as e:
+                logger.exception("Batch operation failed", owner=owner, server_name=operation.name)
+                result.update(status_code=502, detail=f"JupyterHub API request failed: {e}")
+        return result
+
+    async def run(self, operations: typing.List[BatchOperation]) -> typing.AsyncIterator[dict]:
+        """The results of the operations, as they complete."""
+        tasks = [asyncio.ensure_future(self.run_operation(operation)) for operation in operations]
+        try:
+            for next_result in asyncio.as_completed(tasks):
+                yield await next_result
+        finally:
+            # the client went away, the operations not sent yet are dropped
+            for task in tasks:
+                task.cancel()
+            for task in self._owner_servers.values():
+                task.cancel()
+
+
+async def stream_batch_results(username: str, operations: typing.List[BatchOperation]) -> typing.AsyncIterator[bytes]:
+    """The results of the operations as JSON lines."""
+    async for result in BatchRunner(username).run(operations):
+        yield dump_json(result) + b"\n"
@@ -0,0 +1,306 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import typing
+import uuid
+from collections import defaultdict
+
+import structlog
+from cachetools import TTLCache
+
+logger = structlog.get_logger(__name__)
+
+### The service runs several uvicorn workers (JAppsConfig.service_workers), the
+### "memory" backend gives each of them its own caches, while with the "sqlite"
+### backend they share a single SQLite file (in WAL mode) on the service's host:
+### entries cached by a worker are used by the others and deleting an entry is
+### seen by all of them, along with an invalidation event for the state each
+### worker keeps for itself (see subscribe). Workers can also tell the others
+### about changes to state that isn't cached here (see publish).
+CACHE_BACKEND = os.environ.get("JHUB_APPS_CACHE_BACKEND", "memory")
+CACHE_PATH = os.environ.get("JHUB_APPS_CACHE_PATH", "jhub-apps-cache.sqlite")
+# Seconds between two checks for the invalidation events of the other workers
+INVALIDATION_POLL_INTERVAL = 0.2
+# Seconds for which invalidation events are kept in the shared file
+INVALIDATION_RETENTION = 300
+# Expired entries are purged from the shared file every this many writes
+SQLITE_PURGE_EVERY = 256
+# Seconds a worker waits for the lock of the shared file, the cache is used from
+# the event loop: past this, reads are misses and writes are skipped
+SQLITE_BUSY_TIMEOUT = 0.05
+
+
+class CacheBackend:
+    """Storage of the caches, entries are grouped in namespaces each having a ttl and a size."""
+
+    def register(self, namespace: str, ttl: float, maxsize: int):
+        raise NotImplementedError
+
+    def get(self, namespace: str, key: str) -> typing.Any:
+        """Returns the cached value or None."""
+        raise NotImplementedError
+
+    def set(self, namespace: str, key: str, value: typing.Any):
+        raise NotImplementedError
+
+    def delete(self, namespace: str, key: typing.Optional[str] = None):
+        """Deletes the given entry or the whole namespace if key is None, and tells the other workers."""
+        raise NotImplementedError
+
+    def publish(self, channel: str, key: typing.Optional[str] = None):
+        """Tells the other workers about a change, without caching or deleting anything."""
+
+    def poll_invalidations(self) -> typing.List[typing.Tuple[str, typing.Optional[str]]]:
+        """Returns the (namespace or channel, key) deleted or published by other workers
+        since the last poll.
+        """
+        return []
+
+
+class MemoryCacheBackend(CacheBackend):
+    def __init__(self):
+        self._caches: typing.Dict[str, TTLCache] = {}
+
+    def register(self, namespace, ttl, maxsize):
+        if namespace not in self._caches:
+            self._caches[namespace] = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def get(self, namespace, key):
+        return self._caches[namespace].get(key)
+
+    def set(self, namespace, key, value):
+        self._caches[namespace][key] = value
+
+    def delete(self, namespace, key=None):
+        if key is None:
+            self._caches[namespace].clear()
+        else:
+            self._caches[namespace].pop(key, None)
+
+
+class SQLiteCacheBackend(CacheBackend):
+    """Caches shared by the service workers through a SQLite file in WAL mode.
+
+    Values are stored as json. Deletions are recorded in an `invalidations`
+    table, which each worker reads at most every INVALIDATION_POLL_INTERVAL.
+    When the file is locked for longer than SQLITE_BUSY_TIMEOUT (or can't be
+    used at all), reads are cache misses and writes are logged and dropped.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._namespaces: typing.Dict[str, typing.Tuple[float, int]] = {}
+        self._connection: typing.Optional[sqlite3.Connection] = None
+        # connections can't be shared with forked processes
+        self._pid: typing.Optional[int] = None
+        # identifies the events of this worker in the invalidations table
+        self._origin: typing.Optional[str] = None
+        self._lock = threading.Lock()
+        self._last_invalidation_id = 0
+        self._last_poll = 0.0
+        self._writes = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None or self._pid != os.getpid():
+            connection = sqlite3.connect(
+                self.path, timeout=SQLITE_BUSY_TIMEOUT, isolation_level=None, check_same_thread=False
+            )
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, "
+                "expires_at REAL NOT NULL, PRIMARY KEY (namespace, key))"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS invalidations ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, namespace TEXT NOT NULL, key TEXT, "
+                "origin TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            # Only the events from now on are relevant to this worker
+            self._last_invalidation_id = connection.execute(
+                "SELECT COALESCE(MAX(id), 0) FROM invalidations"
+            ).fetchone()[0]
+            self._connection = connection
+            self._pid = os.getpid()
+            self._origin = uuid.uuid4().hex
+            logger.info("Opened shared cache", path=self.path)
+        return self._connection
+
+    def register(self, namespace, ttl, maxsize):
+        self._namespaces[namespace] = (ttl, maxsize)
+
+    def get(self, namespace, key):
+        try:
+            with self._lock:
+                row = self._connect().execute(
+                    "SELECT value FROM entries WHERE namespace = ? AND key = ? AND expires_at > ?",
+                    (namespace, key, time.time()),
+                ).fetchone()
+        except sqlite3.OperationalError as e:
+            logger.warning("Shared cache unavailable, cache miss", namespace=namespace, error=str(e))
+            return None
+        return json.loads(row[0]) if row else None
+
+    def set(self, namespace, key, value):
+        ttl, _ = self._namespaces[namespace]
+        try:
+            with self._lock:
+                connection = self._connect()
+                connection.execute(
+                    "INSERT OR REPLACE INTO entries (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                    (namespace, key, json.dumps(value), time.time() + ttl),
+                )
+                self._writes += 1
+                if self._writes % SQLITE_PURGE_EVERY == 0:
+                    self._purge(connection)
+        except sqlite3.OperationalError as e:
+            logger.warning("Shared cache unavailable, entry not cached", namespace=namespace, error=str(e))
+
+    def _purge(self, connection: sqlite3.Connection):
+        now = time.time()
+        connection.execute("DELETE FROM entries WHERE expires_at <= ?", (now,))
+        connection.execute(
+            "DELETE FROM invalidations WHERE created_at < ?", (now - INVALIDATION_RETENTION,)
+        )
+        for namespace, (_, maxsize) in self._namespaces.items():
+            # Evict the entries closest to expiring beyond the size of the namespace
+            connection.execute(
+                "DELETE FROM entries WHERE namespace = ? AND key NOT IN ("
+                "SELECT key FROM entries WHERE namespace = ? ORDER BY expires_at DESC LIMIT ?)",
+                (namespace, namespace, maxsize),
+            )
+
+    def delete(self, namespace, key=None):
+        try:
+            with self._lock:
+                connection = self._connect()
+                connection.execute("BEGIN")
+                try:
+                    if key is None:
+                        connection.execute("DELETE FROM entries WHERE namespace = ?", (namespace,))
+                    else:
+                        connection.execute(
+                            "DELETE FROM entries WHERE namespace = ? AND key = ?", (namespace, key)
+                        )
+                    self._record_invalidation(connection, namespace, key)
+                    connection.execute("COMMIT")
+                except Exception:
+                    if connection.in_transaction:
+                        connection.execute("ROLLBACK")
+                    raise
+        except sqlite3.OperationalError as e:
+            # the entry expires with its ttl
+            logger.warning("Shared cache unavailable, entry not deleted", namespace=namespace, error=str(e))
+
+    def _record_invalidation(self, connection: sqlite3.Connection, namespace: str, key: typing.Optional[str]):
+        connection.execute(
+            "INSERT INTO invalidations (namespace, key, origin, created_at) VALUES (?, ?, ?, ?)",
+            (namespace, key, self._origin, time.time()),
+        )
+
+    def publish(self, channel, key=None):
+        try:
+            with self._lock:
+                self._record_invalidation(self._connect(), channel, key)
+        except sqlite3.OperationalError as e:
+            logger.warning("Shared cache unavailable, change not published", channel=channel, error=str(e))
+
+    def poll_invalidations(self):
+        now = time.monotonic()
+        if now - self._last_poll < INVALIDATION_POLL_INTERVAL:
+            return []
+        self._last_poll = now
+        try:
+            with self._lock:
+                connection = self._connect()
+                rows = connection.execute(
+                    "SELECT id, namespace, key, origin FROM invalidations WHERE id > ? ORDER BY id",
+                    (self._last_invalidation_id,),
+                ).fetchall()
+        except sqlite3.OperationalError as e:
+            # the events are read on the next poll
+            logger.warning("Shared cache unavailable, invalidations not polled", error=str(e))
+            return []
+        if rows:
+            self._last_invalidation_id = rows[-1][0]
+        return [(namespace, key) for _, namespace, key, origin in rows if origin != self._origin]
+
+
+_backend: typing.Optional[CacheBackend] = None
+_subscribers: typing.Dict[str, typing.List[typing.Callable]] = defaultdict(list)
+
+
+def get_cache_backend() -> CacheBackend:
+    global _backend
+    if _backend is None:
+        if CACHE_BACKEND == "sqlite":
+            _backend = SQLiteCacheBackend(CACHE_PATH)
+        elif CACHE_BACKEND == "memory":
+            _backend = MemoryCacheBackend()
+        else:
+            raise ValueError(f"Unknown cache backend: {CACHE_BACKEND}")
+        logger.info("Using cache backend", backend=CACHE_BACKEND)
+    return _backend
+
+
+class Cache:
+    """A namespace of the worker's cache backend, values must be json serializable."""
+
+    def __init__(self, namespace: str, ttl: float, maxsize: int = 1024):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._backend: typing.Optional[CacheBackend] = None
+
+    @property
+    def backend(self) -> CacheBackend:
+        # The backend is picked when first used, as caches are created at import time
+        if self._backend is None:
+            self._backend = get_cache_backend()
+            self._backend.register(self.namespace, self.ttl, self.maxsize)
+        return self._backend
+
+    def get(self, key: str) -> typing.Any:
+        return self.backend.get(self.namespace, key)
+
+    def set(self, key: str, value: typing.Any):
+        self.backend.set(self.namespace, key, value)
+
+    def delete(self, key: str):
+        self.backend.delete(self.namespace, key)
+
+    def clear(self):
+        self.backend.delete(self.namespace)
+
+
+def subscribe(namespace: str, callback: typing.Callable[[typing.Optional[str]], None]):
+    """Calls `callback(key)` when another worker deletes an entry of the namespace
+    (key is None when the whole namespace is cleared), or publishes a change on the
+    channel of that name.
+    """
+    _subscribers[namespace].append(callback)
+
+
+def unsubscribe(namespace: str, callback: typing.Callable[[typing.Optional[str]], None]):
+    if callback in _subscribers[namespace]:
+        _subscribers[namespace].remove(callback)
+
+
+def publish(channel: str, key: typing.Optional[str] = None):
+    """Tells the other workers subscribed to the channel that `key` changed, e.g. for
+    state they keep in memory. Only the shared backends reach other workers.
+    """
+    get_cache_backend().publish(channel, key)
+
+
+def process_invalidations():
+    """Applies the invalidations made by the other workers, called for every API request."""
+    for namespace, key in get_cache_backend().poll_invalidations():
+        for callback in list(_subscribers.get(namespace, ())):
+            try:
+                callback(key)
+            except Exception as e:
+                logger.warning("Failed to apply cache invalidation", namespace=namespace, error=str(e))
@@ -0,0 +1,192 @@
+import asyncio
+import os
+import typing
+import zlib
+
+import structlog
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = structlog.get_logger(__name__)
+
+### Responses of the service are compressed with the first encoding of
+### RESPONSE_COMPRESSION accepted by the client, when their body is at least
+### RESPONSE_COMPRESSION_MINIMUM_SIZE bytes.
+RESPONSE_COMPRESSION = [
+    encoding.strip()
+    for encoding in os.environ.get("JHUB_APPS_RESPONSE_COMPRESSION", "br,gzip").split(",")
+    if encoding.strip()
+]
+RESPONSE_COMPRESSION_MINIMUM_SIZE = int(os.environ.get("JHUB_APPS_RESPONSE_COMPRESSION_MINIMUM_SIZE", 1024))
+# Bodies this large are compressed in a thread, not to block the event loop
+THREAD_MINIMUM_SIZE = 128 * 1024
+# Fast settings, the responses are compressed on each request
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 4
+
+# Already compressed, or streamed to be consumed as it comes
+EXCLUDED_CONTENT_TYPES = ("image/png", "image/jpeg", "image/gif", "image/webp", "text/event-stream")
+
+
+def accepted_encodings(request_headers: Headers) -> typing.Set[str]:
+    """The content codings of the Accept-Encoding header, without those refused with q=0."""
+    encodings = set()
+    for accepted in request_headers.get("accept-encoding", "").split(","):
+        encoding, _, params = accepted.strip().partition(";")
+        if params.replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        encodings.add(encoding.strip().lower())
+    return encodings
+
+
+class _GzipEncoder:
+    def __init__(self):
+        self._compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, body: bytes, finish: bool) -> bytes:
+        return self._compressor.compress(body) + self._compressor.flush(zlib.Z_FINISH if finish else zlib.Z_SYNC_FLUSH)
+
+
+class _BrotliEncoder:
+    def __init__(self):
+        self._compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+
+    def compress(self, body: bytes, finish: bool) -> bytes:
+        compressed = self._compressor.process(body)
+        return compressed + (self._compressor.finish() if finish else self._compressor.flush())
+
+
+ENCODERS = {"gzip": _GzipEncoder}
+if brotli is not None:
+    ENCODERS["br"] = _BrotliEncoder
+
+
+class CompressionMiddleware:
+    """Compresses the responses with brotli or gzip, according to Accept-Encoding.
+
+    Responses which already have a Content-Encoding (e.g. the precompressed static
+    files), partial responses, images and responses with Cache-Control: no-transform
+    are sent as they are.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        encodings: typing.Sequence[str] = tuple(RESPONSE_COMPRESSION),
+        minimum_size: int = RESPONSE_COMPRESSION_MINIMUM_SIZE,
+    ):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.encodings = [encoding for encoding in encodings if encoding in ENCODERS]
+        if len(self.encodings) != len(encodings):
+            logger.warning(
+                "Some response compression encodings are not available",
+                encodings=list(encodings), available=list(ENCODERS),
+            )
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or not self.encodings:
+            await self.app(scope, receive, send)
+            return
+        accepted = accepted_encodings(Headers(scope=scope))
+        encoding = next((encoding for encoding in self.encodings if encoding in accepted), None)
+        await _CompressionResponder(self.app, encoding, self.minimum_size)(scope, receive, send)
+
+
+class _CompressionResponder:
+    def __init__(self, app: ASGIApp, encoding: typing.Optional[str], minimum_size: int):
+        self.app = app
+        self.encoding = encoding
+        self.minimum_size = minimum_size
+        self.send: typing.Optional[Send] = None
+        self.start_message: typing.Optional[Message] = None
+        self.encoder = None
+        self.buffer = bytearray()
+        self.expected_length: typing.Optional[int] = None
+        # whether the whole body was compressed
+        self.finished = False
+        # whether the response is sent as it is
+        self.passthrough = False
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        self.send = send
+        await self.app(scope, receive, self.send_compressed)
+
+    def _compressible(self, headers: Headers) -> bool:
+        content_type = headers.get("content-type", "").partition(";")[0].strip().lower()
+        return (
+            "content-encoding" not in headers
+            and self.start_message["status"] not in (204, 206, 304)
+            and content_type not in EXCLUDED_CONTENT_TYPES
+            # e.g. streamed results, sent as soon as they are ready rather than buffered
+            and "no-transform" not in headers.get("cache-control", "").lower()
+        )
+
+    async def _compress(self, body: bytes, finish: bool) -> bytes:
+        if len(body) >= THREAD_MINIMUM_SIZE:
+            return await asyncio.to_thread(self.encoder.compress, body, finish)
+        return self.encoder.compress(body, finish)
+
+    async def send_compressed(self, message: Message):
+        if message["type"] == "http.response.start":
+            # sent along with the first part of the body, once we know whether it's compressed
+            self.start_message = message
+            headers = Headers(raw=message["headers"])
+            compressible = self._compressible(headers)
+            if compressible and self.encoding is None:
+                # nothing to buffer when the client accepts none of the encodings
+                MutableHeaders(raw=message["headers"]).add_vary_header("Accept-Encoding")
+            self.passthrough = self.encoding is None or not compressible
+            if headers.get("content-length", "").isdigit():
+                self.expected_length = int(headers["content-length"])
+            return
+        if message["type"] != "http.response.body" or self.passthrough:
+            if self.start_message is not None:
+                await self.send(self.start_message)
+                self.start_message = None
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if self.start_message is None:
+            if not self.finished:
+                body = await self._compress(body, finish=not more_body)
+            await self.send({"type": "http.response.body", "body": body, "more_body": more_body})
+            return
+        # Responses passing through BaseHTTPMiddleware come in several parts,
+        # buffered until there is enough of the body to decide whether to compress it
+        self.buffer += body
+        if more_body and (
+            len(self.buffer) < self.minimum_size
+            # the whole body is coming, compressed at once to send its length
+            or (self.expected_length is not None and len(self.buffer) < self.expected_length)
+        ):
+            return
+        body, self.buffer = bytes(self.buffer), bytearray()
+        headers = MutableHeaders(raw=self.start_message["headers"])
+        headers.add_vary_header("Accept-Encoding")
+        if len(body) < self.minimum_size:
+            self.passthrough = True
+        else:
+            self.encoder = ENCODERS[self.encoding]()
+            headers["Content-Encoding"] = self.encoding
+            if "content-length" in headers:
+                del headers["content-length"]
+            etag = headers.get("etag")
+            if etag and not etag.startswith("W/"):
+                # the bytes differ from the identity response with the same ETag
+                headers["ETag"] = f"W/{etag}"
+            # the rest of the messages, if any, have an empty body
+            self.finished = not more_body or len(body) == self.expected_length
+            body = await self._compress(body, finish=self.finished)
+            if self.finished:
+                headers["Content-Length"] = str(len(body))
+        await self.send(self.start_message)
+        self.start_message = None
+        await self.send({"type": "http.response.body", "body": body, "more_body": more_body})
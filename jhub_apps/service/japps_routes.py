@@ -1,35 +1,54 @@
-from datetime import datetime, timezone
+import hashlib
+import json
 
-from fastapi import APIRouter, FastAPI, Request
+from cachetools import LRUCache
+from fastapi import APIRouter, FastAPI, Request, Response, status
 from fastapi.responses import HTMLResponse
 from fastapi.templating import Jinja2Templates
 
 from jhub_apps import TEMPLATE_PATH, themes
-from jhub_apps.service.utils import get_jupyterhub_config, get_theme
+from jhub_apps.service.static_files import get_ui_assets_version
+from jhub_apps.service.utils import etag_matches, get_jupyterhub_config, get_theme
 
 app = FastAPI()
 
 templates = Jinja2Templates(directory=TEMPLATE_PATH)
 router = APIRouter(prefix="/services/japps")
 
+# The page only depends on the theme and the version of the UI bundles, it is
+# rendered once for each of them: (body, etag) by rendering context
+_rendered_pages = LRUCache(maxsize=16)
+
+
+def _render_page(context: dict):
+    body = templates.get_template("japps_custom.html").render(context).encode()
+    etag = f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+    return body, etag
+
 
 @router.get("/create-app", response_class=HTMLResponse)
 @router.get("/edit-app", response_class=HTMLResponse)
 @router.get("/server-types", response_class=HTMLResponse)
 @router.get("/success", response_class=HTMLResponse)
 async def handle_apps(request: Request):
-    now = datetime.now(timezone.utc)
     config = get_jupyterhub_config()
     theme = get_theme(config)
     if not theme:
         theme = themes.DEFAULT_THEME
-    return templates.TemplateResponse(
-        "japps_custom.html",
-        {
-            "request": request,
-            "version_hash": now.strftime("%Y%m%d%H%M%S"),
-            "hub_title": config.get("hub_title", "JupyterHub"),
-            "favicon": theme.get("favicon", "/service/japps/static/favicon.ico"),
-            **theme,
-        },
-    )
+    context = {
+        "hub_title": config.get("hub_title", "JupyterHub"),
+        "favicon": theme.get("favicon", "/service/japps/static/favicon.ico"),
+        **theme,
+        # the version of the bundles served by this worker, rather than the one in template_vars
+        "version_hash": get_ui_assets_version(),
+    }
+    cache_key = json.dumps(context, sort_keys=True, default=str)
+    page = _rendered_pages.get(cache_key)
+    if page is None:
+        page = _rendered_pages[cache_key] = _render_page(context)
+    body, etag = page
+    # Revalidated on each visit, which is answered with a 304 until the theme or UI change
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request.headers, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return HTMLResponse(body, headers=headers)
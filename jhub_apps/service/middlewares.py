@@ -1,9 +1,15 @@
 import uuid
 
-from fastapi import Request, Response
+from fastapi import Request, Response, status
+from fastapi.responses import JSONResponse
 
 import structlog
 
+from jhub_apps.hub_client.coalescing import end_request_memo, start_request_memo
+from jhub_apps.service.cache import process_invalidations
+from jhub_apps.service.compression import CompressionMiddleware
+from jhub_apps.service.thumbnails import MAX_THUMBNAIL_SIZE, MAX_UPLOAD_REQUEST_SIZE
+
 
 def create_middlewares(app):
     @app.middleware("http")
@@ -13,6 +19,35 @@ def create_middlewares(app):
             request_id=str(uuid.uuid4()),
         )
 
-        response: Response = await call_next(request)
+        # Catch up with the changes made by the other workers
+        process_invalidations()
+        # Hub GET responses are memoized for the lifetime of the request
+        memo_token = start_request_memo()
+        try:
+            response: Response = await call_next(request)
+        finally:
+            end_request_memo(memo_token)
         return response
+
+    @app.middleware("http")
+    async def upload_size_middleware(request: Request, call_next) -> Response:
+        # Multipart requests carry a thumbnail upload, reject the oversized ones
+        # before their body is parsed and spooled
+        content_type = request.headers.get("content-type", "")
+        content_length = request.headers.get("content-length", "")
+        if (
+            content_type.startswith("multipart/form-data")
+            and content_length.isdigit()
+            and int(content_length) > MAX_UPLOAD_REQUEST_SIZE
+        ):
+            return JSONResponse(
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                content={
+                    "detail": f"Thumbnail file too large. Maximum size is {MAX_THUMBNAIL_SIZE / (1024 * 1024)}MB"
+                },
+            )
+        return await call_next(request)
+
+    # Added last, to compress the responses of all the other middlewares
+    app.add_middleware(CompressionMiddleware)
     return app
@@ -3,7 +3,7 @@ from datetime import datetime
 from typing import Any, Dict, List, Optional
 
 
-from pydantic import BaseModel, field_validator
+from pydantic import BaseModel, Field, field_validator
 
 # https://jupyterhub.readthedocs.io/en/stable/_static/rest-api/index.html
 class Server(BaseModel):
@@ -65,6 +65,8 @@ class JHubAppConfig(BaseModel):
     display_name: str
     description: str
     thumbnail: str = None
+    # tiny inline version of the thumbnail, shown while it loads
+    thumbnail_placeholder: typing.Optional[str] = None
     filepath: typing.Optional[str] = str()
     framework: str = "panel"
     custom_command: typing.Optional[str] = str()
@@ -130,4 +132,14 @@ class AdditionalService(BaseModel):
     url: str
     description: Optional[str] = None
     pinned: bool = False
-    thumbnail: Optional[str] = None
\ No newline at end of file
+    thumbnail: Optional[str] = None
+
+class BatchOperation(BaseModel):
+    name: str
+    action: typing.Literal["start", "stop", "delete"]
+    # the user running the batch by default
+    owner: typing.Optional[str] = None
+
+
+class BatchRequest(BaseModel):
+    items: List[BatchOperation] = Field(min_length=1, max_length=500)
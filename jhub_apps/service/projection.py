@@ -0,0 +1,92 @@
+import functools
+import typing
+
+### Projections of the server models returned by GET /server/, selected with
+### the `fields`, `exclude` and `view` query parameters. Fields are dotted
+### paths in the server model, e.g. `user_options.display_name`.
+
+# The fields the app cards don't need
+VIEWS = {
+    "summary": ("state", "user_options.thumbnail", "user_options.env"),
+}
+
+Projection = typing.Callable[[typing.Any], typing.Any]
+
+# A tree of field names, None for a field kept (or dropped) as a whole
+_FieldTree = typing.Dict[str, typing.Optional["_FieldTree"]]
+
+
+def _parse_fields(fields: typing.Iterable[str]) -> _FieldTree:
+    tree: _FieldTree = {}
+    for field in fields:
+        node = tree
+        *parents, leaf = field.split(".")
+        for parent in parents:
+            if node.get(parent, {}) is None:
+                # the parent is already selected as a whole
+                break
+            node = node.setdefault(parent, {})
+        else:
+            node[leaf] = None
+    return tree
+
+
+def _include(tree: _FieldTree) -> Projection:
+    children = {name: _include(subtree) if subtree else None for name, subtree in tree.items()}
+
+    def project(value):
+        if not isinstance(value, dict):
+            return value
+        return {
+            name: child(value[name]) if child else value[name]
+            for name, child in children.items()
+            if name in value
+        }
+    return project
+
+
+def _exclude(tree: _FieldTree) -> Projection:
+    dropped = {name for name, subtree in tree.items() if not subtree}
+    children = {name: _exclude(subtree) for name, subtree in tree.items() if subtree}
+
+    def project(value):
+        if not isinstance(value, dict):
+            return value
+        return {
+            name: children[name](item) if name in children else item
+            for name, item in value.items()
+            if name not in dropped
+        }
+    return project
+
+
+def _split(fields: typing.Optional[str]) -> typing.Tuple[str, ...]:
+    return tuple(sorted({field.strip() for field in (fields or "").split(",") if field.strip()}))
+
+
+@functools.lru_cache(maxsize=128)
+def _compile(fields: typing.Tuple[str, ...], exclude: typing.Tuple[str, ...]) -> typing.Optional[Projection]:
+    steps = []
+    if fields:
+        steps.append(_include(_parse_fields(fields)))
+    if exclude:
+        steps.append(_exclude(_parse_fields(exclude)))
+    if not steps:
+        return None
+    if len(steps) == 1:
+        return steps[0]
+    include, exclude_ = steps
+    return lambda value: exclude_(include(value))
+
+
+def compile_projection(
+    fields: typing.Optional[str] = None,
+    exclude: typing.Optional[str] = None,
+    view: typing.Optional[str] = None,
+) -> typing.Optional[Projection]:
+    """Returns the function projecting a server model on the comma separated
+    `fields` minus the `exclude`d ones and those dropped by the `view`, or None
+    if the whole model is kept. Projections are compiled once per selection.
+    """
+    excluded = _split(exclude) + VIEWS.get(view, ())
+    return _compile(_split(fields), tuple(sorted(set(excluded))))
@@ -0,0 +1,42 @@
+import json
+import typing
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _orjson_default(obj):
+    if isinstance(obj, BaseModel):
+        return obj.model_dump(mode="json")
+    # anything else FastAPI knows how to encode, e.g. sets or paths
+    return jsonable_encoder(obj)
+
+
+def dump_json(content: typing.Any) -> bytes:
+    """Serializes a response body, with orjson when it's installed.
+
+    orjson serializes the dicts and lists of the Hub API responses natively, only
+    the pydantic models and other uncommon types go through the (slow) encoder.
+    """
+    if orjson is not None:
+        return orjson.dumps(content, default=_orjson_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(
+        jsonable_encoder(content),
+        ensure_ascii=False,
+        allow_nan=False,
+        indent=None,
+        separators=(",", ":"),
+    ).encode("utf-8")
+
+
+class JAppsJSONResponse(JSONResponse):
+    """Default response class of the service, see dump_json."""
+
+    def render(self, content: typing.Any) -> bytes:
+        return dump_json(content)
@@ -2,7 +2,7 @@ import os
 import typing
 from datetime import timedelta
 
-import requests
+import httpx
 import structlog
 from fastapi import (
     APIRouter,
@@ -11,6 +11,7 @@ from fastapi import (
     File,
     Form,
     HTTPException,
+    Query,
     Request,
     UploadFile,
     status,
@@ -18,26 +19,38 @@ from fastapi import (
 from fastapi.encoders import jsonable_encoder
 from fastapi.templating import Jinja2Templates
 from pydantic import BaseModel, ValidationError
-from starlette.responses import RedirectResponse
-
-from jhub_apps.hub_client.hub_client import HubClient
+from starlette.responses import FileResponse, RedirectResponse, Response, StreamingResponse
+
+from jhub_apps.hub_client.coalescing import get_single_flight
+from jhub_apps.hub_client.hub_client import HubClient, get_share_permissions
+from jhub_apps.hub_client.state_mirror import get_hub_state_mirror
+from jhub_apps.hub_client.utils import is_jupyterhub_5
+from jhub_apps.hub_client.token_pool import get_user_token_pool
+from jhub_apps.service.app_index import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, AppFilters, get_app_index
 from jhub_apps.service.auth import _create_access_token
+from jhub_apps.service.batch import stream_batch_results
 from jhub_apps.service.client import get_client
 from jhub_apps.service.models import (
     AuthorizationError,
+    BatchRequest,
     HubApiError,
     ServerCreation,
     User,
     Repository,
     JHubAppConfig,
 )
+from jhub_apps.service.projection import compile_projection
 from jhub_apps.service.security import get_current_user, JHUB_APPS_AUTH_COOKIE_NAME
+from jhub_apps.service.thumbnails import image_media_type, store_data_url, thumbnail_store
 from jhub_apps.service.utils import (
     get_conda_envs,
     get_jupyterhub_config,
+    jupyterhub_config_cache,
     get_spawner_profiles,
-    get_thumbnail_data_url,
+    get_thumbnail_url,
     get_shared_servers,
+    conditional_json_response,
+    etag_matches,
     _check_if_framework_allowed,
     _get_allowed_frameworks,
 )
@@ -71,18 +84,18 @@ async def get_token(code: str):
     # The only thing we need in this form post is the code
     # Everything else we can hardcode / pull from env
     logger.info(f"Getting token for code {code}")
-    async with get_client() as client:
-        redirect_uri = (
-            os.environ["PUBLIC_HOST"] + os.environ["JUPYTERHUB_OAUTH_CALLBACK_URL"],
-        )
-        data = {
-            "client_id": os.environ["JUPYTERHUB_CLIENT_ID"],
-            "client_secret": os.environ["JUPYTERHUB_API_TOKEN"],
-            "grant_type": "authorization_code",
-            "code": code,
-            "redirect_uri": redirect_uri,
-        }
-        resp = await client.post("/oauth2/token", data=data)
+    client = get_client()
+    redirect_uri = (
+        os.environ["PUBLIC_HOST"] + os.environ["JUPYTERHUB_OAUTH_CALLBACK_URL"],
+    )
+    data = {
+        "client_id": os.environ["JUPYTERHUB_CLIENT_ID"],
+        "client_secret": os.environ["JUPYTERHUB_API_TOKEN"],
+        "grant_type": "authorization_code",
+        "code": code,
+        "redirect_uri": redirect_uri,
+    }
+    resp = await client.post("/oauth2/token", data=data)
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = _create_access_token(
         data={"sub": resp.json()}, expires_delta=access_token_expires
@@ -107,11 +120,45 @@ async def login(request: Request):
 
 @router.get("/server/", description="Get all servers")
 @router.get("/server/{server_name}", description="Get a server by server name")
-async def get_server(user: User = Depends(get_current_user), server_name=None):
-    """Get servers for the authenticated user"""
+async def get_server(
+    request: Request,
+    user: User = Depends(get_current_user),
+    server_name=None,
+    fields: typing.Optional[str] = Query(
+        None, description="Comma separated fields of the servers to return, e.g. name,user_options.display_name"
+    ),
+    exclude: typing.Optional[str] = Query(None, description="Comma separated fields of the servers to leave out"),
+    view: typing.Optional[typing.Literal["summary"]] = Query(
+        None, description="summary: leave out the state, thumbnail and env of the servers"
+    ),
+    limit: typing.Optional[int] = Query(
+        None, ge=1, le=MAX_PAGE_SIZE, description="Return a page of at most this many apps"
+    ),
+    cursor: typing.Optional[str] = Query(None, description="The next_cursor of the previous page"),
+    framework: typing.Optional[typing.List[str]] = Query(None, description="Only the apps of these frameworks"),
+    app_status: typing.Optional[typing.Literal["running", "stopped"]] = Query(None, alias="status"),
+    owner: typing.Optional[str] = Query(None, description="Only the apps of this user"),
+    scope: typing.Optional[typing.Literal["mine", "shared"]] = Query(
+        None, description="mine: the apps of the user, shared: the apps shared with them"
+    ),
+    search: typing.Optional[str] = Query(
+        None, alias="q", description="Only the apps with this text in their name or description"
+    ),
+    sort: typing.Literal["last_activity", "name", "started"] = Query("name"),
+    order: typing.Literal["asc", "desc"] = Query("asc"),
+):
+    """Get servers for the authenticated user
+
+    With any of the paging, filter or sort parameters, returns a page of the
+    apps of the user and the apps shared with them: ``items`` (each with its
+    ``owner``, whether it's ``shared`` and the ``server``), the ``next_cursor``,
+    the ``total`` number of matching apps and their counts by framework.
+    """
+    project = compile_projection(fields, exclude, view)
     hub_client = HubClient(username=user.name)
-    hub_user = hub_client.get_user()
-    user_servers = hub_user["servers"]
+    user_servers = raw_user_servers = await hub_client.get_user_servers(user.name) or {}
+    if project is not None:
+        user_servers = {name: project(server) for name, server in user_servers.items()}
 
     # If server_name is 'lab' then it is the default user
     if server_name == "lab" or server_name == "vscode":
@@ -121,16 +168,47 @@ async def get_server(user: User = Depends(get_current_user), server_name=None):
         # Get a particular server
         for s_name, server_details in user_servers.items():
             if s_name == server_name:
-                return server_details
+                return conditional_json_response(request.headers, server_details)
         raise HTTPException(
             detail=f"server '{server_name}' not found",
             status_code=status.HTTP_404_NOT_FOUND,
         )
+    elif (
+        limit or cursor or framework or app_status or owner or scope or search
+        or "sort" in request.query_params or "order" in request.query_params
+    ):
+        shared_servers = await get_shared_servers(current_hub_user={"name": user.name})
+        app_index = get_app_index(user.name, list(raw_user_servers.values()), shared_servers)
+        page = app_index.query(
+            AppFilters(
+                frameworks=frozenset(framework or ()),
+                status=app_status,
+                owner=owner,
+                scope=scope,
+                search=search,
+            ),
+            sort=sort,
+            descending=order == "desc",
+            cursor=cursor,
+            limit=limit or DEFAULT_PAGE_SIZE,
+        )
+        page["items"] = [
+            {
+                "owner": entry.owner,
+                "shared": entry.shared,
+                "server": project(entry.server) if project is not None else entry.server,
+            }
+            for entry in page["items"]
+        ]
+        return conditional_json_response(request.headers, page)
     else:
-        return {
-            "shared_apps": get_shared_servers(current_hub_user=hub_user),
+        shared_servers = await get_shared_servers(current_hub_user={"name": user.name})
+        if project is not None:
+            shared_servers = [project(server) for server in shared_servers]
+        return conditional_json_response(request.headers, {
+            "shared_apps": shared_servers,
             "user_apps": list(user_servers.values()),
-        }
+        })
 
 
 class Checker:
@@ -157,17 +235,36 @@ async def create_server(
     _check_if_framework_allowed(server.user_options)
     server_name = server.user_options.display_name
     logger.info("Creating server", server_name=server_name, user=user.name)
-    server.user_options.thumbnail = await get_thumbnail_data_url(
+    server.user_options.thumbnail, server.user_options.thumbnail_placeholder = await get_thumbnail_url(
         framework_name=server.user_options.framework, thumbnail=thumbnail
     )
     hub_client = HubClient(username=user.name)
-    return hub_client.create_server(
+    return await hub_client.create_server(
         username=user.name,
         servername=server.servername,
         user_options=server.user_options,
     )
 
 
+@router.post("/server/batch", description="Start, stop or delete several servers")
+async def batch_servers(
+    batch: BatchRequest,
+    user: User = Depends(get_current_user),
+):
+    """Run the operations on the servers, a few at a time, and stream their
+    results as JSON lines as they complete: the ``owner``, ``name`` and
+    ``action`` of the operation, the ``status_code`` of the Hub and its
+    ``detail`` for failures. Starts refused by the Hub spawn limits are retried.
+    """
+    logger.info("Running batch", user=user.name, operations=len(batch.items))
+    return StreamingResponse(
+        stream_batch_results(user.name, batch.items),
+        media_type="application/x-ndjson",
+        # not buffered by the compression, each result is sent as it completes
+        headers={"Cache-Control": "no-store, no-transform"},
+    )
+
+
 @router.post("/server/")
 @router.post("/server/{server_name}")
 async def start_server(
@@ -182,7 +279,7 @@ async def start_server(
     # user starting the server will not be the owner of the server
     server_owner = request.query_params.get("owner", user.name)
     try:
-        response = hub_client.start_server(
+        response = await hub_client.start_server(
             username=server_owner,
             servername=server_name,
         )
@@ -193,7 +290,7 @@ async def start_server(
                 status_code=status.HTTP_403_FORBIDDEN,
             )
         response.raise_for_status()
-    except requests.exceptions.HTTPError as e:
+    except httpx.HTTPStatusError as e:
         raise HTTPException(
             detail=f"Probably server '{server_name}' is already running: {e}",
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -206,6 +303,15 @@ async def start_server(
     return response.status_code
 
 
+async def _get_thumbnail_placeholder(username, server_name, thumbnail) -> typing.Optional[str]:
+    """The placeholder of the current thumbnail of the server, if it's the given one."""
+    existing_server = await HubClient(username=username).get_server(username, server_name)
+    user_options = (existing_server or {}).get("user_options") or {}
+    if user_options.get("thumbnail") == thumbnail:
+        return user_options.get("thumbnail_placeholder")
+    return None
+
+
 @router.put("/server/{server_name}")
 async def update_server(
     server: ServerCreation = Depends(Checker(ServerCreation)),
@@ -216,14 +322,25 @@ async def update_server(
 ):
     _check_if_framework_allowed(server.user_options)
     if thumbnail_data_url:
-        server.user_options.thumbnail = thumbnail_data_url
+        # The current thumbnail of the app, apps created before thumbnails were
+        # stored by the service have it inline as a data url
+        stored_thumbnail = await store_data_url(thumbnail_data_url)
+        if stored_thumbnail:
+            server.user_options.thumbnail, server.user_options.thumbnail_placeholder = stored_thumbnail
+        else:
+            server.user_options.thumbnail = thumbnail_data_url
+            if server.user_options.thumbnail_placeholder is None:
+                # The thumbnail is kept, so is its placeholder
+                server.user_options.thumbnail_placeholder = await _get_thumbnail_placeholder(
+                    user.name, server_name, thumbnail_data_url
+                )
     else:
-        server.user_options.thumbnail = await get_thumbnail_data_url(
+        server.user_options.thumbnail, server.user_options.thumbnail_placeholder = await get_thumbnail_url(
             framework_name=server.user_options.framework, thumbnail=thumbnail
         )
     hub_client = HubClient(username=user.name)
     logger.info("Updating server", server_name=server.servername, user=user.name)
-    edit_server_response = hub_client.edit_server(
+    edit_server_response = await hub_client.edit_server(
         username=user.name,
         servername=server_name,
         user_options=server.user_options,
@@ -242,7 +359,7 @@ async def delete_server(
     """Delete or stop server. Delete if remove is True otherwise stop the server"""
     hub_client = HubClient(username=user.name)
     logger.info("Deleting server", server_name=server_name, user=user.name)
-    return hub_client.delete_server(user.name, server_name=server_name, remove=remove)
+    return await hub_client.delete_server(user.name, server_name=server_name, remove=remove)
 
 
 @router.get(
@@ -252,46 +369,49 @@ async def delete_server(
 )
 async def me(user: User = Depends(get_current_user)):
     """Authenticated function that returns the User model"""
+    if is_jupyterhub_5():
+        # Used by the app sharing UI, which gets the user from this endpoint
+        user.share_permissions = await get_share_permissions(user)
     return user
 
 
 @router.get("/frameworks/", description="Get all frameworks")
-async def get_frameworks(user: User = Depends(get_current_user)):
+async def get_frameworks(request: Request, user: User = Depends(get_current_user)):
     logger.info("Getting all the frameworks")
     config = get_jupyterhub_config()
-    return [
+    return conditional_json_response(request.headers, [
         framework for framework in FRAMEWORKS if framework.name in _get_allowed_frameworks(config)
-    ]
+    ])
 
 
 @router.get("/conda-environments/", description="Get all conda environments")
-async def conda_environments(user: User = Depends(get_current_user)):
+async def conda_environments(request: Request, user: User = Depends(get_current_user)):
     logger.info("Getting conda environments", user=user.name)
     config = get_jupyterhub_config()
     hclient = HubClient(username=user.name)
-    user_from_service = hclient.get_user(user.name)
+    user_from_service = await hclient.get_user(user.name)
     conda_envs = get_conda_envs(config, user_from_service)
     logger.info(f"Found conda environments: {conda_envs}")
-    return conda_envs
+    return conditional_json_response(request.headers, conda_envs)
 
 
 @router.get("/spawner-profiles/", description="Get all spawner profiles")
-async def spawner_profiles(user: User = Depends(get_current_user)):
+async def spawner_profiles(request: Request, user: User = Depends(get_current_user)):
     hclient = HubClient(username=user.name)
-    user_from_service = hclient.get_user(user.name)
+    user_from_service = await hclient.get_user(user.name)
     auth_state = user_from_service.get("auth_state")
     logger.info("Getting spawner profiles", user=user.name)
     config = get_jupyterhub_config()
     spawner_profiles_ = await get_spawner_profiles(config, auth_state=auth_state)
     logger.debug(f"Loaded spawner profiles: {spawner_profiles_}")
-    return spawner_profiles_
+    return conditional_json_response(request.headers, spawner_profiles_)
 
 
 @router.get("/services/", description="Get all services")
-async def hub_services(user: User = Depends(get_current_user)):
+async def hub_services(request: Request, user: User = Depends(get_current_user)):
     logger.info(f"Getting hub services for user: {user}")
     hub_client = HubClient(username=user.name)
-    return hub_client.get_services()
+    return conditional_json_response(request.headers, await hub_client.get_services())
 
 
 @router.post("/app-config-from-git/",)
@@ -312,6 +432,49 @@ async def app_from_git(
     return response
 
 
+@router.get("/thumbnails/{thumbnail_hash}", description="Thumbnail of an app, by the sha256 of its contents")
+async def get_thumbnail(
+    thumbnail_hash: str,
+    request: Request,
+    user: User = Depends(get_current_user),
+):
+    thumbnail_path = thumbnail_store.get_path(thumbnail_hash)
+    if thumbnail_path is None:
+        raise HTTPException(
+            detail=f"Thumbnail '{thumbnail_hash}' not found",
+            status_code=status.HTTP_404_NOT_FOUND,
+        )
+    headers = {
+        # The url changes with the contents
+        "Cache-Control": "private, max-age=31536000, immutable",
+        "ETag": f'"{thumbnail_hash}"',
+        "X-Content-Type-Options": "nosniff",
+        "Content-Security-Policy": "default-src 'none'; style-src 'unsafe-inline'; sandbox",
+    }
+    if etag_matches(request.headers, headers["ETag"]):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    with open(thumbnail_path, "rb") as f:
+        media_type = image_media_type(f.read(16)) or "application/octet-stream"
+    return FileResponse(thumbnail_path, media_type=media_type, headers=headers)
+
+
+@router.get("/stats/", description="Hub API client statistics of the worker serving the request")
+async def hub_client_stats(user: User = Depends(get_current_user)):
+    if not user.admin:
+        raise HTTPException(
+            detail="Only admins can access the service statistics",
+            status_code=status.HTTP_403_FORBIDDEN,
+        )
+    mirror = get_hub_state_mirror()
+    return {
+        "pid": os.getpid(),
+        "hub_requests": get_single_flight().stats(),
+        "user_tokens": get_user_token_pool().stats(),
+        "hub_state_mirror": mirror.stats() if mirror is not None else None,
+        "jupyterhub_config": jupyterhub_config_cache.stats(),
+    }
+
+
 @router.get("/")
 @router.get("/status")
 async def status_endpoint():
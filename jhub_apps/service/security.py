@@ -1,3 +1,4 @@
+import hashlib
 import json
 import os
 
@@ -6,8 +7,9 @@ from fastapi import HTTPException, Security, status
 from fastapi.security import OAuth2AuthorizationCodeBearer, APIKeyCookie
 from fastapi.security.api_key import APIKeyQuery
 
-from jhub_apps.hub_client.hub_client import get_users_and_group_allowed_to_share_with, is_jupyterhub_5
+from jhub_apps.hub_client.coalescing import get_single_flight
 from .auth import _get_jhub_token_from_jwt_token
+from .cache import Cache
 from .client import get_client
 from .models import User
 
@@ -42,8 +44,53 @@ else:
     access_scopes = ["access:services"]
 
 
-### For consideration: optimize performance with a cache instead of
-### always hitting the Hub api?
+### Hub user models are cached for a short time, keyed by a hash of the Hub token,
+### so that the several API calls the UI makes per page cost a single /user request.
+### With a shared cache backend, a user authenticated by a worker is known to all of them.
+### The user's token is only sent to JupyterHub for this lookup (the service calls
+### the Hub with its own tokens), so a token revoked by JupyterHub (e.g. on logout)
+### keeps working here until its entry expires, it's then rejected (401).
+USER_CACHE_TTL = int(os.environ.get("JHUB_APPS_USER_CACHE_TTL", "30"))
+USER_CACHE_MAX_ENTRIES = int(os.environ.get("JHUB_APPS_USER_CACHE_MAX_ENTRIES", "1024"))
+_user_cache = Cache("users", ttl=max(USER_CACHE_TTL, 1), maxsize=USER_CACHE_MAX_ENTRIES)
+
+
+def _token_cache_key(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+async def _get_hub_user(token: str) -> dict:
+    cache_key = _token_cache_key(token)
+    if USER_CACHE_TTL > 0:
+        hub_user = _user_cache.get(cache_key)
+        if hub_user is not None:
+            return hub_user
+    client = get_client()
+    endpoint = "/user"
+    # normally we auth to Hub API with service api token,
+    # but this time auth as the user token to get user model
+    headers = {"Authorization": f"Bearer {token}"}
+    # The UI fires several API calls at once, which share a single /user request
+    resp = await get_single_flight().get(client, endpoint, headers=headers)
+    if resp.is_error:
+        # Log sensitive information securely (not in response)
+        logger.error(
+            "Failed to get user info from token",
+            request_url=str(resp.request.url),
+            response_code=resp.status_code,
+            # Only log token hash for security
+            token_hash=cache_key[:12],
+        )
+        raise HTTPException(
+            status.HTTP_401_UNAUTHORIZED,
+            detail="Authentication failed. Please try logging in again.",
+        )
+    hub_user = resp.json()
+    if USER_CACHE_TTL > 0:
+        _user_cache.set(cache_key, hub_user)
+    return hub_user
+
+
 async def get_current_user(
     auth_param: str = Security(auth_by_param),
     auth_header: str = Security(auth_by_header),
@@ -59,28 +106,8 @@ async def get_current_user(
 
     token = _get_jhub_token_from_jwt_token(token)
 
-    async with get_client() as client:
-        endpoint = "/user"
-        # normally we auth to Hub API with service api token,
-        # but this time auth as the user token to get user model
-        headers = {"Authorization": f"Bearer {token}"}
-        resp = await client.get(endpoint, headers=headers)
-        if resp.is_error:
-            # Log sensitive information securely (not in response)
-            logger.error(
-                "Failed to get user info from token",
-                request_url=str(resp.request.url),
-                response_code=resp.status_code,
-                # Only log token hash for security
-                token_hash=hash(token) if token else None
-            )
-            raise HTTPException(
-                status.HTTP_401_UNAUTHORIZED,
-                detail="Authentication failed. Please try logging in again.",
-            )
-    user = User(**resp.json())
-    if is_jupyterhub_5():
-        user.share_permissions = get_users_and_group_allowed_to_share_with(user)
+    # share_permissions are only computed by the endpoints which need them
+    user = User(**await _get_hub_user(token))
     if any(scope in user.scopes for scope in access_scopes):
         return user
     else:
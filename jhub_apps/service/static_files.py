@@ -0,0 +1,115 @@
+import hashlib
+import mimetypes
+import os
+import re
+import typing
+from pathlib import Path
+from urllib.parse import parse_qs
+
+from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse
+from starlette.types import Scope
+
+from jhub_apps.service.compression import accepted_encodings
+
+### The UI bundles are built with gzip and brotli variants next to them
+### (ui/compress-assets.mjs), served instead of the bundle itself to the
+### browsers accepting them. Files requested with the current version of the
+### UI bundles (`?v=<get_ui_assets_version()>`), or whose name holds a content
+### hash, never change and are cached for a year, the others (including requests
+### with another or an empty version) are revalidated with their ETag.
+STATIC_DIR = Path(__file__).parent.parent / "static"
+# The UI bundles, referenced by the pages with the version of their contents
+UI_ASSETS = ["js/index.js", "css/index.css"]
+PRECOMPRESSED_ENCODINGS = [("br", ".br"), ("gzip", ".gz")]
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
+# e.g. index-CnamuRvv.js, as named by vite
+_HASHED_FILE_NAME = re.compile(r"-[A-Za-z0-9_-]{8}\.(js|css)$")
+
+
+def get_ui_assets_version() -> str:
+    """Version of the UI bundles: the package version and a hash of their contents,
+    computed once per worker as the bundles only change with the package.
+    """
+    global _ui_assets_version
+    if _ui_assets_version is None:
+        from jhub_apps.version import get_version
+        digest = hashlib.sha256(str(get_version()).encode())
+        for asset in UI_ASSETS:
+            try:
+                digest.update((STATIC_DIR / asset).read_bytes())
+            except OSError:
+                # e.g. the UI wasn't built in a development checkout
+                pass
+        _ui_assets_version = digest.hexdigest()[:16]
+    return _ui_assets_version
+
+
+_ui_assets_version: typing.Optional[str] = None
+
+
+def _is_versioned(scope: Scope) -> bool:
+    """Whether the file is requested with the current version of the UI bundles."""
+    query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+    return query.get("v") == [get_ui_assets_version()]
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """StaticFiles serving the precompressed variants of the files, with cache headers."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # full path -> [(encoding, variant path, variant stat)]
+        self._variants: typing.Dict[str, typing.List[typing.Tuple[str, str, os.stat_result]]] = {}
+
+    def _find_variants(self, full_path: str, stat_result: os.stat_result):
+        variants = self._variants.get(full_path)
+        if variants is None:
+            variants = []
+            for encoding, suffix in PRECOMPRESSED_ENCODINGS:
+                try:
+                    variant_stat = os.stat(full_path + suffix)
+                except OSError:
+                    continue
+                # a variant older than the file is stale, e.g. after a rebuild without compressing
+                if variant_stat.st_mtime >= stat_result.st_mtime:
+                    variants.append((encoding, full_path + suffix, variant_stat))
+            self._variants[full_path] = variants
+        return variants
+
+    def file_response(
+        self,
+        full_path: typing.Union[str, "os.PathLike[str]"],
+        stat_result: os.stat_result,
+        scope: Scope,
+        status_code: int = 200,
+    ) -> Response:
+        request_headers = Headers(scope=scope)
+        full_path = os.fspath(full_path)
+        headers = {}
+        if _is_versioned(scope) or _HASHED_FILE_NAME.search(full_path):
+            headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+        else:
+            headers["Cache-Control"] = REVALIDATE_CACHE_CONTROL
+        served_path, served_stat, media_type = full_path, stat_result, None
+        variants = self._find_variants(full_path, stat_result)
+        if variants:
+            headers["Vary"] = "Accept-Encoding"
+            accepted = accepted_encodings(request_headers)
+            for encoding, variant_path, variant_stat in variants:
+                if encoding in accepted:
+                    headers["Content-Encoding"] = encoding
+                    served_path, served_stat = variant_path, variant_stat
+                    media_type, _ = mimetypes.guess_type(full_path)
+                    break
+        # the ETag is derived from the served file, each encoding has its own
+        response = FileResponse(
+            served_path, status_code=status_code, stat_result=served_stat, media_type=media_type, headers=headers
+        )
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
@@ -0,0 +1,260 @@
+import asyncio
+import base64
+import binascii
+import hashlib
+import io
+import os
+import re
+import typing
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import structlog
+
+logger = structlog.get_logger(__name__)
+
+### Thumbnails are stored once on the local disk of the service, named after the
+### sha256 of their contents, and served by the service from /thumbnails/{sha256}.
+### The user_options of a server only keep the url of its thumbnail, instead of
+### the image itself as a base64 data url, which every Hub API response listing
+### servers used to carry.
+THUMBNAIL_STORE_PATH = os.environ.get("JHUB_APPS_THUMBNAIL_STORE_PATH", "jhub-apps-thumbnails")
+THUMBNAIL_URL_PREFIX = os.getenv("JUPYTERHUB_SERVICE_PREFIX", "").rstrip("/") + "/thumbnails/"
+### Uploaded images are downscaled to fit the app cards and re-encoded, in a pool
+### of threads (Pillow releases the GIL while decoding, resizing and encoding).
+### Without Pillow, the images are stored as uploaded.
+THUMBNAIL_SIZE = tuple(
+    int(side) for side in os.environ.get("JHUB_APPS_THUMBNAIL_SIZE", "640x360").split("x")
+)
+THUMBNAIL_FORMAT = os.environ.get("JHUB_APPS_THUMBNAIL_FORMAT", "webp")
+THUMBNAIL_WORKERS = int(os.environ.get("JHUB_APPS_THUMBNAIL_WORKERS", 2))
+THUMBNAIL_QUALITY = 80
+# Images with more pixels are rejected rather than decoded
+THUMBNAIL_MAX_PIXELS = 50_000_000
+# Size of the blurry preview inlined in the user_options, shown while the thumbnail loads
+PLACEHOLDER_SIZE = (16, 16)
+
+_SHA256_HEX = re.compile(r"^[0-9a-f]{64}$")
+
+# Maximum size of an uploaded thumbnail: 5MB
+MAX_THUMBNAIL_SIZE = 5 * 1024 * 1024
+# Uploads are read by chunks, and rejected as soon as they get over MAX_THUMBNAIL_SIZE
+UPLOAD_CHUNK_SIZE = 64 * 1024
+# Multipart requests announcing a larger body are rejected before it is read,
+# it holds the thumbnail along with the other (small) form fields
+MAX_UPLOAD_REQUEST_SIZE = MAX_THUMBNAIL_SIZE + 1024 * 1024
+
+# (magic bytes, media type) of the images accepted as thumbnails
+UPLOAD_IMAGE_TYPES = [
+    (b"\x89PNG", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF8", "image/gif"),
+]
+
+
+def image_media_type(head: bytes) -> typing.Optional[str]:
+    """Media type of an image given its first bytes, None if it isn't a known image format."""
+    for magic, media_type in UPLOAD_IMAGE_TYPES:
+        if head.startswith(magic):
+            return media_type
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    # the framework logos
+    if head.lstrip().startswith((b"<svg", b"<?xml")):
+        return "image/svg+xml"
+    return None
+
+
+class ThumbnailTooLarge(ValueError):
+    pass
+
+
+async def read_upload(upload) -> bytearray:
+    """Reads an uploaded thumbnail by chunks, raises ThumbnailTooLarge as soon as
+    it gets over MAX_THUMBNAIL_SIZE and ValueError if its first chunk isn't an image.
+
+    The chunks are appended to a single buffer, which is used as is by the
+    rest of the pipeline.
+    """
+    if upload.size is not None and upload.size > MAX_THUMBNAIL_SIZE:
+        raise ThumbnailTooLarge(f"Thumbnail of {upload.size} bytes")
+    chunk = await upload.read(UPLOAD_CHUNK_SIZE)
+    if not any(chunk.startswith(magic) for magic, _ in UPLOAD_IMAGE_TYPES):
+        raise ValueError("Invalid image format")
+    contents = bytearray(chunk)
+    while chunk:
+        chunk = await upload.read(UPLOAD_CHUNK_SIZE)
+        if len(contents) + len(chunk) > MAX_THUMBNAIL_SIZE:
+            raise ThumbnailTooLarge(f"Thumbnail of more than {MAX_THUMBNAIL_SIZE} bytes")
+        contents += chunk
+    return contents
+
+
+class ThumbnailStore:
+    """Content addressed store of the thumbnails, files are written once and never modified."""
+
+    def __init__(self, path: typing.Union[str, Path]):
+        self.path = Path(path)
+
+    def put(self, contents: typing.Union[bytes, bytearray]) -> str:
+        """Stores the thumbnail, if not already stored, and returns its sha256."""
+        digest = hashlib.sha256(contents).hexdigest()
+        file_path = self.path / digest
+        if not file_path.exists():
+            self.path.mkdir(parents=True, exist_ok=True)
+            # written under a temporary name first, readers never see a partial file
+            tmp_path = self.path / f".{digest}.{uuid.uuid4().hex}.tmp"
+            tmp_path.write_bytes(contents)
+            os.replace(tmp_path, file_path)
+            logger.info("Stored thumbnail", sha256=digest, size=len(contents))
+        return digest
+
+    def get_path(self, digest: str) -> typing.Optional[Path]:
+        if not _SHA256_HEX.match(digest):
+            return None
+        file_path = self.path / digest
+        return file_path if file_path.is_file() else None
+
+
+thumbnail_store = ThumbnailStore(THUMBNAIL_STORE_PATH)
+
+
+class NormalizedThumbnail(typing.NamedTuple):
+    contents: typing.Union[bytes, bytearray]
+    # base64 data url of a tiny version of the image, None if it couldn't be made
+    placeholder: typing.Optional[str]
+
+
+class StoredThumbnail(typing.NamedTuple):
+    url: str
+    placeholder: typing.Optional[str]
+
+
+def _encode_image(image, image_format: str, **params) -> bytes:
+    buffer = io.BytesIO()
+    if image_format == "webp":
+        image.save(buffer, format="WEBP", quality=THUMBNAIL_QUALITY, method=4, **params)
+    else:
+        image.save(buffer, format="JPEG", quality=THUMBNAIL_QUALITY, optimize=True, progressive=True, **params)
+    return buffer.getvalue()
+
+
+def _output_format() -> str:
+    from PIL import features
+    if THUMBNAIL_FORMAT == "webp" and not features.check("webp"):
+        return "jpeg"
+    return THUMBNAIL_FORMAT
+
+
+def _to_output_mode(image, image_format: str):
+    from PIL import Image
+    has_alpha = image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info
+    if not has_alpha:
+        return image.convert("RGB")
+    image = image.convert("RGBA")
+    if image_format == "webp":
+        return image
+    # JPEG has no transparency, flatten on white like the cards' background
+    background = Image.new("RGB", image.size, (255, 255, 255))
+    background.paste(image, mask=image.getchannel("A"))
+    return background
+
+
+def normalize_thumbnail(contents: typing.Union[bytes, bytearray]) -> NormalizedThumbnail:
+    """Downscales the image to fit in THUMBNAIL_SIZE and re-encodes it as
+    THUMBNAIL_FORMAT, along with a placeholder for it.
+
+    Raises ValueError if the image can't be decoded. SVG images, and all images
+    when Pillow isn't installed, are returned as they are.
+    """
+    if image_media_type(contents[:16]) == "image/svg+xml":
+        return NormalizedThumbnail(contents, None)
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:
+        logger.info("Pillow is not installed, storing thumbnail as uploaded")
+        return NormalizedThumbnail(contents, None)
+    image_format = _output_format()
+    try:
+        with Image.open(io.BytesIO(contents)) as image:
+            original_size = image.size
+            if image.width * image.height > THUMBNAIL_MAX_PIXELS:
+                raise ValueError(f"Image too large: {image.width}x{image.height}")
+            # JPEGs are decoded at a reduced scale, much faster for large photos
+            image.draft("RGB", THUMBNAIL_SIZE)
+            image = ImageOps.exif_transpose(image)
+            image = _to_output_mode(image, image_format)
+            image.thumbnail(THUMBNAIL_SIZE, Image.LANCZOS)
+            normalized = _encode_image(image, image_format)
+            image.thumbnail(PLACEHOLDER_SIZE, Image.LANCZOS)
+            placeholder = _encode_image(image, image_format)
+    except ValueError:
+        raise
+    except Exception as e:
+        # Pillow raises various errors on truncated or malformed images
+        raise ValueError(f"Invalid image: {e}") from e
+    fits = original_size[0] <= THUMBNAIL_SIZE[0] and original_size[1] <= THUMBNAIL_SIZE[1]
+    if fits and len(contents) <= len(normalized):
+        # already small, e.g. the logos of the frameworks
+        normalized = contents
+    placeholder_url = f"data:image/{image_format};base64,{base64.b64encode(placeholder).decode()}"
+    logger.info(
+        "Normalized thumbnail", original_size=original_size, original_bytes=len(contents),
+        bytes=len(normalized), format=image_format,
+    )
+    return NormalizedThumbnail(normalized, placeholder_url)
+
+
+_executor: typing.Optional[ThreadPoolExecutor] = None
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=THUMBNAIL_WORKERS, thread_name_prefix="jhub-apps-thumbnails")
+    return _executor
+
+
+def shutdown_thumbnail_workers():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False)
+        _executor = None
+
+
+def _normalize_and_store(contents: typing.Union[bytes, bytearray]) -> StoredThumbnail:
+    normalized = normalize_thumbnail(contents)
+    return StoredThumbnail(thumbnail_url(thumbnail_store.put(normalized.contents)), normalized.placeholder)
+
+
+def thumbnail_url(digest: str) -> str:
+    return f"{THUMBNAIL_URL_PREFIX}{digest}"
+
+
+async def store_thumbnail(contents: typing.Union[bytes, bytearray]) -> StoredThumbnail:
+    """Normalizes and stores the thumbnail in the worker pool, off the event loop,
+    and returns the url it is served from. Raises ValueError for invalid images.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_executor(), _normalize_and_store, contents)
+
+
+async def store_data_url(data_url: str) -> typing.Optional[StoredThumbnail]:
+    """Moves the image of a base64 data url to the store, None if it isn't a
+    base64 data url of a valid image.
+    """
+    match = re.match(r"^data:image/[\w.+-]+;base64,", data_url)
+    if not match:
+        return None
+    try:
+        contents = base64.b64decode(data_url[match.end():], validate=True)
+    except (binascii.Error, ValueError):
+        return None
+    if image_media_type(contents[:16]) is None:
+        return None
+    try:
+        return await store_thumbnail(contents)
+    except ValueError as e:
+        logger.warning("Not storing invalid data url thumbnail", error=str(e))
+        return None
@@ -1,24 +1,36 @@
+import asyncio
 import base64
-import itertools
+import hashlib
+import threading
+import time
 
 import structlog
 import os
 
-from cachetools import cached, TTLCache
-from unittest.mock import Mock
-
-from fastapi import HTTPException, status
-from jupyterhub.app import JupyterHub
+from fastapi import HTTPException, Response, status
 from traitlets.config import LazyConfigValue
 
+from jhub_apps.config_snapshot import load_config_snapshot
 from jhub_apps.config_utils import JAppsConfig
 from jhub_apps.hub_client.hub_client import HubClient
 from jhub_apps.service.models import UserOptions
+from jhub_apps.service.responses import JAppsJSONResponse
+from jhub_apps.service.thumbnails import (
+    MAX_THUMBNAIL_SIZE,
+    StoredThumbnail,
+    ThumbnailTooLarge,
+    read_upload,
+    store_thumbnail,
+)
 from jhub_apps.spawner.types import FrameworkConf, FRAMEWORKS_MAPPING, FRAMEWORKS
-from slugify import slugify
 
 
+# Seconds after which the JupyterHub config is reloaded, even if its file didn't change
 CACHE_JUPYTERHUB_CONFIG_TIMEOUT = 180
+# Seconds between two checks of the JupyterHub config file for changes
+JUPYTERHUB_CONFIG_CHECK_INTERVAL = 5
+# Seconds before expiry at which the service reloads the config in the background
+JUPYTERHUB_CONFIG_REFRESH_AHEAD = 30
 logger = structlog.get_logger(__name__)
 
 def _replace_JAppsConfig_config_with_validated_config(config, validated_config):
@@ -37,20 +49,151 @@ def _replace_JAppsConfig_config_with_validated_config(config, validated_config):
         setattr(config, trait_name, getattr(validated_config, trait_name))
 
 
-# Cache JupyterHub config as it might be an expensive operation
-@cached(cache=TTLCache(maxsize=1024, ttl=CACHE_JUPYTERHUB_CONFIG_TIMEOUT))
-def get_jupyterhub_config():
-    hub = JupyterHub()
-    jhub_config_file_path = os.environ["JHUB_JUPYTERHUB_CONFIG"]
-    logger.info(f"Getting JHub config from file: {jhub_config_file_path}")
-    hub.load_config_file(jhub_config_file_path)
-    japps_config = JAppsConfig.instance(config=hub.config)
-    _replace_JAppsConfig_config_with_validated_config(hub.config.JAppsConfig, japps_config)
-    config = hub.config
+def _load_jupyterhub_config(jhub_config_file_path):
+    snapshot_path = os.environ.get("JHUB_APPS_CONFIG_SNAPSHOT")
+    config = load_config_snapshot(snapshot_path, jhub_config_file_path) if snapshot_path else None
+    if config is None:
+        # Only imported when the config file has to be executed
+        from jupyterhub.app import JupyterHub
+        hub = JupyterHub()
+        logger.info(f"Getting JHub config from file: {jhub_config_file_path}")
+        hub.load_config_file(jhub_config_file_path)
+        config = hub.config
+    else:
+        logger.info(f"Getting JHub config from snapshot: {snapshot_path}")
+    # A new instance, rather than the singleton, so that reloads validate the new values
+    japps_config = JAppsConfig(config=config)
+    _replace_JAppsConfig_config_with_validated_config(config.JAppsConfig, japps_config)
     logger.debug(f"JHub Apps config: {config.JAppsConfig}")
     return config
 
 
+def _file_digest(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+class JupyterHubConfigCache:
+    """The JupyterHub config loaded from JHUB_JUPYTERHUB_CONFIG, as loading it is an
+    expensive operation.
+
+    The config is reloaded when the config file changes, which is checked at most
+    every JUPYTERHUB_CONFIG_CHECK_INTERVAL seconds (mtime and size, then the content
+    hash), or when it is older than CACHE_JUPYTERHUB_CONFIG_TIMEOUT, as it may
+    depend on other files or the environment. The service refreshes it in the
+    background (see refresh_periodically): requests then get the config loaded
+    so far and only load it themselves when there is none yet.
+    """
+
+    def __init__(
+            self,
+            ttl: float = CACHE_JUPYTERHUB_CONFIG_TIMEOUT,
+            check_interval: float = JUPYTERHUB_CONFIG_CHECK_INTERVAL,
+    ):
+        self.ttl = ttl
+        self.check_interval = check_interval
+        self.config = None
+        self.loaded_at = None
+        self.loads = 0
+        self.last_load_duration = None
+        self._file_stat = None
+        self._file_digest = None
+        self._checked_at = 0.0
+        # requests run in the event loop and the background refresh in a thread
+        self._lock = threading.Lock()
+        # whether refresh_periodically is running
+        self._refreshed_in_background = False
+
+    def stats(self):
+        return {
+            "loads": self.loads,
+            "last_load_duration": self.last_load_duration,
+            "age": round(time.monotonic() - self.loaded_at, 3) if self.loaded_at is not None else None,
+        }
+
+    def get(self):
+        if self.config is None:
+            return self.load()
+        if self._refreshed_in_background:
+            # reloading blocks the event loop, left to refresh_periodically
+            return self.config
+        now = time.monotonic()
+        if now - self.loaded_at >= self.ttl:
+            return self.load()
+        if now - self._checked_at >= self.check_interval:
+            self._checked_at = now
+            if self.file_changed():
+                return self.load()
+        return self.config
+
+    def file_changed(self) -> bool:
+        path = os.environ["JHUB_JUPYTERHUB_CONFIG"]
+        try:
+            stat = os.stat(path)
+        except OSError:
+            # keep the config loaded so far
+            return False
+        file_stat = (stat.st_mtime_ns, stat.st_size)
+        if file_stat == self._file_stat:
+            return False
+        if _file_digest(path) == self._file_digest:
+            # touched, but the same content
+            self._file_stat = file_stat
+            return False
+        return True
+
+    def load(self):
+        requested_at = time.monotonic()
+        with self._lock:
+            if self.loaded_at is not None and self.loaded_at >= requested_at:
+                # loaded by another thread while waiting for the lock
+                return self.config
+            path = os.environ["JHUB_JUPYTERHUB_CONFIG"]
+            # Taken before loading, so that a change made while loading triggers another reload
+            stat = os.stat(path)
+            file_digest = _file_digest(path)
+            start = time.perf_counter()
+            config = _load_jupyterhub_config(path)
+            self.last_load_duration = round(time.perf_counter() - start, 3)
+            self.config = config
+            self._file_stat = (stat.st_mtime_ns, stat.st_size)
+            self._file_digest = file_digest
+            self.loaded_at = self._checked_at = time.monotonic()
+            self.loads += 1
+        logger.info("Loaded JupyterHub config", path=path, duration=self.last_load_duration)
+        return config
+
+    def _needs_refresh(self) -> bool:
+        return (
+            self.config is None
+            or time.monotonic() - self.loaded_at >= self.ttl - JUPYTERHUB_CONFIG_REFRESH_AHEAD
+            or self.file_changed()
+        )
+
+    async def refresh_periodically(self):
+        """Reloads the config in a thread before it expires or soon after its file changes."""
+        self._refreshed_in_background = True
+        try:
+            while True:
+                try:
+                    if self._needs_refresh():
+                        await asyncio.to_thread(self.load)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.warning("Failed to refresh JupyterHub config, keeping the previous one", error=str(e))
+                await asyncio.sleep(self.check_interval)
+        finally:
+            self._refreshed_in_background = False
+
+
+jupyterhub_config_cache = JupyterHubConfigCache()
+
+
+def get_jupyterhub_config():
+    return jupyterhub_config_cache.get()
+
+
 def get_conda_envs(config, user):
     """This will extract conda environment from the JupyterHub config"""
     if isinstance(config.JAppsConfig.conda_envs, list):
@@ -70,6 +213,8 @@ def get_conda_envs(config, user):
         )
 
 def get_fake_spawner_object(auth_state):
+    # Imported on first use, only needed when profile_list is a callable
+    from unittest.mock import Mock
     fake_spawner = Mock()
 
     async def get_auth_state():
@@ -88,6 +233,7 @@ def _slugify_profile_list(profile_list):
         # empty profile lists are just returned
         return profile_list
 
+    from slugify import slugify
     for profile in profile_list:
         # generate missing slug fields from display_name
         if 'slug' not in profile:
@@ -142,42 +288,66 @@ def get_default_thumbnail(framework_name) -> str:
     )
 
 
-async def get_thumbnail_data_url(framework_name, thumbnail):
-    logger.info("Getting thumbnail data url", framework=framework_name)
-    # Maximum thumbnail size: 5MB
-    MAX_THUMBNAIL_SIZE = 5 * 1024 * 1024
-
+async def get_thumbnail_url(framework_name, thumbnail) -> StoredThumbnail:
+    """Stores the uploaded thumbnail, or the logo of the framework if there is none,
+    and returns the url it is served from along with its placeholder.
+    """
+    logger.info("Getting thumbnail url", framework=framework_name)
     if thumbnail:
         logger.info("Got user provided thumbnail")
-        thumbnail_contents = await thumbnail.read()
-
-        # Validate thumbnail size
-        if len(thumbnail_contents) > MAX_THUMBNAIL_SIZE:
+        try:
+            thumbnail_contents = await read_upload(thumbnail)
+        except ThumbnailTooLarge:
             from fastapi import HTTPException, status
             raise HTTPException(
                 status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
                 detail=f"Thumbnail file too large. Maximum size is {MAX_THUMBNAIL_SIZE / (1024 * 1024)}MB"
             )
-
-        # Validate it's an image file
-        if thumbnail_contents[:4] not in [b'\x89PNG', b'\xff\xd8\xff', b'GIF8']:
+        except ValueError:
             from fastapi import HTTPException, status
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Invalid image format. Only PNG, JPEG, and GIF are supported."
             )
-
-        thumbnail_data_url = encode_file_to_data_url(
-            thumbnail.filename, thumbnail_contents
-        )
     else:
         logger.info("Getting default thumbnail")
         framework: FrameworkConf = FRAMEWORKS_MAPPING.get(framework_name)
-        thumbnail_path = framework.logo_path
-        thumbnail_data_url = encode_file_to_data_url(
-            filename=thumbnail_path.name, file_contents=thumbnail_path.read_bytes()
+        thumbnail_contents = framework.logo_path.read_bytes()
+    try:
+        return await store_thumbnail(thumbnail_contents)
+    except ValueError as e:
+        from fastapi import HTTPException, status
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid image: {e}"
         )
-    return thumbnail_data_url
+
+
+def etag_matches(request_headers, etag: str) -> bool:
+    """Whether the If-None-Match header of the request holds the (strong) ETag,
+    i.e. the client can be answered with 304 Not Modified.
+    """
+    if_none_match = request_headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return etag in [tag[2:] if tag.startswith("W/") else tag for tag in tags]
+
+
+def conditional_json_response(request_headers, content) -> Response:
+    """JSON response with a strong ETag computed from its body, or 304 Not Modified
+    if the client already has it. The body is never sent again while it's unchanged.
+    """
+    response = JAppsJSONResponse(content=content)
+    etag = f'"{hashlib.sha256(response.body).hexdigest()[:32]}"'
+    # user specific, and revalidated before being used
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(request_headers, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    response.headers.update(headers)
+    return response
 
 
 def get_theme(config):
@@ -188,24 +358,33 @@ def get_theme(config):
         return None
 
 
-def get_shared_servers(current_hub_user):
-    # Filter servers shared with the user
-    hub_client_service = HubClient()
-    all_users_servers = list(itertools.chain.from_iterable([
-        list(user['servers'].values()) for user in hub_client_service.get_users()
-    ]))
-    user_servers_without_default_jlab = list(filter(lambda server: server["name"] != "", all_users_servers))
+async def get_shared_servers(current_hub_user):
+    """Returns the full server models of the apps shared with the user.
+
+    Only the owners of the shared apps are looked up, so the cost depends on
+    the number of shared apps rather than the number of users in the hub.
+    """
     hub_client_user = HubClient(username=current_hub_user['name'])
-    shared_servers = hub_client_user.get_shared_servers()
-    shared_server_names = {
-        shared_server["server"]["name"] for shared_server in shared_servers
-        # remove shared apps by current user
-        if shared_server["server"]["user"]["name"] != current_hub_user['name']
-    }
-    shared_servers_rich = [
-        server for server in user_servers_without_default_jlab
-        if server["name"] in shared_server_names
-    ]
+    shared_servers = await hub_client_user.get_shared_servers()
+    # owner -> names of their servers shared with the user, in the order they were listed
+    shared_server_names_by_owner = {}
+    for shared_server in shared_servers:
+        owner = shared_server["server"]["user"]["name"]
+        server_name = shared_server["server"]["name"]
+        # remove shared apps by current user and the default JupyterLab servers
+        if owner == current_hub_user['name'] or server_name == "":
+            continue
+        shared_server_names_by_owner.setdefault(owner, {})[server_name] = None
+    hub_client_service = HubClient()
+    owners = list(shared_server_names_by_owner)
+    owners_servers = await asyncio.gather(
+        *(hub_client_service.get_user_servers(owner) for owner in owners)
+    )
+    shared_servers_rich = []
+    for owner, owner_servers in zip(owners, owners_servers):
+        for server_name in shared_server_names_by_owner[owner]:
+            if owner_servers and server_name in owner_servers:
+                shared_servers_rich.append(owner_servers[server_name])
     return shared_servers_rich
 
 
@@ -4,6 +4,8 @@ import signal
 import structlog
 
 from jhub_apps.hub_client.hub_client import HubClient
+from jhub_apps.hub_client.token_pool import close_user_token_pool
+from jhub_apps.hub_client.transport import close_hub_http_client
 from jhub_apps.service.logging_utils import setup_logging
 from jhub_apps.service.models import StartupApp
 from jhub_apps.service.utils import get_jupyterhub_config
@@ -52,6 +54,9 @@ async def async_main():
 
     except asyncio.CancelledError:
         logger.info("Shutdown requested")
+    finally:
+        await close_user_token_pool()
+        await close_hub_http_client()
 
 
 async def instantiate_startup_apps(
@@ -61,7 +66,7 @@ async def instantiate_startup_apps(
     await asyncio.sleep(1)
 
     hub_client = HubClient(username=username)
-    existing_servers = hub_client.get_server(username=username)
+    existing_servers = await hub_client.get_server(username=username)
     for startup_app in user_apps_list:
         user_options = startup_app.user_options
         normalized_servername = startup_app.normalized_servername
@@ -69,34 +74,34 @@ async def instantiate_startup_apps(
         # delete server if it exists
         while normalized_servername in existing_servers:
             logger.info(f"Deleting server {normalized_servername}")
-            hub_client.delete_server(
+            await hub_client.delete_server(
                 username, normalized_servername, remove=True
             )
             await asyncio.sleep(1)
-            existing_servers = hub_client.get_server(username=username)
+            existing_servers = await hub_client.get_server(username=username)
 
         # create the server
         logger.info(f"Creating server {normalized_servername}")
         while normalized_servername not in existing_servers:
-            hub_client.create_server(
+            await hub_client.create_server(
                 username=username,
                 servername=normalized_servername,
                 user_options=user_options,
             )
             await asyncio.sleep(1)
-            existing_servers = hub_client.get_server(username=username)
+            existing_servers = await hub_client.get_server(username=username)
 
         # turn off the server
         logger.info(f"Stopping server {normalized_servername}")
         while not existing_servers[normalized_servername]["stopped"]:
-            status_code = hub_client.delete_server(
+            status_code = await hub_client.delete_server(
                 username, normalized_servername, remove=False
             )
             if status_code == 204:
                 # server stopped successfully
                 break
             await asyncio.sleep(1)
-            existing_servers = hub_client.get_server(username=username)
+            existing_servers = await hub_client.get_server(username=username)
 
 
 async def shutdown(sig):
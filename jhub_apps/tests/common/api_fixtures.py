@@ -6,7 +6,14 @@ from jhub_apps.tests.common.constants import MOCK_USER
 
 
 @pytest.fixture
-def client():
+def thumbnail_store(tmp_path, monkeypatch):
+    from jhub_apps.service.thumbnails import thumbnail_store
+    monkeypatch.setattr(thumbnail_store, "path", tmp_path / "thumbnails")
+    return thumbnail_store
+
+
+@pytest.fixture
+def client(thumbnail_store):
     logging_format = (
         "%(asctime)s %(levelname)9s %(name)s:%(lineno)4s: %(message)s"
     )
@@ -0,0 +1,103 @@
+import inspect
+import itertools
+import json
+import typing
+from unittest.mock import patch
+
+import httpx
+
+HUB_API_URL = "http://hub.test/hub/api"
+
+
+class FakeHubAPI:
+    """In-memory stand-in for the JupyterHub REST API, served through httpx.MockTransport.
+
+    Routes are registered as ``(method, path) -> handler`` where the handler receives
+    the ``httpx.Request`` and returns (or is a coroutine returning) an ``httpx.Response``
+    or json-able data for a 200 response.
+    Token creation and revocation for users are handled out of the box.
+    """
+
+    def __init__(self):
+        self.routes: typing.Dict[typing.Tuple[str, str], typing.Callable] = {}
+        self.requests: typing.List[httpx.Request] = []
+        self._token_ids = itertools.count(1)
+        self.scopes = ["read:users:name", "read:groups:name"]
+
+    def add(self, method: str, path: str, handler):
+        if not callable(handler):
+            data = handler
+            handler = lambda request: data  # noqa: E731
+        self.routes[(method.upper(), path)] = handler
+
+    @staticmethod
+    def paginated(items: typing.List[dict], max_limit: int = 200):
+        """Handler serving `items` with JupyterHub's offset/limit pagination."""
+        def handler(request: httpx.Request):
+            if "jupyterhub-pagination" not in request.headers.get("Accept", ""):
+                return items
+            offset = int(request.url.params.get("offset", 0))
+            limit = min(int(request.url.params.get("limit", max_limit)), max_limit)
+            next_offset = offset + limit
+            return {
+                "items": items[offset:next_offset],
+                "_pagination": {
+                    "offset": offset,
+                    "limit": limit,
+                    "total": len(items),
+                    "next": {"offset": next_offset, "limit": limit} if next_offset < len(items) else None,
+                },
+            }
+        return handler
+
+    def calls(self, method: str = None, path: str = None) -> typing.List[httpx.Request]:
+        return [
+            request for request in self.requests
+            if (method is None or request.method == method.upper())
+            and (path is None or self.path(request) == path)
+        ]
+
+    @staticmethod
+    def path(request: httpx.Request) -> str:
+        return request.url.path[len("/hub/api"):]
+
+    async def _handle(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+        path = self.path(request)
+        handler = self.routes.get((request.method, path))
+        if handler is None:
+            handler = self._default_handler(request, path)
+        result = handler(request)
+        if inspect.isawaitable(result):
+            result = await result
+        if isinstance(result, httpx.Response):
+            return result
+        return httpx.Response(200, json=result)
+
+    def _default_handler(self, request, path):
+        parts = path.strip("/").split("/")
+        if parts[0] == "users" and len(parts) == 3 and parts[2] == "tokens" and request.method == "POST":
+            def create_token(request):
+                token_id = next(self._token_ids)
+                expires_in = json.loads(request.content).get("expires_in")
+                return httpx.Response(201, json={
+                    "id": f"a{token_id}",
+                    "token": f"token-{token_id}",
+                    "scopes": self.scopes,
+                    "expires_in": expires_in,
+                })
+            return create_token
+        if parts[0] == "users" and len(parts) == 4 and parts[2] == "tokens" and request.method == "DELETE":
+            return lambda request: httpx.Response(204)
+        return lambda request: httpx.Response(404, json={"message": f"Not found: {path}"})
+
+    def client(self) -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            base_url=HUB_API_URL, transport=httpx.MockTransport(self._handle)
+        )
+
+    def patch(self):
+        """Make the shared Hub http client use this fake API."""
+        return patch(
+            "jhub_apps.hub_client.transport._create_hub_http_client", side_effect=self.client
+        )
@@ -25,10 +25,10 @@ def retry_test(max_attempts=5, delay=1):
 
 
 def test_startup_apps(jupyterhub_manager):
-    from jhub_apps.hub_client.hub_client import HubClient
+    from jhub_apps.hub_client.hub_client import SyncHubClient
 
     # get admin servers
-    hc = HubClient(username="admin")
+    hc = SyncHubClient(username="admin")
 
     expected_servernames = [hc.normalize_server_name(name) for name in["admin's-startup-server", "admin's-2nd-startup-server"]]
 
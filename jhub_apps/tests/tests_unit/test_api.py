@@ -1,14 +1,18 @@
+import asyncio
+import base64
 import io
 import json
+import re
 from unittest.mock import patch, Mock
 
 import pytest
 
 from jhub_apps.hub_client.hub_client import HubClient
-from jhub_apps.service.models import UserOptions, ServerCreation, Repository
+from jhub_apps.service.models import UserOptions, ServerCreation, Repository, User
 from jhub_apps.service.utils import get_shared_servers
 from jhub_apps.spawner.types import FRAMEWORKS, Framework
 from jhub_apps.tests.common.constants import MOCK_USER
+from jhub_apps.tests.common.images import png_image
 
 MOCK_ALLOW_ALL_FRAMEWORKS_CONFIG = Mock(
     JAppsConfig=Mock(
@@ -43,24 +47,129 @@ def mock_user_options():
     return user_options
 
 
-@patch.object(HubClient, "get_user")
-def test_api_get_server(get_user, client):
+@patch.object(HubClient, "get_user_servers")
+def test_api_get_server(get_user_servers, client):
     server_data = {"panel-app": {}}
-    get_users_response = {'name': 'jovyan', 'servers': server_data}
-    get_user.return_value = get_users_response
+    get_user_servers.return_value = server_data
     response = client.get("/server/panel-app")
-    get_user.assert_called_once_with()
+    get_user_servers.assert_called_once_with(MOCK_USER.name)
     assert response.status_code == 200
     assert response.json() == server_data["panel-app"]
 
 
-@patch.object(HubClient, "get_user")
-def test_api_get_server_not_found(get_user, client):
+@patch.object(HubClient, "get_user_servers")
+@patch("jhub_apps.service.routes.get_shared_servers")
+def test_api_get_servers_not_modified(get_shared_servers, get_user_servers, client):
+    get_shared_servers.return_value = []
+    get_user_servers.return_value = {"panel-app": {"name": "panel-app", "ready": False}}
+    response = client.get("/server/")
+    assert response.status_code == 200
+    assert response.headers["cache-control"] == "private, no-cache"
+    etag = response.headers["etag"]
+    response = client.get("/server/", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["etag"] == etag
+    # the app started in the meantime
+    get_user_servers.return_value = {"panel-app": {"name": "panel-app", "ready": True}}
+    response = client.get("/server/", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
+    assert response.json()["user_apps"] == [{"name": "panel-app", "ready": True}]
+
+
+@patch.object(HubClient, "get_user_servers")
+@patch("jhub_apps.service.routes.get_shared_servers")
+def test_api_get_servers_compressed_not_modified(get_shared_servers, get_user_servers, client):
+    get_shared_servers.return_value = []
+    get_user_servers.return_value = {
+        f"app-{i}": {"name": f"app-{i}", "user_options": {"env": {"KEY": "value"}}} for i in range(100)
+    }
+    response = client.get("/server/", headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert response.headers["content-encoding"] == "gzip"
+    # the compressed bytes differ from the identity response
+    etag = response.headers["etag"]
+    assert etag.startswith('W/"')
+    response = client.get("/server/", headers={"Accept-Encoding": "gzip", "If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b""
+
+
+@patch.object(HubClient, "get_user_servers")
+@patch("jhub_apps.service.routes.get_shared_servers")
+def test_api_get_servers_page(get_shared_servers, get_user_servers, client):
+    def server(owner, name, framework):
+        return {
+            "name": name,
+            "full_name": f"{owner}/{name}",
+            "state": {"pod_name": f"jupyter-{name}"},
+            "user_options": {"display_name": name, "framework": framework},
+        }
+    get_user_servers.return_value = {
+        "panel-app": server("jovyan", "panel-app", "panel"),
+        "voila-app": server("jovyan", "voila-app", "voila"),
+    }
+    get_shared_servers.return_value = [server("alice", "alice-panel", "panel")]
+    response = client.get("/server/", params={"framework": "panel", "limit": 1, "view": "summary"})
+    assert response.status_code == 200
+    page = response.json()
+    assert page["items"] == [
+        {
+            "owner": "alice",
+            "shared": True,
+            "server": {
+                "name": "alice-panel",
+                "full_name": "alice/alice-panel",
+                "user_options": {"display_name": "alice-panel", "framework": "panel"},
+            },
+        }
+    ]
+    assert page["total"] == 2
+    assert page["facets"] == {"framework": {"panel": 2, "voila": 1}}
+    response = client.get("/server/", params={"framework": "panel", "limit": 1, "cursor": page["next_cursor"]})
+    page = response.json()
+    assert [item["server"]["name"] for item in page["items"]] == ["panel-app"]
+    assert page["next_cursor"] is None
+    response = client.get("/server/", params={"cursor": "invalid"})
+    assert response.status_code == 400
+
+
+@patch.object(HubClient, "get_user_servers")
+@patch("jhub_apps.service.routes.get_shared_servers")
+def test_api_get_servers_projection(get_shared_servers, get_user_servers, client):
+    server = {
+        "name": "panel-app",
+        "state": {"pod_name": "jupyter-panel-app"},
+        "user_options": {"display_name": "Panel App", "env": {"KEY": "value"}, "thumbnail": "/thumbnails/abc"},
+    }
+    get_shared_servers.return_value = [server]
+    get_user_servers.return_value = {"panel-app": server}
+    response = client.get("/server/", params={"view": "summary"})
+    assert response.status_code == 200
+    summary = {"name": "panel-app", "user_options": {"display_name": "Panel App"}}
+    assert response.json() == {"shared_apps": [summary], "user_apps": [summary]}
+    response = client.get("/server/panel-app", params={"fields": "name,user_options.display_name"})
+    assert response.json() == summary
+    response = client.get("/server/panel-app", params={"exclude": "user_options"})
+    assert response.json() == {"name": "panel-app", "state": {"pod_name": "jupyter-panel-app"}}
+    assert client.get("/server/", params={"view": "everything"}).status_code == 422
+
+
+@patch.object(HubClient, "get_services")
+def test_api_services_not_modified(get_services, client):
+    get_services.return_value = {"japps": {"name": "japps"}}
+    etag = client.get("/services/").headers["etag"]
+    response = client.get("/services/", headers={"If-None-Match": f'W/{etag}, "other"'})
+    assert response.status_code == 304
+
+
+@patch.object(HubClient, "get_user_servers")
+def test_api_get_server_not_found(get_user_servers, client):
     server_data = {"panel-app": {}}
-    get_users_response = {'name': 'jovyan', 'servers': server_data}
-    get_user.return_value = get_users_response
+    get_user_servers.return_value = server_data
     response = client.get("/server/panel-app-not-found")
-    get_user.assert_called_once_with()
+    get_user_servers.assert_called_once_with(MOCK_USER.name)
     assert response.status_code == 404
     assert response.json() == {
         'detail': "server 'panel-app-not-found' not found",
@@ -75,15 +184,19 @@ def test_api_create_server(create_server, get_jupyterhub_config, client):
     create_server_response = {"user": "jovyan"}
     create_server.return_value = create_server_response
     user_options = mock_user_options()
-    thumbnail = b"contents of thumbnail"
+    thumbnail = png_image(64, 64)
     in_memory_file = io.BytesIO(thumbnail)
     response = client.post(
         "/server",
         data={'data': json.dumps({"servername": "panel-app", "user_options": user_options})},
-        files={'thumbnail': ('image.jpeg', in_memory_file)}
+        files={'thumbnail': ('image.png', in_memory_file)}
     )
     final_user_options = UserOptions(**user_options)
-    final_user_options.thumbnail = "data:image/jpeg;base64,Y29udGVudHMgb2YgdGh1bWJuYWls"
+    stored_user_options = create_server.call_args.kwargs["user_options"]
+    assert re.match(r"^/thumbnails/[0-9a-f]{64}$", stored_user_options.thumbnail)
+    assert client.get(stored_user_options.thumbnail).status_code == 200
+    final_user_options.thumbnail = stored_user_options.thumbnail
+    final_user_options.thumbnail_placeholder = stored_user_options.thumbnail_placeholder
     create_server.assert_called_once_with(
         username=MOCK_USER.name,
         servername="panel-app",
@@ -123,6 +236,25 @@ def test_api_start_server_404(start_server, client):
     assert response.status_code == 403
 
 
+@patch.object(HubClient, "delete_server")
+def test_api_batch_servers(delete_server, client):
+    delete_server.return_value = 204
+    response = client.post("/server/batch", json={"items": [
+        {"name": "panel-app", "action": "stop"},
+        {"owner": "alice", "name": "voila-app", "action": "delete"},
+    ]}, headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert "content-encoding" not in response.headers
+    results = [json.loads(line) for line in response.text.splitlines()]
+    assert sorted(results, key=lambda result: result["name"]) == [
+        {"owner": MOCK_USER.name, "name": "panel-app", "action": "stop", "status_code": 204},
+        {"owner": "alice", "name": "voila-app", "action": "delete", "status_code": 204},
+    ]
+    response = client.post("/server/batch", json={"items": [{"name": "panel-app", "action": "restart"}]})
+    assert response.status_code == 422
+
+
 @pytest.mark.parametrize("name,remove", [
     ('delete', True,),
     ('stop', False,),
@@ -149,15 +281,19 @@ def test_api_update_server(edit_server, get_jupyterhub_config, client):
     create_server_response = {"user": "jovyan"}
     edit_server.return_value = create_server_response
     user_options = mock_user_options()
-    thumbnail = b"contents of thumbnail"
+    thumbnail = png_image(64, 64)
     in_memory_file = io.BytesIO(thumbnail)
     response = client.put(
         "/server/panel-app",
         data={'data': json.dumps({"servername": "panel-app", "user_options": user_options})},
-        files={'thumbnail': ('image.jpeg', in_memory_file)}
+        files={'thumbnail': ('image.png', in_memory_file)}
     )
     final_user_options = UserOptions(**user_options)
-    final_user_options.thumbnail = "data:image/jpeg;base64,Y29udGVudHMgb2YgdGh1bWJuYWls"
+    stored_user_options = edit_server.call_args.kwargs["user_options"]
+    assert re.match(r"^/thumbnails/[0-9a-f]{64}$", stored_user_options.thumbnail)
+    assert client.get(stored_user_options.thumbnail).status_code == 200
+    final_user_options.thumbnail = stored_user_options.thumbnail
+    final_user_options.thumbnail_placeholder = stored_user_options.thumbnail_placeholder
     edit_server.assert_called_once_with(
         username=MOCK_USER.name,
         servername="panel-app",
@@ -167,43 +303,35 @@ def test_api_update_server(edit_server, get_jupyterhub_config, client):
     assert response.json() == create_server_response
 
 
-@patch.object(HubClient, "get_users")
+@patch.object(HubClient, "get_user_servers")
 @patch.object(HubClient, "get_shared_servers")
-def test_shared_server_filtering(hub_get_shared_servers, get_users):
+def test_shared_server_filtering(hub_get_shared_servers, get_user_servers):
     current_hub_user = {"name": "fakeuser"}
-    get_users.return_value = [
-        {
-            "servers": {
-                '': {'name': ''},
-                "panel-12": {"name": "panel-12"}
-            }
+    owners_servers = {
+        "another-user": {
+            '': {'name': ''},
+            "panel-12": {"name": "panel-12"},
+            "panel-34": {"name": "panel-34", "fullname": "panel shared 34"},
+            "panel-56": {"name": "panel-56", "fullname": "panel shared server"},
         },
-        {
-            "servers": {
-                '': {'name': ''},
-                "panel-34": {"name": "panel-34", "fullname": "panel shared 34"}
-            }
-        },
-        {
-            "servers": {
-                '': {'name': ''},
-                "panel-56": {"name": "panel-56", "fullname": "panel shared server"}
-            }
-        }
-    ]
+        "deleted-user": None,
+    }
+    get_user_servers.side_effect = lambda owner: owners_servers[owner]
     hub_get_shared_servers.return_value = [
-        {"server": {"name": "panel-56", "user": {"name": "another-user"}}},
         {"server": {"name": "panel-34", "user": {"name": "another-user"}}},
+        {"server": {"name": "panel-56", "user": {"name": "another-user"}}},
         {"server": {"name": "panel-23", "user": {"name": "fakeuser"}}},
         {"server": {"name": "panel-42", "user": {"name": "fakeuser"}}},
+        {"server": {"name": "panel-78", "user": {"name": "deleted-user"}}},
     ]
-    shared_servers = get_shared_servers(current_hub_user)
+    shared_servers = asyncio.run(get_shared_servers(current_hub_user))
     assert shared_servers == [
         {"name": "panel-34", "fullname": "panel shared 34"},
         {"name": "panel-56", "fullname": "panel shared server"}
     ]
     hub_get_shared_servers.assert_called_once_with()
-    get_users.assert_called_once_with()
+    # only the owners of the shared apps are looked up
+    assert sorted(call.args[0] for call in get_user_servers.call_args_list) == ["another-user", "deleted-user"]
 
 
 @pytest.mark.parametrize("allowed_frameworks, blocked_frameworks,", [
@@ -229,6 +357,42 @@ def test_api_frameworks(get_jupyterhub_config, client, allowed_frameworks, block
     assert returned_frameworks == set(allowed_frameworks) - set(blocked_frameworks)
 
 
+@patch("jhub_apps.service.routes.is_jupyterhub_5", return_value=True)
+@patch("jhub_apps.service.routes.get_share_permissions")
+def test_api_me_with_share_permissions(get_share_permissions, is_jupyterhub_5, client):
+    from jhub_apps.service.app import app
+    from jhub_apps.service.security import get_current_user
+    user = User(name="jovyan", admin=False, groups=["alpha"], kind="user", scopes=["access:services"])
+
+    async def mock_get_current_user():
+        return user
+
+    app.dependency_overrides[get_current_user] = mock_get_current_user
+    get_share_permissions.return_value = {"users": ["alice"], "groups": ["alpha"]}
+    response = client.get("/user")
+    assert response.status_code == 200
+    assert response.json()["share_permissions"] == {"users": ["alice"], "groups": ["alpha"]}
+    get_share_permissions.assert_called_once_with(user)
+
+
+@patch("jhub_apps.service.routes.get_jupyterhub_config")
+@patch("jhub_apps.service.routes.get_share_permissions")
+def test_api_share_permissions_not_computed_by_other_endpoints(get_share_permissions, get_jupyterhub_config, client):
+    get_jupyterhub_config.return_value = MOCK_ALLOW_ALL_FRAMEWORKS_CONFIG
+    response = client.get("/frameworks/")
+    assert response.status_code == 200
+    get_share_permissions.assert_not_called()
+
+
+def test_api_hub_client_stats(client):
+    response = client.get("/stats/")
+    assert response.status_code == 200
+    rjson = response.json()
+    assert set(rjson["hub_requests"]) >= {"calls", "coalesced", "memo_hits", "fan_in_ratio"}
+    assert set(rjson["user_tokens"]) >= {"hits", "misses"}
+    assert set(rjson["jupyterhub_config"]) >= {"loads", "last_load_duration"}
+
+
 def test_api_status(client):
     response = client.get(
         "/status",
@@ -273,13 +437,78 @@ def test_create_server_with_git_repository(
         )
     )
     server_data = ServerCreation(servername="test server", user_options=user_options)
-    files = {"thumbnail": ("test.png", b"dummy image data", "image/png")}
+    thumbnail = png_image(64, 64)
+    files = {"thumbnail": ("test.png", thumbnail, "image/png")}
     data = {"data": server_data.model_dump_json()}
     hub_create_server.return_value = (201, 'test-server-abcdef')
     response = client.post("/server", data=data, files=files)
     assert response.status_code == 200
     assert response.json() == [201, 'test-server-abcdef']
+    stored_user_options = hub_create_server.call_args.kwargs["user_options"]
+    assert re.match(r"^/thumbnails/[0-9a-f]{64}$", stored_user_options.thumbnail)
+    user_options.thumbnail = stored_user_options.thumbnail
+    user_options.thumbnail_placeholder = stored_user_options.thumbnail_placeholder
     hub_create_server.assert_called_once_with(
         username="jovyan", servername=server_data.servername,
         user_options=user_options
     )
+
+
+def test_api_thumbnail_is_served_by_hash(client, thumbnail_store):
+    thumbnail = b"\x89PNG thumbnail"
+    thumbnail_hash = thumbnail_store.put(thumbnail)
+    assert thumbnail_store.put(thumbnail) == thumbnail_hash
+    response = client.get(f"/thumbnails/{thumbnail_hash}")
+    assert response.status_code == 200
+    assert response.content == thumbnail
+    assert response.headers["content-type"] == "image/png"
+    assert "immutable" in response.headers["cache-control"]
+    response = client.get(f"/thumbnails/{thumbnail_hash}", headers={"If-None-Match": response.headers["etag"]})
+    assert response.status_code == 304
+    assert client.get("/thumbnails/" + "0" * 64).status_code == 404
+    assert client.get("/thumbnails/..%2F..%2Fetc%2Fpasswd").status_code == 404
+
+
+@patch("jhub_apps.service.utils.get_jupyterhub_config")
+@patch.object(HubClient, "edit_server")
+def test_api_update_server_moves_data_url_thumbnail_to_store(edit_server, get_jupyterhub_config, client):
+    get_jupyterhub_config.return_value = MOCK_ALLOW_ALL_FRAMEWORKS_CONFIG
+    edit_server.return_value = (201, "panel-app")
+    thumbnail = png_image(64, 64)
+    data_url = "data:image/png;base64," + base64.b64encode(thumbnail).decode()
+    response = client.put(
+        "/server/panel-app",
+        data={
+            "data": json.dumps({"servername": "panel-app", "user_options": mock_user_options()}),
+            "thumbnail_data_url": data_url,
+        },
+    )
+    assert response.status_code == 200
+    thumbnail_url = edit_server.call_args.kwargs["user_options"].thumbnail
+    assert re.match(r"^/thumbnails/[0-9a-f]{64}$", thumbnail_url)
+    assert client.get(thumbnail_url).status_code == 200
+
+
+@patch("jhub_apps.service.utils.get_jupyterhub_config")
+@patch.object(HubClient, "get_server")
+@patch.object(HubClient, "edit_server")
+def test_api_update_server_keeps_thumbnail_placeholder(edit_server, get_server, get_jupyterhub_config, client):
+    get_jupyterhub_config.return_value = MOCK_ALLOW_ALL_FRAMEWORKS_CONFIG
+    edit_server.return_value = (201, "panel-app")
+    thumbnail_url = "/thumbnails/" + "a" * 64
+    get_server.return_value = {
+        "name": "panel-app",
+        "user_options": {"thumbnail": thumbnail_url, "thumbnail_placeholder": "data:image/webp;base64,AAAA"},
+    }
+    response = client.put(
+        "/server/panel-app",
+        data={
+            "data": json.dumps({"servername": "panel-app", "user_options": mock_user_options()}),
+            "thumbnail_data_url": thumbnail_url,
+        },
+    )
+    assert response.status_code == 200
+    user_options = edit_server.call_args.kwargs["user_options"]
+    assert user_options.thumbnail == thumbnail_url
+    assert user_options.thumbnail_placeholder == "data:image/webp;base64,AAAA"
+    get_server.assert_called_once_with(MOCK_USER.name, "panel-app")
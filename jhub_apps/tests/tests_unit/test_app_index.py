@@ -0,0 +1,103 @@
+from unittest.mock import Mock, patch
+
+import pytest
+from fastapi import HTTPException
+
+from jhub_apps.service import app_index
+from jhub_apps.service.app_index import AppFilters, AppIndex, get_app_index
+
+
+def make_server(owner, name, framework, ready=False, last_activity=None, display_name=None):
+    return {
+        "name": name,
+        "full_name": f"{owner}/{name}",
+        "ready": ready,
+        "pending": None,
+        "last_activity": last_activity,
+        "started": last_activity if ready else None,
+        "user_options": {
+            "display_name": display_name or name,
+            "description": f"{framework} app of {owner}",
+            "framework": framework,
+        },
+    }
+
+
+USER_APPS = [
+    make_server("jovyan", "panel-a", "panel", ready=True, last_activity="2024-05-03T10:00:00Z", display_name="Zeta"),
+    make_server("jovyan", "panel-b", "panel", last_activity="2024-05-01T10:00:00Z", display_name="alpha"),
+    make_server("jovyan", "streamlit-a", "streamlit", ready=True, last_activity="2024-05-02T10:00:00Z"),
+]
+SHARED_APPS = [
+    make_server("alice", "panel-c", "panel", display_name="Beta"),
+    make_server("bob", "voila-a", "voila", ready=True, last_activity="2024-05-04T10:00:00Z"),
+]
+
+
+def names(page):
+    return [entry.name for entry in page["items"]]
+
+
+def build():
+    return AppIndex.build("jovyan", USER_APPS, SHARED_APPS)
+
+
+def test_sort_and_facets():
+    index = build()
+    page = index.query(AppFilters(), sort="name")
+    assert names(page) == ["panel-b", "panel-c", "streamlit-a", "voila-a", "panel-a"]
+    assert page["total"] == 5
+    assert page["next_cursor"] is None
+    assert page["facets"] == {"framework": {"panel": 3, "streamlit": 1, "voila": 1}}
+    page = index.query(AppFilters(), sort="last_activity", descending=True)
+    assert names(page) == ["voila-a", "panel-a", "streamlit-a", "panel-b", "panel-c"]
+
+
+def test_filters():
+    index = build()
+    page = index.query(AppFilters(frameworks=frozenset({"panel"}), status="stopped"))
+    assert names(page) == ["panel-b", "panel-c"]
+    assert page["total"] == 2
+    # the framework counts leave out the framework filter
+    assert page["facets"] == {"framework": {"panel": 2}}
+    assert names(index.query(AppFilters(scope="shared"))) == ["panel-c", "voila-a"]
+    assert names(index.query(AppFilters(scope="mine", status="running"))) == ["streamlit-a", "panel-a"]
+    assert names(index.query(AppFilters(owner="bob"))) == ["voila-a"]
+    assert names(index.query(AppFilters(search="APP OF ALICE"))) == ["panel-c"]
+
+
+@pytest.mark.parametrize("descending", [False, True])
+def test_cursor_pagination(descending):
+    index = build()
+    seen = []
+    cursor = None
+    while True:
+        page = index.query(AppFilters(), sort="last_activity", descending=descending, cursor=cursor, limit=2)
+        seen += names(page)
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    assert seen == names(index.query(AppFilters(), sort="last_activity", descending=descending))
+
+
+def test_invalid_cursor():
+    index = build()
+    cursor = index.query(AppFilters(), sort="name", limit=1)["next_cursor"]
+    for invalid_cursor in ["not-a-cursor", cursor]:
+        with pytest.raises(HTTPException) as exc_info:
+            index.query(AppFilters(), sort="started", cursor=invalid_cursor)
+        assert exc_info.value.status_code == 400
+
+
+def test_index_not_kept_without_mirror():
+    assert get_app_index("jovyan", USER_APPS, SHARED_APPS) is not get_app_index("jovyan", USER_APPS, SHARED_APPS)
+    assert "jovyan" not in app_index._indexes
+
+
+@patch.object(app_index, "get_hub_state_mirror", return_value=Mock())
+def test_index_rebuilt_when_servers_change(get_hub_state_mirror):
+    user_apps = list(USER_APPS)
+    index = get_app_index("jovyan", user_apps, SHARED_APPS)
+    assert get_app_index("jovyan", list(user_apps), SHARED_APPS) is index
+    user_apps[0] = dict(user_apps[0], ready=False)
+    assert get_app_index("jovyan", user_apps, SHARED_APPS) is not index
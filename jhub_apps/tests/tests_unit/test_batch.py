@@ -0,0 +1,88 @@
+import asyncio
+from unittest.mock import patch
+
+import httpx
+
+from jhub_apps.hub_client.hub_client import HubClient
+from jhub_apps.service import batch
+from jhub_apps.service.batch import BatchRunner
+from jhub_apps.service.models import BatchOperation
+
+SERVERS = {
+    "alice": {"panel-app": {"name": "panel-app", "user_options": {"framework": "panel"}}},
+    "bob": {"voila-app": {"name": "voila-app", "user_options": {"framework": "voila"}}},
+}
+
+
+async def get_server(username, servername=None, fresh=False):
+    return SERVERS.get(username)
+
+
+def run(operations, concurrency=2):
+    async def collect():
+        return [result async for result in BatchRunner("jovyan", concurrency=concurrency).run(operations)]
+    return asyncio.run(collect())
+
+
+@patch.object(HubClient, "delete_server")
+@patch.object(HubClient, "start_server")
+@patch.object(HubClient, "get_server", side_effect=get_server)
+def test_batch(hub_get_server, start_server, delete_server):
+    start_server.return_value = httpx.Response(202)
+    delete_server.return_value = 204
+    results = run([
+        BatchOperation(owner="alice", name="panel-app", action="start"),
+        BatchOperation(owner="bob", name="voila-app", action="start"),
+        BatchOperation(owner="alice", name="missing-app", action="start"),
+        BatchOperation(owner="bob", name="voila-app", action="stop"),
+        BatchOperation(name="my-app", action="delete"),
+    ])
+    assert sorted(results, key=lambda result: (result["owner"], result["name"], result["action"])) == [
+        {"owner": "alice", "name": "missing-app", "action": "start", "status_code": 404,
+         "detail": "server 'missing-app' not found"},
+        {"owner": "alice", "name": "panel-app", "action": "start", "status_code": 202},
+        {"owner": "bob", "name": "voila-app", "action": "start", "status_code": 202},
+        {"owner": "bob", "name": "voila-app", "action": "stop", "status_code": 204},
+        {"owner": "jovyan", "name": "my-app", "action": "delete", "status_code": 204},
+    ]
+    # the servers of each owner are fetched once for the batch
+    assert sorted(call.args[0] for call in hub_get_server.call_args_list) == ["alice", "bob"]
+    start_server.assert_any_call("alice", "panel-app", server=SERVERS["alice"]["panel-app"])
+    delete_server.assert_any_call("bob", "voila-app", remove=False)
+    delete_server.assert_any_call("jovyan", "my-app", remove=True)
+
+
+@patch.object(batch, "MAX_RETRY_AFTER", 0)
+@patch.object(HubClient, "start_server")
+@patch.object(HubClient, "get_server", side_effect=get_server)
+def test_batch_retries_spawn_limit(hub_get_server, start_server):
+    start_server.side_effect = [httpx.Response(429, headers={"Retry-After": "5"}), httpx.Response(202)]
+    results = run([BatchOperation(owner="alice", name="panel-app", action="start")])
+    assert results == [{"owner": "alice", "name": "panel-app", "action": "start", "status_code": 202}]
+    assert start_server.call_count == 2
+
+
+@patch.object(HubClient, "delete_server")
+def test_batch_failures_and_concurrency(delete_server):
+    running = 0
+    max_running = 0
+
+    async def hub_delete_server(username, server_name, remove=False):
+        nonlocal running, max_running
+        running += 1
+        max_running = max(max_running, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+        if server_name == "forbidden":
+            request = httpx.Request("DELETE", "http://hub/hub/api/users/bob/servers/forbidden")
+            response = httpx.Response(403, text="Forbidden", request=request)
+            raise httpx.HTTPStatusError("Forbidden", request=request, response=response)
+        return 204
+
+    delete_server.side_effect = hub_delete_server
+    operations = [BatchOperation(owner="bob", name=f"app-{i}", action="stop") for i in range(6)]
+    operations.append(BatchOperation(owner="bob", name="forbidden", action="stop"))
+    results = run(operations, concurrency=2)
+    assert max_running == 2
+    assert [result["status_code"] for result in results].count(204) == 6
+    assert {"owner": "bob", "name": "forbidden", "action": "stop", "status_code": 403, "detail": "Forbidden"} in results
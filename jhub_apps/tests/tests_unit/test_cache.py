@@ -0,0 +1,103 @@
+import sqlite3
+import time
+from unittest.mock import Mock, patch
+
+import pytest
+
+from jhub_apps.service import cache
+from jhub_apps.service.cache import Cache, MemoryCacheBackend, SQLiteCacheBackend
+
+
+@pytest.fixture
+def workers(tmp_path, monkeypatch):
+    """Two service workers sharing the same SQLite cache file."""
+    monkeypatch.setattr(cache, "INVALIDATION_POLL_INTERVAL", 0)
+    path = str(tmp_path / "cache.sqlite")
+    backends = [SQLiteCacheBackend(path), SQLiteCacheBackend(path)]
+    for backend in backends:
+        backend.register("users", ttl=30, maxsize=10)
+    return backends
+
+
+def test_sqlite_cache_is_shared_between_workers(workers):
+    worker_1, worker_2 = workers
+    worker_1.set("users", "hash-1", {"name": "alice", "groups": ["alpha"]})
+    assert worker_2.get("users", "hash-1") == {"name": "alice", "groups": ["alpha"]}
+    assert worker_2.get("users", "hash-2") is None
+    worker_2.delete("users", "hash-1")
+    assert worker_1.get("users", "hash-1") is None
+
+
+def test_sqlite_cache_entries_expire(workers):
+    worker_1, worker_2 = workers
+    worker_1.set("users", "hash-1", {"name": "alice"})
+    with patch.object(cache.time, "time", return_value=time.time() + 31):
+        assert worker_2.get("users", "hash-1") is None
+
+
+def test_sqlite_cache_broadcasts_invalidations(workers):
+    worker_1, worker_2 = workers
+    worker_2.poll_invalidations()
+    worker_1.delete("users", "hash-1")
+    worker_1.delete("users")
+    # a worker isn't told about its own invalidations
+    assert worker_1.poll_invalidations() == []
+    assert worker_2.poll_invalidations() == [("users", "hash-1"), ("users", None)]
+    assert worker_2.poll_invalidations() == []
+
+
+def test_sqlite_cache_locked_is_a_miss(workers):
+    worker_1, worker_2 = workers
+    worker_1.set("users", "hash-1", {"name": "alice"})
+    worker_2.poll_invalidations()
+    # another process holding the write lock of the file
+    blocker = sqlite3.connect(worker_1.path, isolation_level=None)
+    blocker.execute("BEGIN IMMEDIATE")
+    try:
+        start = time.monotonic()
+        worker_2.set("users", "hash-2", {"name": "bob"})
+        worker_2.delete("users", "hash-1")
+        assert time.monotonic() - start < 1
+    finally:
+        blocker.execute("ROLLBACK")
+        blocker.close()
+    assert worker_1.get("users", "hash-2") is None
+    assert worker_1.get("users", "hash-1") == {"name": "alice"}
+    with patch.object(worker_1, "_connect", side_effect=sqlite3.OperationalError("database is locked")):
+        assert worker_1.get("users", "hash-1") is None
+        assert worker_1.poll_invalidations() == []
+
+
+def test_sqlite_cache_publishes_changes(workers):
+    worker_1, worker_2 = workers
+    worker_1.set("users", "hash-1", {"name": "alice"})
+    worker_2.poll_invalidations()
+    worker_1.publish("hub_servers", "alice")
+    assert worker_1.poll_invalidations() == []
+    assert worker_2.poll_invalidations() == [("hub_servers", "alice")]
+    # nothing cached is dropped
+    assert worker_2.get("users", "hash-1") == {"name": "alice"}
+
+
+def test_invalidations_are_dispatched_to_subscribers(workers, monkeypatch):
+    worker_1, worker_2 = workers
+    worker_2.poll_invalidations()
+    monkeypatch.setattr(cache, "_backend", worker_2)
+    callback = Mock()
+    cache.subscribe("users", callback)
+    try:
+        worker_1.delete("users", "hash-1")
+        cache.process_invalidations()
+    finally:
+        cache.unsubscribe("users", callback)
+    callback.assert_called_once_with("hash-1")
+
+
+def test_memory_cache(monkeypatch):
+    monkeypatch.setattr(cache, "_backend", MemoryCacheBackend())
+    users = Cache("users", ttl=30)
+    users.set("hash-1", {"name": "alice"})
+    assert users.get("hash-1") == {"name": "alice"}
+    users.delete("hash-1")
+    assert users.get("hash-1") is None
+    assert cache.get_cache_backend().poll_invalidations() == []
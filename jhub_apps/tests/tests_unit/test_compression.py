@@ -0,0 +1,101 @@
+import gzip
+import json
+
+import pytest
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from fastapi.testclient import TestClient
+
+from jhub_apps.service.compression import CompressionMiddleware
+from jhub_apps.service.responses import JAppsJSONResponse, dump_json
+from jhub_apps.service.models import UserOptions
+
+LARGE = {"apps": [{"name": f"app-{i}", "env": {"KEY": "value"}} for i in range(200)]}
+
+
+@pytest.fixture
+def compressed_client():
+    app = FastAPI(default_response_class=JAppsJSONResponse)
+
+    @app.get("/large")
+    async def large():
+        return LARGE
+
+    @app.get("/small")
+    async def small():
+        return {"status": "ok"}
+
+    @app.get("/etag")
+    async def etag():
+        return JAppsJSONResponse(LARGE, headers={"ETag": '"abc"'})
+
+    @app.get("/encoded")
+    async def encoded():
+        return PlainTextResponse("x" * 4096, headers={"Content-Encoding": "identity-ish"})
+
+    @app.get("/stream")
+    async def stream():
+        async def lines():
+            for i in range(100):
+                yield json.dumps({"line": i}).encode() + b"\n"
+        return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+    @app.middleware("http")
+    async def passthrough(request, call_next):
+        # responses going through BaseHTTPMiddleware are streamed to the next middleware
+        return await call_next(request)
+
+    app.add_middleware(CompressionMiddleware, encodings=["gzip"], minimum_size=1024)
+    return TestClient(app)
+
+
+def test_large_response_is_compressed(compressed_client):
+    response = compressed_client.get("/large", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert int(response.headers["content-length"]) < len(json.dumps(LARGE)) / 5
+    assert response.json() == LARGE
+
+
+def test_small_response_is_not_compressed(compressed_client):
+    response = compressed_client.get("/small", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in response.headers
+    assert response.json() == {"status": "ok"}
+
+
+def test_not_compressed_without_accepted_encoding(compressed_client):
+    response = compressed_client.get("/large", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in response.headers
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert response.json() == LARGE
+
+
+def test_compressed_response_has_weak_etag(compressed_client):
+    response = compressed_client.get("/etag", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["etag"] == 'W/"abc"'
+    response = compressed_client.get("/etag", headers={"Accept-Encoding": "identity"})
+    assert response.headers["etag"] == '"abc"'
+
+
+def test_already_encoded_response_is_left_alone(compressed_client):
+    with compressed_client.stream("GET", "/encoded", headers={"Accept-Encoding": "gzip"}) as response:
+        assert response.headers["content-encoding"] == "identity-ish"
+        assert b"".join(response.iter_raw()) == b"x" * 4096
+
+
+def test_streaming_response_is_compressed(compressed_client):
+    with compressed_client.stream("GET", "/stream", headers={"Accept-Encoding": "gzip"}) as response:
+        assert response.headers["content-encoding"] == "gzip"
+        raw = b"".join(response.iter_raw())
+    lines = gzip.decompress(raw).splitlines()
+    assert [json.loads(line)["line"] for line in lines] == list(range(100))
+
+
+def test_dump_json_serializes_models():
+    user_options = UserOptions(jhub_app=True, display_name="App", description="", framework="panel")
+    content = {"user_options": user_options, "ids": {1, 2}, 3: "int key"}
+    assert json.loads(dump_json(content)) == {
+        "user_options": user_options.model_dump(mode="json"),
+        "ids": [1, 2],
+        "3": "int key",
+    }
@@ -0,0 +1,51 @@
+import json
+
+import pytest
+from traitlets.config import Config
+
+from jhub_apps.config_snapshot import load_config_snapshot, write_config_snapshot
+from jhub_apps.config_utils import JAppsConfig
+
+
+@pytest.fixture
+def hub_config(tmp_path):
+    config_file = tmp_path / "jupyterhub_config.py"
+    config_file.write_text("# config\n")
+    c = Config()
+    c.JAppsConfig.jupyterhub_config_path = str(config_file)
+    c.JAppsConfig.app_title = "My Apps"
+    c.JAppsConfig.allowed_frameworks = ["panel", "bokeh"]
+    c.JAppsConfig.additional_services = [{"name": "Argo", "url": "/argo"}]
+    c.KubeSpawner.profile_list = [{"display_name": "Small", "slug": "small"}]
+    c.JupyterHub.template_vars = {"hub_title": "Hub"}
+    return c
+
+
+def test_config_snapshot_round_trip(hub_config, tmp_path):
+    snapshot_path = str(tmp_path / "snapshot.json")
+    write_config_snapshot(hub_config, JAppsConfig(config=hub_config), snapshot_path)
+    config = load_config_snapshot(snapshot_path, hub_config.JAppsConfig.jupyterhub_config_path)
+    japps_config = JAppsConfig(config=config)
+    assert japps_config.app_title == "My Apps"
+    assert japps_config.allowed_frameworks == ["panel", "bokeh"]
+    assert japps_config.additional_services[0].name == "Argo"
+    assert config.KubeSpawner.profile_list == [{"display_name": "Small", "slug": "small"}]
+    assert config.JupyterHub.template_vars == {"hub_title": "Hub"}
+
+
+def test_config_snapshot_not_used_with_callables(hub_config, tmp_path):
+    snapshot_path = str(tmp_path / "snapshot.json")
+    hub_config.JAppsConfig.conda_envs = lambda user: ["env"]
+    write_config_snapshot(hub_config, JAppsConfig(config=hub_config), snapshot_path)
+    with open(snapshot_path) as f:
+        assert json.load(f)["unserializable"] == ["JAppsConfig.conda_envs"]
+    assert load_config_snapshot(snapshot_path, hub_config.JAppsConfig.jupyterhub_config_path) is None
+
+
+def test_config_snapshot_not_used_when_config_file_changed(hub_config, tmp_path):
+    snapshot_path = str(tmp_path / "snapshot.json")
+    write_config_snapshot(hub_config, JAppsConfig(config=hub_config), snapshot_path)
+    with open(hub_config.JAppsConfig.jupyterhub_config_path, "a") as f:
+        f.write("c.JAppsConfig.app_title = 'Other'\n")
+    assert load_config_snapshot(snapshot_path, hub_config.JAppsConfig.jupyterhub_config_path) is None
+    assert load_config_snapshot(str(tmp_path / "missing.json"), "jupyterhub_config.py") is None
@@ -56,3 +56,13 @@ def test_filter_users_based_on_scopes(name, entity_key, scopes, entities, expect
         entity_key=entity_key
     )
     assert set(filtered_entities) == set(expected_entities)
+
+
+@pytest.mark.skipif(not is_jupyterhub_5(), reason="requires jupyterhub>=5")
+def test_filter_users_based_on_group_scopes():
+    filtered_entities = filter_entity_based_on_scopes(
+        scopes=["read:users:name!group=group-a", "read:users:name!user=user_e"],
+        entities=["user_a", "user_b", "user_c", "user_e"],
+        group_members={"group-a": ["user_a", "user_b", "user_x"], "group-b": ["user_c"]},
+    )
+    assert set(filtered_entities) == {"user_a", "user_b", "user_e"}
@@ -1,4 +1,30 @@
-from jhub_apps.hub_client.hub_client import HubClient
+import asyncio
+import json
+import time
+from unittest.mock import patch
+
+import httpx
+import pytest
+
+from jhub_apps.hub_client.coalescing import end_request_memo, get_single_flight, start_request_memo
+from jhub_apps.hub_client.hub_client import (
+    HubClient,
+    SyncHubClient,
+    _share_permissions_cache,
+    get_share_permissions,
+    get_users_and_group_allowed_to_share_with,
+)
+from jhub_apps.hub_client.state_mirror import (
+    HubStateMirror,
+    get_hub_state_mirror,
+    start_hub_state_mirror,
+    stop_hub_state_mirror,
+)
+from jhub_apps.hub_client.token_pool import close_user_token_pool, get_user_token_pool
+from jhub_apps.hub_client.transport import close_hub_http_client
+from jhub_apps.hub_client.utils import is_jupyterhub_5
+from jhub_apps.service.models import SharePermissions, User
+from jhub_apps.tests.common.hub_api import FakeHubAPI
 
 
 def test_normalize_server_name():
@@ -13,3 +39,409 @@ def test_normalize_server_name():
     assert hub_client.normalize_server_name("some server name") == "some-server-name"
     # lowercase
     assert hub_client.normalize_server_name("SOMESERVERNAME") == "someservername"
+
+
+def test_hub_client_reuses_shared_http_client():
+    hub_api = FakeHubAPI()
+    hub_api.add("GET", "/users", [{"name": "alice", "servers": {}}])
+    hub_api.add("GET", "/groups", [{"name": "alpha"}])
+
+    async def run():
+        hub_client = HubClient()
+        await hub_client.get_users()
+        await hub_client.get_groups()
+        await HubClient().get_users()
+        await close_hub_http_client()
+
+    with hub_api.patch() as create_client:
+        asyncio.run(run())
+    create_client.assert_called_once_with()
+    assert len(hub_api.calls("GET", "/users")) == 2
+    assert len(hub_api.calls("GET", "/groups")) == 1
+
+
+def test_sync_hub_client_get_server():
+    hub_api = FakeHubAPI()
+    hub_api.add("GET", "/users/alice", {"name": "alice", "servers": {"app-1": {"name": "app-1"}}})
+    with hub_api.patch():
+        hub_client = SyncHubClient(username="alice")
+        assert hub_client.get_server("alice", "app-1") == {"name": "app-1"}
+        assert hub_client.get_server("alice", "app-2") is None
+        assert hub_client.get_server("bob") is None
+        assert hub_client.normalize_server_name("App 1") == "app-1"
+    # servers are looked up for the given user only, never by listing all users
+    assert [hub_api.path(r) for r in hub_api.requests] == ["/users/alice", "/users/alice", "/users/bob"]
+    assert hub_api.requests[0].url.params["include_stopped_servers"] == "true"
+
+
+def test_user_token_is_leased_across_calls():
+    hub_api = FakeHubAPI()
+    hub_api.add("GET", "/users/alice", {"name": "alice", "servers": {}})
+    hub_api.add("GET", "/services", {})
+
+    async def run():
+        hub_client = HubClient(username="alice")
+        await hub_client.get_user()
+        await asyncio.gather(hub_client.get_services(), HubClient(username="alice").get_services())
+        stats = get_user_token_pool().stats()
+        await close_user_token_pool()
+        await close_hub_http_client()
+        return stats
+
+    with hub_api.patch():
+        stats = asyncio.run(run())
+    assert stats == {"hits": 2, "misses": 1, "revoked": 0, "active": 1}
+    assert len(hub_api.calls("POST", "/users/alice/tokens")) == 1
+    assert len(hub_api.calls("DELETE", "/users/alice/tokens/a1")) == 1
+
+
+def test_user_token_is_renewed_before_expiry():
+    hub_api = FakeHubAPI()
+    hub_api.add("GET", "/services", {})
+
+    async def run():
+        hub_client = HubClient(username="alice")
+        await hub_client.get_services()
+        with patch("jhub_apps.hub_client.token_pool.time.monotonic", return_value=time.monotonic() + 250):
+            await hub_client.get_services()
+            # let the background revocation of the old token run
+            await asyncio.sleep(0)
+            await asyncio.sleep(0)
+            stats = get_user_token_pool().stats()
+            await close_user_token_pool()
+        await close_hub_http_client()
+        return stats
+
+    with hub_api.patch():
+        stats = asyncio.run(run())
+    assert stats == {"hits": 0, "misses": 2, "revoked": 1, "active": 1}
+    assert [hub_api.path(r) for r in hub_api.calls("DELETE")] == [
+        "/users/alice/tokens/a1", "/users/alice/tokens/a2"
+    ]
+
+
+def test_idle_user_tokens_are_swept():
+    hub_api = FakeHubAPI()
+    hub_api.add("GET", "/services", {})
+
+    async def run():
+        await HubClient(username="alice").get_services()
+        pool = get_user_token_pool()
+        # alice stops making requests, bob's request after the renewal window sweeps her token
+        with patch("jhub_apps.hub_client.token_pool.time.monotonic", return_value=time.monotonic() + 250):
+            await HubClient(username="bob").get_services()
+            await asyncio.sleep(0)
+            await asyncio.sleep(0)
+            leases, locks = set(pool._leases), set(pool._locks)
+            await close_user_token_pool()
+        await close_hub_http_client()
+        return leases, locks
+
+    with hub_api.patch():
+        leases, locks = asyncio.run(run())
+    assert leases == {"bob"}
+    assert locks == {"bob"}
+    assert [hub_api.path(r) for r in hub_api.calls("DELETE")] == [
+        "/users/alice/tokens/a1", "/users/bob/tokens/a2"
+    ]
+
+
+def test_expired_user_tokens_are_not_revoked_on_close():
+    hub_api = FakeHubAPI()
+    hub_api.add("GET", "/services", {})
+
+    async def run():
+        await HubClient(username="alice").get_services()
+        with patch("jhub_apps.hub_client.token_pool.time.monotonic", return_value=time.monotonic() + 301):
+            await close_user_token_pool()
+        await close_hub_http_client()
+
+    with hub_api.patch():
+        asyncio.run(run())
+    assert not hub_api.calls("DELETE")
+
+
+def test_iter_users_streams_pages_concurrently():
+    hub_api = FakeHubAPI()
+    users = [{"name": f"user-{i}", "servers": {}} for i in range(450)]
+    hub_api.add("GET", "/users", FakeHubAPI.paginated(users, max_limit=100))
+
+    async def run():
+        hub_client = HubClient()
+        streamed = [user async for user in hub_client.iter_users(state="active", concurrency=2)]
+        await close_hub_http_client()
+        return streamed
+
+    with hub_api.patch():
+        streamed = asyncio.run(run())
+    assert streamed == users
+    requests = hub_api.calls("GET", "/users")
+    # page size is capped by the hub to 100
+    assert [r.url.params["offset"] for r in requests] == ["0", "100", "200", "300", "400"]
+    assert {r.url.params["limit"] for r in requests[1:]} == {"100"}
+    assert {r.url.params["state"] for r in requests} == {"active"}
+
+
+def test_get_groups_without_pagination_support():
+    hub_api = FakeHubAPI()
+    groups = [{"name": "alpha"}, {"name": "beta"}]
+    hub_api.add("GET", "/groups", groups)
+    with hub_api.patch():
+        assert SyncHubClient().get_groups() == groups
+    assert len(hub_api.calls("GET", "/groups")) == 1
+
+
+def test_share_server_applies_only_the_difference():
+    hub_api = FakeHubAPI()
+    hub_api.add("GET", "/shares/alice/app-1", FakeHubAPI.paginated([
+        {"user": {"name": "bob"}, "group": None},
+        {"user": {"name": "carol"}, "group": None},
+        {"user": None, "group": {"name": "alpha"}},
+    ]))
+    hub_api.add("POST", "/shares/alice/app-1", lambda request: httpx.Response(200, json={}))
+    hub_api.add("PATCH", "/shares/alice/app-1", lambda request: httpx.Response(200, json={}))
+
+    async def run():
+        results = await HubClient(username="alice")._share_server_with_multiple_entities(
+            "alice", "app-1", share_with=SharePermissions(users=["bob", "dave"], groups=["beta"])
+        )
+        await close_hub_http_client()
+        return results
+
+    with hub_api.patch():
+        results = asyncio.run(run())
+    actions = {(r.get("user") or r.get("group"), r["action"]) for r in results}
+    assert actions == {
+        ("dave", "share"), ("beta", "share"),
+        ("carol", "revoke"), ("alpha", "revoke"),
+        ("bob", "unchanged"),
+    }
+    assert all(r["status_code"] == 200 and r["duration"] >= 0 for r in results if r["action"] != "unchanged")
+    assert not hub_api.calls("DELETE")
+    posted = [json.loads(r.content) for r in hub_api.calls("POST", "/shares/alice/app-1")]
+    assert sorted(posted, key=str) == sorted([{"user": "dave"}, {"group": "beta"}], key=str)
+    patched = [json.loads(r.content) for r in hub_api.calls("PATCH", "/shares/alice/app-1")]
+    assert sorted(patched, key=str) == sorted([{"user": "carol"}, {"group": "alpha"}], key=str)
+
+
+def test_concurrent_identical_gets_are_coalesced():
+    hub_api = FakeHubAPI()
+
+    async def slow_users(request):
+        await asyncio.sleep(0.01)
+        return httpx.Response(200, json={"name": "alice", "servers": {"app-1": {"name": "app-1"}}})
+    hub_api.add("GET", "/users/alice", slow_users)
+
+    async def run():
+        results = await asyncio.gather(*(HubClient().get_server("alice") for _ in range(10)))
+        stats = get_single_flight().stats()
+        await close_hub_http_client()
+        return results, stats
+
+    with hub_api.patch():
+        results, stats = asyncio.run(run())
+    assert len(hub_api.calls("GET", "/users/alice")) == 1
+    assert stats["calls"] == 1 and stats["coalesced"] == 9 and stats["fan_in_ratio"] == 10
+    # every caller gets its own copy of the parsed body
+    results[0]["app-1"]["name"] = "changed"
+    assert results[1] == {"app-1": {"name": "app-1"}}
+
+
+def test_request_memo_is_dropped_after_changes():
+    hub_api = FakeHubAPI()
+    hub_api.add("GET", "/users/alice", {"name": "alice", "servers": {}})
+    hub_api.add("DELETE", "/users/alice/servers/app-1", lambda request: httpx.Response(204))
+
+    async def run():
+        memo_token = start_request_memo()
+        hub_client = HubClient()
+        await hub_client.get_server("alice")
+        await hub_client.get_server("alice")
+        assert len(hub_api.calls("GET", "/users/alice")) == 1
+        await HubClient(username="alice").delete_server("alice", "app-1")
+        await hub_client.get_server("alice")
+        assert len(hub_api.calls("GET", "/users/alice")) == 2
+        end_request_memo(memo_token)
+        await close_user_token_pool()
+        await close_hub_http_client()
+
+    with hub_api.patch():
+        asyncio.run(run())
+
+
+def test_fresh_user_servers_are_not_memoized_nor_coalesced():
+    hub_api = FakeHubAPI()
+    hub_api.add("GET", "/users/alice", {"name": "alice", "servers": {"app-1": {"name": "app-1"}}})
+
+    async def run():
+        memo_token = start_request_memo()
+        hub_client = HubClient()
+        await hub_client.get_user_servers("alice")
+        await hub_client.get_user_servers("alice")
+        assert len(hub_api.calls("GET", "/users/alice")) == 1
+        await asyncio.gather(
+            hub_client.get_user_servers("alice", fresh=True),
+            hub_client.get_user_servers("alice", fresh=True),
+        )
+        assert len(hub_api.calls("GET", "/users/alice")) == 3
+        end_request_memo(memo_token)
+        await close_hub_http_client()
+
+    with hub_api.patch():
+        asyncio.run(run())
+
+
+@patch("jhub_apps.hub_client.hub_client.get_users_and_group_allowed_to_share_with")
+def test_share_permissions_are_cached_until_groups_or_scopes_change(allowed_to_share_with):
+    allowed_to_share_with.return_value = {"users": ["bob"], "groups": ["alpha"]}
+    user = User(name="alice", admin=False, groups=["alpha"], kind="user", scopes=["shares!user"])
+    _share_permissions_cache.clear()
+
+    async def run():
+        await get_share_permissions(user)
+        await get_share_permissions(user)
+        assert allowed_to_share_with.call_count == 1
+        user.groups = ["alpha", "beta"]
+        await get_share_permissions(user)
+        user.scopes = ["shares!user", "read:users:name"]
+        await get_share_permissions(user)
+        assert allowed_to_share_with.call_count == 3
+        return await get_share_permissions(user)
+
+    assert asyncio.run(run()) == {"users": ["bob"], "groups": ["alpha"]}
+    assert allowed_to_share_with.call_count == 3
+
+
+def test_hub_state_mirror_serves_servers_and_applies_changes():
+    hub_api = FakeHubAPI()
+    alice = {"name": "alice", "servers": {"app-1": {"name": "app-1"}, "app-2": {"name": "app-2"}}}
+    hub_api.add("GET", "/users", FakeHubAPI.paginated([alice, {"name": "bob", "servers": {}}]))
+    hub_api.add("GET", "/users/alice", {"name": "alice", "servers": {"app-1": {"name": "app-1"}}})
+    hub_api.add("DELETE", "/users/alice/servers/app-2", lambda request: httpx.Response(204))
+
+    async def run():
+        mirror = start_hub_state_mirror(interval=3600)
+        await asyncio.sleep(0.05)
+        assert mirror.ready
+        hub_client = HubClient()
+        assert await hub_client.get_server("alice", "app-2") == {"name": "app-2"}
+        assert await hub_client.get_server("bob") == {}
+        assert not hub_api.calls("GET", "/users/alice")
+        await HubClient(username="alice").delete_server("alice", "app-2", remove=True)
+        # refreshed right after the change, without waiting for the next listing
+        assert await hub_client.get_server("alice") == {"app-1": {"name": "app-1"}}
+        assert len(hub_api.calls("GET", "/users/alice")) == 1
+        stats = mirror.stats()
+        await stop_hub_state_mirror()
+        await close_user_token_pool()
+        await close_hub_http_client()
+        return stats
+
+    with hub_api.patch():
+        stats = asyncio.run(run())
+    assert get_hub_state_mirror() is None
+    assert len(hub_api.calls("GET", "/users")) == 1
+    assert stats["syncs"] == 1
+    assert stats["owners"] == 2
+    assert stats["hits"] == 3
+
+
+def test_hub_state_mirror_keeps_snapshot_when_hub_fails():
+    hub_api = FakeHubAPI()
+    listings = iter([
+        [{"name": "alice", "servers": {"app-1": {"name": "app-1"}}}],
+        httpx.Response(503),
+    ])
+    hub_api.add("GET", "/users", lambda request: next(listings))
+    mirror = HubStateMirror(interval=3600)
+
+    async def run():
+        await mirror.sync()
+        try:
+            await mirror.sync()
+        except httpx.HTTPStatusError:
+            pass
+        servers = await HubClient().get_server("alice")
+        await close_hub_http_client()
+        return servers
+
+    with hub_api.patch(), patch("jhub_apps.hub_client.hub_client.get_hub_state_mirror", return_value=mirror):
+        servers = asyncio.run(run())
+    assert servers == {"app-1": {"name": "app-1"}}
+    assert mirror.syncs == 1
+    assert not hub_api.calls("GET", "/users/alice")
+
+
+def test_hub_state_mirror_keeps_users_refreshed_during_a_sync():
+    hub_api = FakeHubAPI()
+    mirror = HubStateMirror(interval=3600)
+
+    async def list_users(request):
+        # alice's server is created while the listing is in flight
+        mirror.set_user_servers("alice", {"app-1": {"name": "app-1"}})
+        return [{"name": "alice", "servers": {}}, {"name": "bob", "servers": {}}]
+
+    hub_api.add("GET", "/users", list_users)
+
+    async def run():
+        await mirror.sync()
+        await close_hub_http_client()
+
+    with hub_api.patch():
+        asyncio.run(run())
+    assert mirror.get_user_servers("alice") == {"app-1": {"name": "app-1"}}
+    assert mirror.get_user_servers("bob") == {}
+
+
+def test_hub_state_mirror_rechecks_owner_after_start():
+    hub_api = FakeHubAPI()
+    server_models = iter([
+        {"app-1": {"name": "app-1", "ready": False, "pending": None, "user_options": {}}},
+        {"app-1": {"name": "app-1", "ready": False, "pending": "spawn", "user_options": {}}},
+        {"app-1": {"name": "app-1", "ready": True, "pending": None, "user_options": {}}},
+    ])
+    hub_api.add("GET", "/users/alice", lambda request: {"name": "alice", "servers": next(server_models)})
+    hub_api.add("POST", "/users/alice/servers/app-1", lambda request: httpx.Response(202))
+    mirror = HubStateMirror(interval=3600, start_recheck_delay=0.01)
+
+    async def run():
+        await HubClient(username="alice").start_server("alice", "app-1")
+        # refreshed right after the start, the server is pending
+        assert mirror.get_user_servers("alice")["app-1"]["pending"] == "spawn"
+        await asyncio.sleep(0.05)
+        servers = mirror.get_user_servers("alice")
+        await mirror.stop()
+        await close_user_token_pool()
+        await close_hub_http_client()
+        return servers
+
+    with hub_api.patch(), patch("jhub_apps.hub_client.hub_client.get_hub_state_mirror", return_value=mirror):
+        mirror.synced_at = time.monotonic()
+        servers = asyncio.run(run())
+    assert servers["app-1"]["ready"]
+    assert len(hub_api.calls("GET", "/users/alice")) == 3
+
+
+@pytest.mark.skipif(not is_jupyterhub_5(), reason="requires jupyterhub>=5")
+def test_users_allowed_to_share_with_from_group_members():
+    hub_api = FakeHubAPI()
+    hub_api.scopes = ["read:users:name!group=group-a", "read:users:name!user=user-e", "read:groups:name"]
+    users = [{"name": name, "servers": {}} for name in ["alice", "user-a", "user-b", "user-c", "user-e"]]
+    hub_api.add("GET", "/users", FakeHubAPI.paginated(users))
+    # group models as returned by the Hub to a token with read:groups
+    hub_api.add("GET", "/groups", FakeHubAPI.paginated([
+        {"kind": "group", "name": "group-a", "users": ["user-a", "user-b", "user-x"], "properties": {}, "roles": []},
+        {"kind": "group", "name": "group-b", "users": ["user-c"], "properties": {}, "roles": []},
+    ]))
+
+    async def run():
+        user = User(name="alice", admin=False, groups=[], kind="user", scopes=[])
+        allowed = await get_users_and_group_allowed_to_share_with(user)
+        await close_user_token_pool()
+        await close_hub_http_client()
+        return allowed
+
+    with hub_api.patch():
+        allowed = asyncio.run(run())
+    assert sorted(allowed["users"]) == ["user-a", "user-b", "user-e"]
+    assert sorted(allowed["groups"]) == ["group-a", "group-b"]
@@ -0,0 +1,43 @@
+from unittest.mock import patch
+
+from traitlets.config import Config
+
+from jhub_apps.service import japps_routes
+from jhub_apps.service.static_files import get_ui_assets_version
+
+
+def make_config(logo):
+    config = Config()
+    config.JupyterHub.template_vars = {"logo": logo}
+    return config
+
+
+@patch("jhub_apps.service.japps_routes.get_jupyterhub_config")
+def test_page_is_rendered_once_and_revalidated(get_jupyterhub_config, client):
+    japps_routes._rendered_pages.clear()
+    get_jupyterhub_config.return_value = make_config("/logo-1.svg")
+    with patch.object(japps_routes, "_render_page", wraps=japps_routes._render_page) as render_page:
+        response = client.get("/services/japps/create-app")
+        assert response.status_code == 200
+        assert f"js/index.js?v={get_ui_assets_version()}" in response.text
+        assert "/logo-1.svg" in response.text
+        etag = response.headers["etag"]
+        assert response.headers["cache-control"] == "no-cache"
+        # the same page for all the routes and visits
+        assert client.get("/services/japps/edit-app").headers["etag"] == etag
+        response = client.get("/services/japps/server-types", headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        assert render_page.call_count == 1
+
+        # rendered again when the theme changes
+        get_jupyterhub_config.return_value = make_config("/logo-2.svg")
+        response = client.get("/services/japps/create-app", headers={"If-None-Match": etag})
+        assert response.status_code == 200
+        assert "/logo-2.svg" in response.text
+        assert response.headers["etag"] != etag
+        assert render_page.call_count == 2
+
+
+def test_ui_assets_version_is_stable():
+    assert get_ui_assets_version() == get_ui_assets_version()
+    assert len(get_ui_assets_version()) == 16
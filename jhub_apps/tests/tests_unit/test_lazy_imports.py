@@ -0,0 +1,22 @@
+import os
+import subprocess
+import sys
+
+# Keep in sync with LAZY_MODULES in benchmarks/import_time.py
+LAZY_MODULES = ["git", "conda_project", "jupyterhub.app", "slugify", "unittest.mock"]
+
+
+def test_service_doesnt_import_heavy_modules_at_startup():
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import sys, jhub_apps.service.app; "
+            f"print('imported:' + ','.join(m for m in {LAZY_MODULES!r} if m in sys.modules))",
+        ],
+        env={**os.environ, "PUBLIC_HOST": "/", "JUPYTERHUB_CLIENT_ID": "test-client-id"},
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    assert "imported:\n" in result.stdout
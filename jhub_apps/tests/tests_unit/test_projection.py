@@ -0,0 +1,65 @@
+from jhub_apps.service.projection import compile_projection
+
+SERVER = {
+    "name": "panel-app",
+    "ready": True,
+    "state": {"pod_name": "jupyter-panel-app"},
+    "progress_url": "/hub/api/users/jovyan/servers/panel-app/progress",
+    "user_options": {
+        "display_name": "Panel App",
+        "thumbnail": "/thumbnails/abc",
+        "thumbnail_placeholder": "data:image/webp;base64,",
+        "env": {"KEY": "value"},
+        "share_with": {"users": ["alice"], "groups": []},
+    },
+}
+
+
+def test_no_projection():
+    assert compile_projection() is None
+    assert compile_projection(fields=" , ") is None
+
+
+def test_fields():
+    project = compile_projection(fields="name, user_options.display_name,user_options.share_with.users,missing")
+    assert project(SERVER) == {
+        "name": "panel-app",
+        "user_options": {"display_name": "Panel App", "share_with": {"users": ["alice"]}},
+    }
+
+
+def test_field_selected_as_whole_and_nested():
+    project = compile_projection(fields="user_options,user_options.env")
+    assert project(SERVER) == {"user_options": SERVER["user_options"]}
+
+
+def test_exclude():
+    project = compile_projection(exclude="progress_url,user_options.share_with.users")
+    projected = project(SERVER)
+    assert "progress_url" not in projected
+    assert projected["user_options"]["share_with"] == {"groups": []}
+    assert projected["state"] == SERVER["state"]
+    # the server model is not modified
+    assert SERVER["user_options"]["share_with"]["users"] == ["alice"]
+
+
+def test_summary_view():
+    projected = compile_projection(view="summary")(SERVER)
+    assert "state" not in projected
+    assert set(projected["user_options"]) == {"display_name", "thumbnail_placeholder", "share_with"}
+
+
+def test_fields_with_summary_view():
+    project = compile_projection(fields="name,user_options", view="summary")
+    assert project(SERVER) == {
+        "name": "panel-app",
+        "user_options": {
+            "display_name": "Panel App",
+            "thumbnail_placeholder": "data:image/webp;base64,",
+            "share_with": {"users": ["alice"], "groups": []},
+        },
+    }
+
+
+def test_projections_are_compiled_once():
+    assert compile_projection(fields="name,ready") is compile_projection(fields="ready, name")
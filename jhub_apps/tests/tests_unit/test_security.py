@@ -0,0 +1,75 @@
+import asyncio
+
+import httpx
+import pytest
+from fastapi import HTTPException
+
+from jhub_apps.hub_client.transport import close_hub_http_client
+from jhub_apps.tests.common.hub_api import FakeHubAPI
+
+HUB_USER = {
+    "name": "alice",
+    "admin": False,
+    "groups": [],
+    "kind": "user",
+    "scopes": ["access:services"],
+}
+
+
+@pytest.fixture
+def security(monkeypatch):
+    monkeypatch.setenv("PUBLIC_HOST", "/")
+    monkeypatch.setenv("JHUB_APP_JWT_SECRET_KEY", "test-secret")
+    from jhub_apps.service import security
+    security._user_cache.clear()
+    yield security
+    security._user_cache.clear()
+
+
+def _jwt_for(hub_token):
+    from jhub_apps.service.auth import _create_access_token
+    return _create_access_token(data={"sub": {"access_token": hub_token}})
+
+
+def test_current_user_is_cached_per_token(security):
+    hub_api = FakeHubAPI()
+    hub_api.add("GET", "/user", HUB_USER)
+
+    async def run():
+        users = [await security.get_current_user(_jwt_for("hub-token"), None, None) for _ in range(3)]
+        await security.get_current_user(_jwt_for("other-hub-token"), None, None)
+        await close_hub_http_client()
+        return users
+
+    with hub_api.patch():
+        users = asyncio.run(run())
+    assert {user.name for user in users} == {"alice"}
+    # each request gets its own user model
+    assert users[0] is not users[1]
+    assert [r.headers["Authorization"] for r in hub_api.calls("GET", "/user")] == [
+        "Bearer hub-token", "Bearer other-hub-token"
+    ]
+    assert security._user_cache.get(security._token_cache_key("hub-token"))["name"] == "alice"
+    assert security._user_cache.get("hub-token") is None
+
+
+def test_expired_cached_user_is_checked_again(security):
+    hub_api = FakeHubAPI()
+    hub_api.add("GET", "/user", HUB_USER)
+
+    async def run():
+        await security.get_current_user(_jwt_for("hub-token"), None, None)
+        # the entry expired
+        security._user_cache.delete(security._token_cache_key("hub-token"))
+        # the token got revoked on the Hub in the meantime
+        hub_api.add("GET", "/user", lambda request: httpx.Response(403, json={}))
+        with pytest.raises(HTTPException) as e:
+            await security.get_current_user(_jwt_for("hub-token"), None, None)
+        await close_hub_http_client()
+        return e.value
+
+    with hub_api.patch():
+        error = asyncio.run(run())
+    assert error.status_code == 401
+    assert len(hub_api.calls("GET", "/user")) == 2
+    assert security._user_cache.get(security._token_cache_key("hub-token")) is None
@@ -0,0 +1,91 @@
+import gzip
+import os
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from jhub_apps.service.static_files import (
+    IMMUTABLE_CACHE_CONTROL,
+    PrecompressedStaticFiles,
+    get_ui_assets_version,
+)
+
+BUNDLE = b"console.log('jhub-apps');" * 100
+
+
+@pytest.fixture
+def static_client(tmp_path):
+    (tmp_path / "js").mkdir()
+    bundle_path = tmp_path / "js" / "index.js"
+    bundle_path.write_bytes(BUNDLE)
+    (tmp_path / "js" / "index.js.gz").write_bytes(gzip.compress(BUNDLE))
+    (tmp_path / "js" / "index.js.br").write_bytes(b"brotli bytes")
+    (tmp_path / "favicon.ico").write_bytes(b"icon")
+    app = FastAPI()
+    app.mount("/static", PrecompressedStaticFiles(directory=tmp_path), name="static")
+    return TestClient(app)
+
+
+def get_headers(client, url, **headers):
+    # the brotli variant is not real brotli, don't let the client decode it
+    with client.stream("GET", url, headers=headers) as response:
+        return response.status_code, response.headers
+
+
+def test_serves_brotli_variant(static_client):
+    status_code, headers = get_headers(
+        static_client, f"/static/js/index.js?v={get_ui_assets_version()}", **{"Accept-Encoding": "gzip, br"}
+    )
+    assert status_code == 200
+    assert headers["content-encoding"] == "br"
+    assert headers["content-type"].startswith("text/javascript")
+    assert headers["vary"] == "Accept-Encoding"
+    assert headers["cache-control"] == IMMUTABLE_CACHE_CONTROL
+    assert headers["content-length"] == str(len(b"brotli bytes"))
+
+
+@pytest.mark.parametrize("query", ["v=", "dev=1", "v=0123456789abcdef", "x=1&v="])
+def test_only_current_version_is_immutable(static_client, query):
+    status_code, headers = get_headers(static_client, f"/static/js/index.js?{query}")
+    assert status_code == 200
+    assert headers["cache-control"] == "no-cache"
+
+
+def test_serves_gzip_variant(static_client):
+    response = static_client.get("/static/js/index.js", headers={"Accept-Encoding": "gzip, br;q=0"})
+    assert response.headers["content-encoding"] == "gzip"
+    # decoded by the client
+    assert response.content == BUNDLE
+
+
+def test_serves_identity_without_accepted_encoding(static_client):
+    response = static_client.get("/static/js/index.js", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in response.headers
+    assert response.content == BUNDLE
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert response.headers["cache-control"] == "no-cache"
+
+
+def test_etag_per_encoding_and_not_modified(static_client):
+    _, br_headers = get_headers(static_client, "/static/js/index.js", **{"Accept-Encoding": "br"})
+    identity = static_client.get("/static/js/index.js", headers={"Accept-Encoding": "identity"})
+    assert br_headers["etag"] != identity.headers["etag"]
+    response = static_client.get(
+        "/static/js/index.js", headers={"Accept-Encoding": "br", "If-None-Match": br_headers["etag"]}
+    )
+    assert response.status_code == 304
+    assert response.headers["vary"] == "Accept-Encoding"
+    response = static_client.get("/static/favicon.ico")
+    assert response.headers["cache-control"] == "no-cache"
+    assert "vary" not in response.headers
+    response = static_client.get("/static/favicon.ico", headers={"If-None-Match": response.headers["etag"]})
+    assert response.status_code == 304
+
+
+def test_stale_variant_is_not_served(static_client, tmp_path):
+    variant = tmp_path / "js" / "index.js.br"
+    os.utime(variant, (0, 0))
+    response = static_client.get("/static/js/index.js", headers={"Accept-Encoding": "br"})
+    assert "content-encoding" not in response.headers
+    assert response.content == BUNDLE
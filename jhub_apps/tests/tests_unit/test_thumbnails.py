@@ -0,0 +1,155 @@
+import asyncio
+import base64
+import io
+import sys
+import threading
+import tracemalloc
+from unittest.mock import patch
+
+import pytest
+from fastapi import UploadFile
+
+from jhub_apps.service import thumbnails
+from jhub_apps.service.thumbnails import (
+    MAX_THUMBNAIL_SIZE,
+    MAX_UPLOAD_REQUEST_SIZE,
+    UPLOAD_CHUNK_SIZE,
+    ThumbnailTooLarge,
+    image_media_type,
+    normalize_thumbnail,
+    read_upload,
+    store_thumbnail,
+)
+from jhub_apps.tests.common.images import png_image
+
+
+def test_normalize_thumbnail_without_pillow_keeps_the_image():
+    image = png_image(2000, 1000)
+    with patch.dict(sys.modules, {"PIL": None}):
+        normalized = normalize_thumbnail(image)
+    assert normalized.contents == image
+    assert normalized.placeholder is None
+
+
+def test_normalize_thumbnail_keeps_svg():
+    svg = b'<svg xmlns="http://www.w3.org/2000/svg" width="10" height="10"></svg>'
+    assert normalize_thumbnail(svg).contents == svg
+
+
+@pytest.mark.parametrize("image_format, media_type", [("webp", "image/webp"), ("jpeg", "image/jpeg")])
+def test_normalize_thumbnail_downscales_and_reencodes(image_format, media_type, monkeypatch):
+    Image = pytest.importorskip("PIL.Image")
+    from PIL import features
+    if image_format == "webp" and not features.check("webp"):
+        pytest.skip("Pillow built without WebP")
+    monkeypatch.setattr(thumbnails, "THUMBNAIL_FORMAT", image_format)
+    normalized = normalize_thumbnail(png_image(2000, 1000))
+    assert image_media_type(normalized.contents[:16]) == media_type
+    with Image.open(io.BytesIO(normalized.contents)) as image:
+        # fits in the card size, keeping the aspect ratio
+        assert image.size == (640, 320)
+    assert normalized.placeholder.startswith(f"data:image/{image_format};base64,")
+    placeholder = base64.b64decode(normalized.placeholder.split(",", 1)[1])
+    with Image.open(io.BytesIO(placeholder)) as image:
+        assert image.size == (16, 8)
+    assert len(normalized.placeholder) < 1024
+
+
+def test_normalize_thumbnail_rejects_invalid_image():
+    pytest.importorskip("PIL")
+    with pytest.raises(ValueError):
+        normalize_thumbnail(b"\x89PNG not really a png")
+
+
+def test_normalize_thumbnail_rejects_too_many_pixels(monkeypatch):
+    pytest.importorskip("PIL")
+    monkeypatch.setattr(thumbnails, "THUMBNAIL_MAX_PIXELS", 100)
+    with pytest.raises(ValueError, match="too large"):
+        normalize_thumbnail(png_image(20, 20))
+
+
+def test_store_thumbnail_runs_in_the_worker_pool(tmp_path, monkeypatch):
+    monkeypatch.setattr(thumbnails.thumbnail_store, "path", tmp_path)
+    normalize_threads = []
+
+    def normalize(contents):
+        normalize_threads.append(threading.current_thread().name)
+        return thumbnails.NormalizedThumbnail(contents, "data:image/webp;base64,")
+
+    monkeypatch.setattr(thumbnails, "normalize_thumbnail", normalize)
+    image = png_image(4, 4)
+    stored = asyncio.run(store_thumbnail(image))
+    assert normalize_threads[0].startswith("jhub-apps-thumbnails")
+    assert stored.placeholder == "data:image/webp;base64,"
+    digest = stored.url.rsplit("/", 1)[1]
+    assert thumbnails.thumbnail_store.get_path(digest).read_bytes() == image
+
+
+class GeneratedFile:
+    """File object of `size` bytes starting with a PNG signature, generated while being read."""
+
+    def __init__(self, size):
+        self.remaining = size
+        self.position = 0
+
+    def read(self, size=-1):
+        size = self.remaining if size < 0 else min(size, self.remaining)
+        self.remaining -= size
+        chunk = b"\x89PNG" + bytes(size - 4) if self.position == 0 else bytes(size)
+        self.position += size
+        return chunk
+
+
+def test_read_upload_rejects_oversized_upload_without_reading_it_whole():
+    upload = UploadFile(GeneratedFile(50 * 1024 * 1024))
+    with pytest.raises(ThumbnailTooLarge):
+        asyncio.run(read_upload(upload))
+    # stopped reading soon after the limit
+    assert upload.file.position <= MAX_THUMBNAIL_SIZE + UPLOAD_CHUNK_SIZE
+
+
+def test_read_upload_rejects_upload_of_known_size_before_reading():
+    upload = UploadFile(GeneratedFile(50 * 1024 * 1024), size=50 * 1024 * 1024)
+    with pytest.raises(ThumbnailTooLarge):
+        asyncio.run(read_upload(upload))
+    assert upload.file.position == 0
+
+
+def test_read_upload_rejects_non_image_from_first_chunk():
+    upload = UploadFile(io.BytesIO(b"#!/bin/sh" + bytes(10 * 1024 * 1024)))
+    with pytest.raises(ValueError, match="Invalid image format"):
+        asyncio.run(read_upload(upload))
+    assert upload.file.tell() == UPLOAD_CHUNK_SIZE
+
+
+def test_read_upload_peak_memory_during_concurrent_burst():
+    concurrent_uploads = 16
+    upload_size = 40 * 1024 * 1024
+
+    async def burst():
+        uploads = [UploadFile(GeneratedFile(upload_size)) for _ in range(concurrent_uploads)]
+        return await asyncio.gather(*(read_upload(upload) for upload in uploads), return_exceptions=True)
+
+    tracemalloc.start()
+    try:
+        results = asyncio.run(burst())
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert all(isinstance(result, ThumbnailTooLarge) for result in results)
+    # at most one buffer of MAX_THUMBNAIL_SIZE (and its over-allocation) per upload,
+    # where reading the uploads whole would take concurrent_uploads * upload_size
+    assert peak < concurrent_uploads * MAX_THUMBNAIL_SIZE * 1.5
+    assert peak < concurrent_uploads * upload_size / 4
+
+
+def test_oversized_multipart_request_is_rejected_before_being_read(client):
+    response = client.post(
+        "/server",
+        content=b"",
+        headers={
+            "content-type": "multipart/form-data; boundary=x",
+            "content-length": str(MAX_UPLOAD_REQUEST_SIZE + 1),
+        },
+    )
+    assert response.status_code == 413
@@ -0,0 +1,76 @@
+import asyncio
+import os
+from unittest.mock import Mock, patch
+
+import pytest
+
+from jhub_apps.service.utils import JupyterHubConfigCache
+
+
+@pytest.fixture
+def config_file(tmp_path, monkeypatch):
+    path = tmp_path / "jupyterhub_config.py"
+    path.write_text("c.JAppsConfig.app_title = 'Apps'\n")
+    monkeypatch.setenv("JHUB_JUPYTERHUB_CONFIG", str(path))
+    return path
+
+
+@patch("jhub_apps.service.utils._load_jupyterhub_config")
+def test_jupyterhub_config_is_reloaded_when_file_changes(load_config, config_file):
+    load_config.side_effect = lambda path: Mock(loaded_from=open(path).read())
+    config_cache = JupyterHubConfigCache(ttl=3600, check_interval=0)
+    config = config_cache.get()
+    assert config_cache.get() is config
+    # touched, content unchanged
+    os.utime(config_file, ns=(1, 1))
+    assert config_cache.get() is config
+    assert load_config.call_count == 1
+
+    config_file.write_text("c.JAppsConfig.app_title = 'My Apps'\n")
+    new_config = config_cache.get()
+    assert new_config.loaded_from == "c.JAppsConfig.app_title = 'My Apps'\n"
+    assert config_cache.get() is new_config
+    assert load_config.call_count == 2
+    assert config_cache.stats()["loads"] == 2
+    assert config_cache.stats()["last_load_duration"] is not None
+
+
+@patch("jhub_apps.service.utils._load_jupyterhub_config")
+def test_jupyterhub_config_file_is_checked_at_most_every_interval(load_config, config_file):
+    config_cache = JupyterHubConfigCache(ttl=3600, check_interval=3600)
+    config_cache.get()
+    config_file.write_text("c.JAppsConfig.app_title = 'My Apps'\n")
+    config_cache.get()
+    assert load_config.call_count == 1
+    assert config_cache.file_changed()
+
+
+@patch("jhub_apps.service.utils._load_jupyterhub_config")
+def test_jupyterhub_config_is_not_reloaded_by_requests_when_refreshed_in_background(load_config, config_file):
+    # always expired and checked
+    config_cache = JupyterHubConfigCache(ttl=0, check_interval=0)
+
+    async def main():
+        refresh_task = asyncio.create_task(config_cache.refresh_periodically())
+        # the first request loads the config, there is none yet
+        config_cache.get()
+        await asyncio.sleep(0)
+        config_file.write_text("c.JAppsConfig.app_title = 'My Apps'\n")
+        with patch.object(config_cache, "load") as load:
+            assert config_cache.get() is config_cache.config
+            load.assert_not_called()
+        refresh_task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await refresh_task
+
+    asyncio.run(main())
+    assert load_config.call_count >= 2
+    assert not config_cache._refreshed_in_background
+
+
+@patch("jhub_apps.service.utils._load_jupyterhub_config")
+def test_jupyterhub_config_is_reloaded_when_expired(load_config, config_file):
+    config_cache = JupyterHubConfigCache(ttl=0, check_interval=3600)
+    config_cache.get()
+    config_cache.get()
+    assert load_config.call_count == 2
@@ -5,3 +5,6 @@ cp dist/assets/index-*.css dist/assets/index.css
 # Copy assets to jhub_apps static folder
 cp -r dist/assets/index.js ../jhub_apps/static/js
 cp -r dist/assets/index.css ../jhub_apps/static/css
+
+# Precompressed variants of the assets
+node compress-assets.mjs
@@ -0,0 +1,24 @@
+// Writes gzip (.gz) and brotli (.br) variants of the UI bundles next to them,
+// served by the JHub Apps service according to the Accept-Encoding of the browser.
+import { readFileSync, writeFileSync } from 'fs';
+import { brotliCompressSync, constants, gzipSync } from 'zlib';
+
+const ASSETS = [
+  '../jhub_apps/static/js/index.js',
+  '../jhub_apps/static/css/index.css',
+];
+
+for (const asset of ASSETS) {
+  const contents = readFileSync(asset);
+  // Both are deterministic, the variants only change with the bundles
+  writeFileSync(`${asset}.gz`, gzipSync(contents, { level: 9 }));
+  writeFileSync(
+    `${asset}.br`,
+    brotliCompressSync(contents, {
+      params: {
+        [constants.BROTLI_PARAM_QUALITY]: constants.BROTLI_MAX_QUALITY,
+        [constants.BROTLI_PARAM_SIZE_HINT]: contents.length,
+      },
+    }),
+  );
+}